@@ -1,30 +1,220 @@
 """
 FrameAnalysis の時系列から異常っぽい区間を検出するモジュール。
 ベースではルールベースで良く、あとから LLM を組み込んでもOK。
+
+フレーム単位のヒットは AlertAggregator で区間にまとめる。
+ストリーミング（1パス）で動くので、ライブ映像にもそのまま使える。
 """
 
 from __future__ import annotations
 
-from typing import List
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
 
 import importlib
 import paths
 import schemas
 import jsonl_io
+import config_loader
 
 importlib.reload(paths)
 importlib.reload(schemas)
 importlib.reload(jsonl_io)
+importlib.reload(config_loader)
 
-from paths import get_analysis_path
+from paths import get_analysis_path, get_audio_alerts_path
 from schemas import FrameAnalysis, AlertEvent
 from jsonl_io import read_jsonl_as_dataclasses
+from config_loader import SETTINGS
+
+
+ALERT_KEYWORDS = ["泣", "転ぶ", "危ない", "暴れる"]
+
+
+def match_alert_keywords(fa: FrameAnalysis) -> Dict[str, str]:
+    """
+    1フレーム分のルール判定。
+    戻り値: {キーワード: 理由テキスト}（ヒットしなければ空 dict）
+    """
+    return {
+        k: f"keyword in caption: {fa.caption}"
+        for k in ALERT_KEYWORDS
+        if k in fa.caption
+    }
+
+
+@dataclass
+class _OpenInterval:
+    """集約中（まだ閉じていない）区間の状態。"""
+    key: str
+    reason: str
+    start_time_sec: float
+    last_hit_sec: float
+    hits: int = 1
+    misses: int = 0
+    observed: int = 1                 # 区間開始から最後のヒットまでの観測数
+    frames: List[int] = field(default_factory=list)
+    announced: bool = False           # emit_on_enter で開始通知済みか
+
+
+class AlertAggregator:
+    """
+    フレーム単位のヒットを、ギャップ許容とヒステリシス付きで区間にまとめる。
+
+    - 同じキーのヒットが gap_tolerance_sec 以内に続く限り1つの区間として延長する
+    - enter_hits 回ヒットするまでは区間を確定しない（単発ノイズの抑制）
+    - exit_misses 回連続でヒットしなければ区間を閉じる
+    - 継続時間やヒット密度に応じて level を warning → critical に昇格する
+
+    保持するのはキーごとの開いた区間だけなので、メモリは O(開いている区間数)。
+
+    emit_on_enter=True のときは、区間が確定した時点で extra["state"] == "open" の
+    AlertEvent を先に返す（ライブ監視で区間の終了を待たずに通知するため）。
+    区間が閉じたときの AlertEvent は extra["state"] == "closed" になる。
+    """
+
+    def __init__(
+        self,
+        video_id: str,
+        gap_tolerance_sec: Optional[float] = None,
+        enter_hits: Optional[int] = None,
+        exit_misses: Optional[int] = None,
+        critical_duration_sec: Optional[float] = None,
+        critical_density: Optional[float] = None,
+        critical_min_hits: Optional[int] = None,
+        emit_on_enter: bool = False,
+    ) -> None:
+        self.video_id = video_id
+        self.emit_on_enter = emit_on_enter
+        self.gap_tolerance_sec = (
+            SETTINGS.alert_gap_tolerance_sec if gap_tolerance_sec is None else gap_tolerance_sec
+        )
+        self.enter_hits = SETTINGS.alert_enter_hits if enter_hits is None else enter_hits
+        self.exit_misses = SETTINGS.alert_exit_misses if exit_misses is None else exit_misses
+        self.critical_duration_sec = (
+            SETTINGS.alert_critical_duration_sec
+            if critical_duration_sec is None
+            else critical_duration_sec
+        )
+        self.critical_density = (
+            SETTINGS.alert_critical_density if critical_density is None else critical_density
+        )
+        self.critical_min_hits = (
+            SETTINGS.alert_critical_min_hits if critical_min_hits is None else critical_min_hits
+        )
+        self._open: Dict[str, _OpenInterval] = {}
+
+    def push_hits(
+        self,
+        time_sec: float,
+        hits: Dict[str, str],
+        frame_index: Optional[int] = None,
+    ) -> List[AlertEvent]:
+        """
+        1観測分のヒット（{キー: 理由}）を投入し、この時点で発行された AlertEvent を返す。
+        frame_index が None の観測（音声窓など）は related_frames に含めない。
+        """
+        emitted: List[AlertEvent] = []
+
+        # ヒットしなかった開区間はミスとして数え、条件を満たせば閉じる
+        for key in list(self._open):
+            if key in hits:
+                continue
+            iv = self._open[key]
+            iv.misses += 1
+            if (
+                iv.misses >= self.exit_misses
+                or time_sec - iv.last_hit_sec > self.gap_tolerance_sec
+            ):
+                emitted.extend(self._close(key))
+
+        for key, reason in hits.items():
+            iv = self._open.get(key)
+            if iv is not None and time_sec - iv.last_hit_sec > self.gap_tolerance_sec:
+                emitted.extend(self._close(key))
+                iv = None
+
+            if iv is None:
+                iv = _OpenInterval(
+                    key=key,
+                    reason=reason,
+                    start_time_sec=time_sec,
+                    last_hit_sec=time_sec,
+                )
+                self._open[key] = iv
+            else:
+                iv.observed += iv.misses + 1
+                iv.hits += 1
+                iv.misses = 0
+                iv.last_hit_sec = time_sec
+
+            if frame_index is not None:
+                iv.frames.append(frame_index)
+
+            if self.emit_on_enter and not iv.announced and iv.hits >= self.enter_hits:
+                iv.announced = True
+                emitted.append(self._to_event(iv, state="open"))
+
+        return emitted
+
+    def push(self, fa: FrameAnalysis) -> List[AlertEvent]:
+        """FrameAnalysis を1件投入する（ルール判定 + 集約）。"""
+        return self.push_hits(fa.time_sec, match_alert_keywords(fa), fa.frame_index)
+
+    def flush(self) -> List[AlertEvent]:
+        """ストリーム終端で、開いている区間をすべて閉じる。"""
+        closed: List[AlertEvent] = []
+        for key in list(self._open):
+            closed.extend(self._close(key))
+        closed.sort(key=lambda ev: ev.start_time_sec)
+        return closed
+
+    def _level_for(self, iv: _OpenInterval) -> str:
+        duration = iv.last_hit_sec - iv.start_time_sec
+        density = iv.hits / max(iv.observed, 1)
+        if duration >= self.critical_duration_sec:
+            return "critical"
+        if iv.hits >= self.critical_min_hits and density >= self.critical_density:
+            return "critical"
+        return "warning"
+
+    def _close(self, key: str) -> List[AlertEvent]:
+        iv = self._open.pop(key)
+        if iv.hits < self.enter_hits:
+            return []
+        return [self._to_event(iv, state="closed")]
+
+    def _to_event(self, iv: _OpenInterval, state: str) -> AlertEvent:
+        duration = iv.last_hit_sec - iv.start_time_sec
+        density = iv.hits / max(iv.observed, 1)
+        if iv.hits > 1:
+            reason = f"{iv.reason} (他 {iv.hits - 1} フレーム, {duration:.1f} 秒間)"
+        else:
+            reason = iv.reason
+
+        return AlertEvent(
+            video_id=self.video_id,
+            start_time_sec=iv.start_time_sec,
+            end_time_sec=iv.last_hit_sec,
+            level=self._level_for(iv),
+            reason=reason,
+            related_frames=list(iv.frames),
+            extra={
+                "key": iv.key,
+                "state": state,
+                "hit_count": iv.hits,
+                "observed_frames": iv.observed,
+                "density": round(density, 3),
+                "duration_sec": round(duration, 3),
+            },
+        )
 
 
 def detect_simple_alerts(video_id: str) -> List[AlertEvent]:
     """
     非常にシンプルなルールベースの異常検知例。
-    - caption や tags に「泣く」「転ぶ」などのキーワードがある場合にフラグ
+    - caption に「泣く」「転ぶ」などのキーワードがある場合にフラグ
+    - 近接するヒットは AlertAggregator で1つの区間にまとめる
     TODO: 実際のルールはチームで設計して差し替え。
     """
     analysis_path = get_analysis_path(video_id)
@@ -34,19 +224,27 @@ def detect_simple_alerts(video_id: str) -> List[AlertEvent]:
         print(f"No analysis found: {analysis_path}")
         return []
 
-    keywords = ["泣", "転ぶ", "危ない", "暴れる"]
+    aggregator = AlertAggregator(video_id)
     events: List[AlertEvent] = []
 
-    for fa in frames:
-        if any(k in fa.caption for k in keywords):
-            ev = AlertEvent(
-                video_id=fa.video_id,
-                start_time_sec=fa.time_sec,
-                end_time_sec=fa.time_sec,
-                level="warning",
-                reason=f"keyword in caption: {fa.caption}",
-                related_frames=[fa.frame_index],
-            )
-            events.append(ev)
+    for fa in sorted(frames, key=lambda f: f.time_sec):
+        events.extend(aggregator.push(fa))
+    events.extend(aggregator.flush())
+
+    events.sort(key=lambda ev: ev.start_time_sec)
+    return events
+
 
+def collect_alerts(video_id: str) -> List[AlertEvent]:
+    """
+    画像（caption）から検出したアラートと、audio ステージが書いた音声のアラート
+    （analysis/{video_id}_audio_alerts.jsonl）をまとめて時刻順に返す。extra["source"] が "visual" / "audio"。
+    """
+    events = detect_simple_alerts(video_id)
+    for ev in events:
+        ev.extra.setdefault("source", "visual")
+    audio_path = get_audio_alerts_path(video_id)
+    if audio_path.exists():
+        events.extend(read_jsonl_as_dataclasses(audio_path, AlertEvent))
+    events.sort(key=lambda ev: ev.start_time_sec)
     return events
@@ -0,0 +1,213 @@
+"""
+動画の音声トラックから「大きな音」「泣き声らしい音」の区間を検出するモジュール。
+
+- ffmpeg で音声をモノラル 16bit PCM として取り出し、NumPy 配列にする
+- 窓ごとの RMS とスペクトル特徴（泣き声帯域のエネルギー比・スペクトル平坦度・重心）をベクトル演算で計算
+- 該当区間を AlertEvent にまとめ、frame_extractor に渡す「密に切り出す区間」としても使う
+
+Vision 解析より桁違いに安いので、全フレームを LLM に投げなくてもイベントを拾える。
+"""
+
+from __future__ import annotations
+
+import math
+import subprocess
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np  # type: ignore
+
+import importlib
+import config_loader
+import paths
+import schemas
+import jsonl_io
+import alert_analyzer
+
+importlib.reload(config_loader)
+importlib.reload(paths)
+importlib.reload(schemas)
+importlib.reload(jsonl_io)
+importlib.reload(alert_analyzer)
+
+from config_loader import SETTINGS
+from paths import get_raw_video_path, get_audio_alerts_path
+from schemas import AlertEvent
+from jsonl_io import write_jsonl
+from alert_analyzer import AlertAggregator
+
+
+CRY_BAND_HZ = (300.0, 3500.0)
+CRY_CENTROID_HZ = (400.0, 3000.0)
+
+# 一度に FFT する窓数（長時間動画でもメモリを一定に抑える）
+_WINDOW_BLOCK = 1024
+
+
+def extract_audio(video_path: Path, sample_rate: Optional[int] = None) -> np.ndarray:
+    """
+    ffmpeg で音声トラックをモノラル PCM として取り出し、int16 の 1次元配列で返す。
+    音声トラックが無い動画では空配列を返す。
+    """
+    sr = sample_rate or SETTINGS.audio_sample_rate
+    cmd = [
+        "ffmpeg", "-nostdin", "-v", "error",
+        "-i", str(video_path),
+        "-vn", "-ac", "1", "-ar", str(sr),
+        "-f", "s16le", "-",
+    ]
+    try:
+        proc = subprocess.run(cmd, capture_output=True, check=False)
+    except FileNotFoundError as e:
+        raise RuntimeError("ffmpeg が見つかりません。音声解析には ffmpeg が必要です。") from e
+
+    if proc.returncode != 0:
+        err = proc.stderr.decode("utf-8", errors="replace")
+        if "does not contain any stream" in err or "matches no streams" in err:
+            return np.zeros(0, dtype=np.int16)
+        raise RuntimeError(f"ffmpeg audio extraction failed: {err.strip()}")
+
+    return np.frombuffer(proc.stdout, dtype=np.int16)
+
+
+def compute_audio_features(
+    pcm: np.ndarray,
+    sample_rate: int,
+    window_sec: float,
+    hop_sec: float,
+) -> dict:
+    """
+    窓ごとの特徴量をまとめて計算する。
+    戻り値: {"time_sec", "rms_db", "cry_band_ratio", "flatness", "centroid_hz"}（いずれも窓数の配列）
+    """
+    win = max(int(round(window_sec * sample_rate)), 16)
+    hop = max(int(round(hop_sec * sample_rate)), 1)
+    if pcm.size < win:
+        empty = np.zeros(0, dtype=np.float32)
+        return {k: empty for k in ("time_sec", "rms_db", "cry_band_ratio", "flatness", "centroid_hz")}
+
+    # コピー無しの窓ビュー（n_windows × win）
+    windows = np.lib.stride_tricks.sliding_window_view(pcm, win)[::hop]
+    n = windows.shape[0]
+
+    freqs = np.fft.rfftfreq(win, d=1.0 / sample_rate)
+    band = (freqs >= CRY_BAND_HZ[0]) & (freqs <= CRY_BAND_HZ[1])
+    taper = np.hanning(win).astype(np.float32)
+
+    rms_db = np.empty(n, dtype=np.float32)
+    band_ratio = np.empty(n, dtype=np.float32)
+    flatness = np.empty(n, dtype=np.float32)
+    centroid = np.empty(n, dtype=np.float32)
+
+    for s in range(0, n, _WINDOW_BLOCK):
+        block = windows[s:s + _WINDOW_BLOCK].astype(np.float32) / 32768.0
+
+        rms = np.sqrt(np.mean(block * block, axis=1))
+        rms_db[s:s + len(block)] = 20.0 * np.log10(rms + 1e-10)
+
+        power = np.abs(np.fft.rfft(block * taper, axis=1)) ** 2 + 1e-12
+        total = power.sum(axis=1)
+        band_ratio[s:s + len(block)] = power[:, band].sum(axis=1) / total
+        flatness[s:s + len(block)] = np.exp(np.mean(np.log(power), axis=1)) / np.mean(power, axis=1)
+        centroid[s:s + len(block)] = (power * freqs).sum(axis=1) / total
+
+    return {
+        "time_sec": np.arange(n, dtype=np.float32) * (hop / sample_rate),
+        "rms_db": rms_db,
+        "cry_band_ratio": band_ratio,
+        "flatness": flatness,
+        "centroid_hz": centroid,
+    }
+
+
+def classify_windows(features: dict) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    窓ごとに (大きな音, 泣き声らしい音) の bool 配列を返す。
+    「大きな音」の閾値は動画全体の中央値からの相対値と絶対下限の大きい方。
+    """
+    rms_db = features["rms_db"]
+    if rms_db.size == 0:
+        empty = np.zeros(0, dtype=bool)
+        return empty, empty
+
+    threshold = max(float(np.median(rms_db)) + SETTINGS.audio_loud_margin_db, SETTINGS.audio_min_loud_db)
+    loud = rms_db >= threshold
+
+    centroid = features["centroid_hz"]
+    cry = (
+        loud
+        & (features["cry_band_ratio"] >= SETTINGS.audio_cry_band_ratio)
+        & (features["flatness"] <= SETTINGS.audio_cry_max_flatness)
+        & (centroid >= CRY_CENTROID_HZ[0])
+        & (centroid <= CRY_CENTROID_HZ[1])
+    )
+    return loud, cry
+
+
+def detect_audio_alerts(video_id: str) -> List[AlertEvent]:
+    """
+    raw_videos/{video_id} の音声から大きな音・泣き声らしい区間を検出し、
+    analysis/{video_id}_audio_alerts.jsonl に保存して返す。
+    """
+    video_path = get_raw_video_path(video_id)
+    if not video_path.exists():
+        raise FileNotFoundError(f"Video not found: {video_path}")
+
+    sr = SETTINGS.audio_sample_rate
+    pcm = extract_audio(video_path, sr)
+    if pcm.size == 0:
+        print(f"No audio track: {video_path}")
+        write_jsonl(get_audio_alerts_path(video_id), [])
+        return []
+
+    window_sec = SETTINGS.audio_window_sec
+    hop_sec = SETTINGS.audio_hop_sec
+    features = compute_audio_features(pcm, sr, window_sec, hop_sec)
+    loud, cry = classify_windows(features)
+
+    # 窓単位のヒットを AlertAggregator で区間化する（related_frames は空のまま）
+    aggregator = AlertAggregator(
+        video_id,
+        gap_tolerance_sec=SETTINGS.audio_gap_sec,
+        enter_hits=max(int(math.ceil(SETTINGS.audio_min_event_sec / hop_sec)), 1),
+        exit_misses=max(int(math.ceil(SETTINGS.audio_gap_sec / hop_sec)), 1),
+    )
+    events: List[AlertEvent] = []
+    times = features["time_sec"]
+    for i in range(times.size):
+        hits = {}
+        if cry[i]:
+            hits["audio_cry"] = "音声: 泣き声らしい音"
+        elif loud[i]:
+            hits["audio_loud"] = "音声: 大きな音"
+        events.extend(aggregator.push_hits(float(times[i]), hits))
+    events.extend(aggregator.flush())
+
+    for ev in events:
+        ev.end_time_sec = ev.end_time_sec + window_sec
+        ev.extra["source"] = "audio"
+    events.sort(key=lambda ev: ev.start_time_sec)
+
+    write_jsonl(get_audio_alerts_path(video_id), events)
+    return events
+
+
+def alerts_to_focus_segments(
+    events: List[AlertEvent],
+    padding_sec: Optional[float] = None,
+) -> List[Tuple[float, float]]:
+    """
+    AlertEvent の区間に前後の余白を足し、重なりをマージした (start, end) のリストを返す。
+    frame_extractor.extract_frames(focus_segments=...) にそのまま渡せる。
+    """
+    pad = SETTINGS.audio_focus_padding_sec if padding_sec is None else padding_sec
+    spans = sorted(
+        (max(ev.start_time_sec - pad, 0.0), ev.end_time_sec + pad) for ev in events
+    )
+    merged: List[Tuple[float, float]] = []
+    for start, end in spans:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
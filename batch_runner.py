@@ -0,0 +1,320 @@
+"""
+複数の動画をまとめて処理するコマンドライン用バッチランナー（Streamlit を使わない）。
+
+- ディレクトリ / glob / ファイルパスで動画を指定し、プロセスプールで並列にパイプラインを実行する
+- LLM API の同時呼び出し数は、全プロセス共通の Semaphore（batch.api_concurrency）で制限する
+- video_id はファイル名から決める（同じファイルを再実行すると pipeline のキャッシュが効き、途中から再開できる）
+- 取り込み済みの動画と同じ内容のファイル（別名・別フォルダのコピー）は、取り込み済みの video_id で処理する。
+  バッチ内の同じ内容のファイルは1本だけ処理し、残りは結果に duplicate として記録する
+- 1本ごとの進捗と合計を表示し、結果を runs/_batches/{batch_id}.json に保存する
+- 1本でも失敗したら終了コード 1（動画が見つからなければ 2）
+
+実行例:
+    python batch_runner.py /mnt/camera/2024-05 --workers 4 --api-concurrency 8
+    python batch_runner.py "footage/*.mp4" --targets bestshots
+"""
+
+from __future__ import annotations
+
+import argparse
+import glob
+import json
+import multiprocessing
+import re
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import importlib
+import config_loader
+import paths
+
+importlib.reload(config_loader)
+importlib.reload(paths)
+
+from config_loader import SETTINGS
+from paths import get_batch_report_path
+
+
+VIDEO_SUFFIXES = {".mp4", ".mov", ".avi", ".mkv"}
+
+_VIDEO_ID_UNSAFE = re.compile(r"[^0-9A-Za-z_.-]+")
+
+
+def find_videos(inputs: Sequence[str]) -> List[Path]:
+    """ディレクトリ（再帰）/ glob / ファイルパスから動画ファイルを集める（重複除去・パス順）。"""
+    found = set()
+    for item in inputs:
+        p = Path(item)
+        if p.is_dir():
+            candidates = [c for c in p.rglob("*") if c.is_file()]
+        elif p.is_file():
+            candidates = [p]
+        else:
+            candidates = [Path(c) for c in glob.glob(item, recursive=True)]
+        for c in candidates:
+            if c.suffix.lower() in VIDEO_SUFFIXES:
+                found.add(c.resolve())
+    return sorted(found)
+
+
+def assign_video_ids(videos: Sequence[Path], prefix: str = "") -> List[Tuple[Path, str]]:
+    """
+    ファイル名から video_id を決める。別ディレクトリに同じ名前がある場合は親ディレクトリ名を前に付ける。
+    """
+    def base(p: Path) -> str:
+        return _VIDEO_ID_UNSAFE.sub("_", p.stem)
+
+    counts: Dict[str, int] = {}
+    for v in videos:
+        counts[base(v)] = counts.get(base(v), 0) + 1
+
+    out: List[Tuple[Path, str]] = []
+    used = set()
+    for v in videos:
+        vid = base(v)
+        if counts[vid] > 1:
+            vid = f"{_VIDEO_ID_UNSAFE.sub('_', v.parent.name)}_{vid}"
+        n = 2
+        unique = vid
+        while unique in used:
+            unique = f"{vid}_{n}"
+            n += 1
+        used.add(unique)
+        out.append((v, f"{prefix}{unique}"))
+    return out
+
+
+def _init_worker(api_semaphore: Any) -> None:
+    """
+    ワーカープロセスの初期化。パイプライン一式を import してから（import 時の reload で
+    モジュール変数が初期化されるため）、全プロセス共通の API Semaphore を設定する。
+    """
+    import pipeline  # noqa: F401
+    import model_loader
+
+    model_loader.set_api_limiter(api_semaphore)
+
+
+def split_duplicates(jobs: Sequence[Tuple[Path, str]]) -> Tuple[List[Tuple[Path, str]], List[Dict[str, Any]]]:
+    """
+    バッチ内で同じ内容のファイルを1本にまとめる（並列に取り込むと、互いに取り込み済みと気づけないため）。
+    同じサイズのファイルがあるときだけ内容ハッシュを比べる。
+    戻り値: (処理する jobs, 重複として飛ばしたファイルの結果)
+    """
+    from video_loader import file_sha256
+
+    by_size: Dict[int, List[Tuple[Path, str]]] = {}
+    for src, vid in jobs:
+        by_size.setdefault(src.stat().st_size, []).append((src, vid))
+
+    duplicate_of: Dict[str, str] = {}
+    for group in by_size.values():
+        if len(group) < 2:
+            continue
+        first_by_digest: Dict[str, str] = {}
+        for src, vid in group:
+            digest = file_sha256(src)
+            if digest in first_by_digest:
+                duplicate_of[vid] = first_by_digest[digest]
+            else:
+                first_by_digest[digest] = vid
+
+    unique = [(src, vid) for src, vid in jobs if vid not in duplicate_of]
+    skipped = [
+        {"source": str(src), "video_id": vid, "status": "duplicate", "duplicate_of": duplicate_of[vid], "elapsed_sec": 0.0}
+        for src, vid in jobs
+        if vid in duplicate_of
+    ]
+    return unique, skipped
+
+
+def _process_video(
+    src: str,
+    video_id: str,
+    targets: Optional[List[str]],
+    force: bool,
+    captioning_mode: Optional[str],
+    profile: Optional[bool] = None,
+    batch_video_ids: frozenset = frozenset(),
+) -> Dict[str, Any]:
+    """
+    ワーカープロセス側: 1本の動画を取り込んでパイプラインを実行する。例外は結果に詰めて返す。
+    取り込み済みの動画と同じ内容なら、その video_id でパイプラインを実行する（結果の duplicate_of に記録）。
+    その video_id がこのバッチでも処理される場合は、同じ成果物を取り合わないよう duplicate として飛ばす。
+    """
+    import pipeline
+    import video_loader
+
+    started = time.perf_counter()
+    result: Dict[str, Any] = {"source": src, "video_id": video_id}
+    try:
+        imported_id = video_loader.import_video(src, video_id)
+        if imported_id != video_id:
+            result["duplicate_of"] = imported_id
+            if imported_id in batch_video_ids:
+                result["status"] = "duplicate"
+                result["elapsed_sec"] = round(time.perf_counter() - started, 3)
+                return result
+        report = pipeline.run_pipeline(
+            imported_id,
+            targets=targets,
+            force=force,
+            captioning_mode=captioning_mode,
+            profile=profile,
+        )
+        result.update(
+            {
+                "status": "ok",
+                "hits": report["hits"],
+                "misses": report["misses"],
+                "stages": report["stages"],
+            }
+        )
+    except Exception as e:  # 1本の失敗でバッチ全体を止めない
+        result.update(
+            {
+                "status": "failed",
+                "error": f"{type(e).__name__}: {e}",
+                "traceback": traceback.format_exc(),
+            }
+        )
+    result["elapsed_sec"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def run_batch(
+    jobs: Sequence[Tuple[Path, str]],
+    workers: Optional[int] = None,
+    api_concurrency: Optional[int] = None,
+    targets: Optional[List[str]] = None,
+    force: bool = False,
+    captioning_mode: Optional[str] = None,
+    profile: Optional[bool] = None,
+) -> Dict[str, Any]:
+    """
+    jobs（(動画パス, video_id) のリスト）をプロセスプールで処理し、バッチ全体の報告を返す。
+    """
+    workers = max(workers or SETTINGS.batch_workers, 1)
+    api_concurrency = max(api_concurrency or SETTINGS.batch_api_concurrency, 1)
+
+    batch_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+    api_semaphore = multiprocessing.BoundedSemaphore(api_concurrency)
+    total = len(jobs)
+    started = time.perf_counter()
+
+    print(f"Batch {batch_id}: {total} videos, {workers} workers, API concurrency {api_concurrency}")
+    jobs, results = split_duplicates(jobs)
+    batch_video_ids = frozenset(vid for _, vid in jobs)
+    for i, r in enumerate(results, 1):
+        print(f"[{i}/{total}] DUPLICATE {r['video_id']} 0.0s - same as {r['duplicate_of']}")
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(api_semaphore,),
+    ) as pool:
+        futures = {
+            pool.submit(
+                _process_video, str(src), vid, targets, force, captioning_mode, profile, batch_video_ids
+            ): vid
+            for src, vid in jobs
+        }
+        try:
+            for fut in as_completed(futures):
+                r = fut.result()
+                results.append(r)
+                if r["status"] == "ok":
+                    detail = f"{r['hits']} hit / {r['misses']} miss"
+                    if "duplicate_of" in r:
+                        detail += f" (as {r['duplicate_of']})"
+                elif r["status"] == "duplicate":
+                    detail = f"same as {r['duplicate_of']}"
+                else:
+                    detail = r["error"]
+                print(
+                    f"[{len(results)}/{total}] {r['status'].upper():<6} {r['video_id']} "
+                    f"{r['elapsed_sec']:.1f}s - {detail}"
+                )
+        except KeyboardInterrupt:
+            print("[WARN] 中断しました。実行中の動画が終わるまで待ちます …")
+            pool.shutdown(wait=True, cancel_futures=True)
+            raise
+
+    failed = [r for r in results if r["status"] == "failed"]
+    duplicates = [r for r in results if r["status"] == "duplicate"]
+    report = {
+        "batch_id": batch_id,
+        "videos": total,
+        "succeeded": total - len(failed) - len(duplicates),
+        "duplicates": len(duplicates),
+        "failed": len(failed),
+        "workers": workers,
+        "api_concurrency": api_concurrency,
+        "elapsed_sec": round(time.perf_counter() - started, 3),
+        "results": sorted(results, key=lambda r: r["video_id"]),
+    }
+    get_batch_report_path(batch_id).write_text(
+        json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8"
+    )
+    return report
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="複数の動画をプロセスプールでまとめて処理する")
+    parser.add_argument("inputs", nargs="+", help="動画ファイル / ディレクトリ / glob（例: 'footage/**/*.mp4'）")
+    parser.add_argument("--workers", type=int, default=None, help="並列に処理する動画数（既定: batch.workers）")
+    parser.add_argument(
+        "--api-concurrency", type=int, default=None,
+        help="全プロセス合計の LLM API 同時呼び出し数（既定: batch.api_concurrency）",
+    )
+    parser.add_argument("--targets", nargs="*", default=None, help="pipeline のステージ名（省略時は全ステージ）")
+    parser.add_argument("--force", action="store_true", help="キャッシュを無視して全ステージを再実行する")
+    parser.add_argument("--captioning-mode", choices=["all", "candidates"], default=None)
+    parser.add_argument("--prefix", default="", help="video_id の先頭に付ける文字列")
+    parser.add_argument(
+        "--profile", action="store_true", default=None,
+        help="各動画の runs/{video_id}/profile/ にプロファイルを書く（遅くなるので調査用）",
+    )
+    args = parser.parse_args(argv)
+
+    if args.targets:
+        import pipeline
+
+        unknown = [t for t in args.targets if t not in pipeline.STAGE_NAMES]
+        if unknown:
+            parser.error(f"unknown stage(s): {unknown} (choose from {pipeline.STAGE_NAMES})")
+
+    videos = find_videos(args.inputs)
+    if not videos:
+        print(f"[WARN] 動画が見つかりませんでした: {args.inputs}")
+        return 2
+
+    report = run_batch(
+        assign_video_ids(videos, prefix=args.prefix),
+        workers=args.workers,
+        api_concurrency=args.api_concurrency,
+        targets=args.targets,
+        force=args.force,
+        captioning_mode=args.captioning_mode,
+        profile=args.profile,
+    )
+
+    print(
+        f"Done: {report['succeeded']}/{report['videos']} succeeded, "
+        f"{report['duplicates']} duplicates, {report['failed']} failed ({report['elapsed_sec']:.1f}s)"
+    )
+    for r in report["results"]:
+        if r["status"] == "failed":
+            print(f"  FAILED {r['video_id']} ({r['source']}): {r['error']}")
+        elif "duplicate_of" in r:
+            print(f"  SAME   {r['video_id']} ({r['source']}) -> {r['duplicate_of']}")
+    print(f"Report: {get_batch_report_path(report['batch_id'])}")
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,643 @@
+"""
+実映像も有料 API も使わずに、パイプラインの性能を再現性のある条件で測るベンチマーク。
+
+- cv2.VideoWriter で合成動画（長さ・解像度・fps を指定。シーン切り替えと動く物体入り）を作る
+- SambaNova / OpenAI 互換の chat completions API をまねるローカル HTTP モックサーバーを立てる
+  （応答遅延・ゆらぎ・エラー率・JSON が壊れる率を指定できる。stream=True にも対応）
+- ingest_video / extract_frames / preprocess_frames / run_captioning / select_bestshots / generate_diary を
+  ステージごとに計測し、commit・環境情報と一緒に outputs/benchmarks/*.json に保存する
+- compare サブコマンドで2つの結果をステージごとに比較する
+
+各ケースは一時ディレクトリ（config/settings.yaml, config/models.yaml を生成）を作業ディレクトリにした
+子プロセスで実行するので、手元の outputs や models.yaml には影響しない。
+
+実行例:
+    python benchmark.py run --durations 60 300 --resolutions 640x360 1280x720 --latency-ms 300
+    python benchmark.py run --backend dummy --repeat 3
+    python benchmark.py compare outputs/benchmarks/A.json outputs/benchmarks/B.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import cv2  # type: ignore
+import numpy as np  # type: ignore
+import yaml
+
+import importlib
+import config_loader
+import paths
+
+importlib.reload(config_loader)
+importlib.reload(paths)
+
+from paths import get_benchmarks_dir
+
+
+BENCHMARK_VERSION = 1
+REPO_DIR = Path(__file__).resolve().parent
+STAGES = ["ingest_video", "extract_frames", "preprocess_frames", "run_captioning", "select_bestshots", "generate_diary"]
+BENCH_VIDEO_ID = "bench"
+
+_MOCK_CAPTIONS = [
+    "室内の保育室で、男の子がブロックで遊んでいる。",
+    "屋外の園庭で、複数の子どもが滑り台で遊んでいる。",
+    "先生が絵本を読み聞かせしている。",
+    "子どもたちがテーブルで給食を食べている。",
+    "女の子が積み木を高く積み上げて笑っている。",
+]
+
+
+# ---------------------------------------------------------------------------
+# 合成動画
+# ---------------------------------------------------------------------------
+
+def make_synthetic_video(
+    path: Path,
+    duration_sec: float,
+    width: int,
+    height: int,
+    fps: float,
+    seed: int = 0,
+    scene_sec: float = 20.0,
+) -> Path:
+    """
+    scene_sec ごとに背景色が変わり、円と矩形が動き回る合成動画を書き出す（同じ seed なら同じ内容）。
+    ブレ・暗さ判定やベストショットの多様性選択がそれなりに働くよう、暗いシーンとノイズも混ぜる。
+    """
+    rng = np.random.default_rng(seed)
+    n_frames = int(round(duration_sec * fps))
+    n_scenes = max(int(np.ceil(duration_sec / scene_sec)), 1)
+    backgrounds = rng.integers(30, 225, size=(n_scenes, 3))
+    backgrounds[::4] //= 6  # 4シーンに1つは暗いシーン
+    noise = rng.integers(0, 24, size=(height, width, 3), dtype=np.uint8)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    if not writer.isOpened():
+        raise RuntimeError(f"Cannot open VideoWriter: {path}")
+
+    r = max(min(width, height) // 8, 4)
+    try:
+        for i in range(n_frames):
+            t = i / fps
+            scene = min(int(t // scene_sec), n_scenes - 1)
+            frame = np.empty((height, width, 3), dtype=np.uint8)
+            frame[:] = backgrounds[scene]
+            frame = cv2.add(frame, noise)
+
+            cx = int((0.5 + 0.4 * np.sin(t * 0.7 + scene)) * width)
+            cy = int((0.5 + 0.3 * np.cos(t * 1.1 + scene)) * height)
+            cv2.circle(frame, (cx, cy), r, (40, 200, 255), -1)
+            x0 = int((t * 37) % max(width - 2 * r, 1))
+            cv2.rectangle(frame, (x0, height - 3 * r), (x0 + 2 * r, height - r), (255, 120, 40), -1)
+            cv2.putText(
+                frame, f"{t:7.2f}", (8, max(height // 12, 16)),
+                cv2.FONT_HERSHEY_SIMPLEX, max(height / 720, 0.4), (255, 255, 255), 1,
+            )
+            writer.write(frame)
+    finally:
+        writer.release()
+    return path
+
+
+# ---------------------------------------------------------------------------
+# モック LLM サーバー（OpenAI 互換 chat completions）
+# ---------------------------------------------------------------------------
+
+class MockChatServer:
+    """
+    POST .../chat/completions に OpenAI 互換の応答を返すローカルサーバー。
+    - 画像（image_url）を含む要求には vision_caption 形式の JSON を、それ以外には日記風のテキストを返す
+    - latency_ms ± jitter_ms 待ってから応答する
+    - error_rate の確率で 500 / 429 を返す、malformed_rate の確率で壊れた JSON を返す
+    - 先頭の system メッセージが前に見たものと同じなら、その分を usage.prompt_tokens_details.cached_tokens に入れる
+      （プレフィックスキャッシュのあるサーバーの真似）
+    """
+
+    def __init__(
+        self,
+        latency_ms: float = 200.0,
+        jitter_ms: float = 50.0,
+        error_rate: float = 0.0,
+        malformed_rate: float = 0.0,
+        seed: int = 0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ) -> None:
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats: Dict[str, int] = {}
+        self._seen_prefixes: set = set()
+        self.reset_stats()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, fmt: str, *args: Any) -> None:  # アクセスログは出さない
+                pass
+
+            def do_POST(self) -> None:  # noqa: N802
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except json.JSONDecodeError:
+                    self._send_json(400, {"error": {"message": "invalid JSON"}})
+                    return
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+                    return
+                server._handle(self, body)
+
+            def _send_json(self, status: int, obj: Dict[str, Any]) -> None:
+                data = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockChatServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reset_stats(self) -> None:
+        with self.lock:
+            self.stats = {"requests": 0, "vision": 0, "text": 0, "stream": 0, "errors": 0, "malformed": 0}
+
+    def _bump(self, key: str) -> None:
+        with self.lock:
+            self.stats[key] += 1
+
+    def _draw(self) -> Tuple[float, float, float]:
+        with self.lock:
+            return self.rng.random(), self.rng.random(), self.rng.gauss(0.0, 1.0)
+
+    def _vision_content(self, malformed: bool) -> str:
+        with self.lock:
+            rng = random.Random(self.rng.random())
+        x0, y0 = rng.uniform(0.0, 0.6), rng.uniform(0.0, 0.6)
+        obj = {
+            "caption": rng.choice(_MOCK_CAPTIONS),
+            "tags": rng.sample(["室内", "屋外", "遊び", "笑顔", "先生", "給食", "絵本"], 3),
+            "scores": {
+                "cuteness": round(rng.random(), 3),
+                "interesting": round(rng.random(), 3),
+                "representative": round(rng.random(), 3),
+            },
+            "has_child": True,
+            "num_children": rng.randint(1, 4),
+            "main_subject": rng.choice(["男の子", "女の子", "複数の子ども", "先生"]),
+            "bbox": [round(x0, 3), round(y0, 3), round(x0 + 0.3, 3), round(y0 + 0.35, 3)],
+        }
+        text = json.dumps(obj, ensure_ascii=False)
+        return text[: len(text) // 2] if malformed else text
+
+    def _handle(self, handler: BaseHTTPRequestHandler, body: Dict[str, Any]) -> None:
+        self._bump("requests")
+        err_draw, malformed_draw, jitter = self._draw()
+        time.sleep(max(self.latency_ms + self.jitter_ms * jitter, 0.0) / 1000.0)
+
+        if err_draw < self.error_rate:
+            self._bump("errors")
+            status = 429 if err_draw < self.error_rate / 2 else 500
+            handler._send_json(status, {"error": {"message": "mock error", "code": status}})
+            return
+
+        messages = body.get("messages") or []
+        is_vision = any(
+            isinstance(part, dict) and part.get("type") == "image_url"
+            for m in messages
+            for part in (m.get("content") if isinstance(m.get("content"), list) else [])
+        )
+        prompt_chars = sum(len(json.dumps(m.get("content"), ensure_ascii=False)) for m in messages)
+        cached_chars = 0
+        if messages and messages[0].get("role") == "system":
+            prefix = json.dumps(messages[0].get("content"), ensure_ascii=False)
+            with self.lock:
+                if prefix in self._seen_prefixes:
+                    cached_chars = len(prefix)
+                self._seen_prefixes.add(prefix)
+        if is_vision:
+            self._bump("vision")
+            malformed = malformed_draw < self.malformed_rate
+            if malformed:
+                self._bump("malformed")
+            content = self._vision_content(malformed)
+        else:
+            self._bump("text")
+            content = "今日は朝からブロック遊びや外遊びを楽しみ、給食もしっかり食べました。" * 4
+
+        usage = {
+            "prompt_tokens": prompt_chars // 4,
+            "completion_tokens": len(content),
+            "total_tokens": prompt_chars // 4 + len(content),
+            "prompt_tokens_details": {"cached_tokens": cached_chars // 4},
+        }
+        model = body.get("model", "mock")
+        created = int(time.time())
+
+        if body.get("stream"):
+            self._bump("stream")
+            handler.send_response(200)
+            handler.send_header("Content-Type", "text/event-stream")
+            handler.end_headers()
+            for i in range(0, len(content), 16):
+                chunk = {
+                    "id": "mock", "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {"content": content[i:i + 16]}, "finish_reason": None}],
+                }
+                handler.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            if (body.get("stream_options") or {}).get("include_usage"):
+                # OpenAI 互換 API と同じく、choices が空でトークン数だけのチャンクを最後に送る
+                chunk = {
+                    "id": "mock", "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [], "usage": usage,
+                }
+                handler.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            handler.wfile.write(b"data: [DONE]\n\n")
+            return
+
+        handler._send_json(
+            200,
+            {
+                "id": "mock",
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [
+                    {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+                ],
+                "usage": usage,
+            },
+        )
+
+
+# ---------------------------------------------------------------------------
+# 計測（子プロセス側）
+# ---------------------------------------------------------------------------
+
+def _clear_outputs() -> None:
+    """
+    作業ディレクトリの outputs/ から、元動画（raw_videos/）以外の成果物を消す。
+    抽出済みフレーム・解析結果・日記の時間帯ごとの要約などが残っていると、2回目以降が温まったキャッシュの計測になるため。
+    """
+    from paths import get_data_root, get_raw_video_dir
+
+    # ディレクトリは残す（paths の各関数が作ったディレクトリを前提に書き込む処理があるため）
+    keep = get_raw_video_dir().resolve()
+    for p in get_data_root().rglob("*"):
+        if p.is_file() and keep not in p.resolve().parents:
+            p.unlink()
+
+
+def _run_stages(repeat: int, captioning_mode: str) -> Dict[str, Any]:
+    """
+    作業ディレクトリ（config/ がある一時ディレクトリ）で各ステージを repeat 回実行して計測する。
+    毎回成果物を消してから実行するので、どの回も同じ条件（キャッシュの無い状態）の計測になる。
+    import は作業ディレクトリの config/ を読ませるためにここで行う。
+    """
+    import instrumentation
+    from video_ingest import ingest_video
+    from frame_extractor import extract_frames
+    from frame_preprocessor import preprocess_frames
+    from manifest_builder import build_manifest
+    from vision_captioner import run_captioning
+    from bestshot_scorer import select_bestshots
+    from diary_generator import generate_diary
+
+    timings: Dict[str, List[float]] = {s: [] for s in STAGES}
+    counters: Dict[str, Dict[str, float]] = {}
+    frames = 0
+    for _ in range(repeat):
+        _clear_outputs()
+        run = instrumentation.start_run(BENCH_VIDEO_ID)
+        with instrumentation.span("ingest_video"):
+            ingest_video(BENCH_VIDEO_ID)
+        with instrumentation.span("extract_frames"):
+            metas = extract_frames(BENCH_VIDEO_ID)
+        with instrumentation.span("preprocess_frames"):
+            metas = preprocess_frames(metas)
+            build_manifest(BENCH_VIDEO_ID, metas)
+        with instrumentation.span("run_captioning"):
+            run_captioning(BENCH_VIDEO_ID, mode=captioning_mode)
+        with instrumentation.span("select_bestshots"):
+            select_bestshots(BENCH_VIDEO_ID)
+        with instrumentation.span("generate_diary"):
+            generate_diary(BENCH_VIDEO_ID)
+        report = instrumentation.end_run(run)
+
+        frames = len(metas)
+        for s in STAGES:
+            timings[s].append(report["stages"][s]["wall_sec"])
+        counters = {s: report["stages"][s].get("counters", {}) for s in STAGES}
+
+    return {"frames": frames, "timings": timings, "counters": counters}
+
+
+def _stats(values: Sequence[float]) -> Dict[str, Any]:
+    return {
+        "runs": [round(v, 6) for v in values],
+        "median": round(statistics.median(values), 6),
+        "min": round(min(values), 6),
+        "max": round(max(values), 6),
+    }
+
+
+# ---------------------------------------------------------------------------
+# 実行（親プロセス側）
+# ---------------------------------------------------------------------------
+
+def _git_info() -> Dict[str, Any]:
+    def git(*args: str) -> str:
+        return subprocess.run(
+            ["git", *args], cwd=REPO_DIR, capture_output=True, text=True, check=False
+        ).stdout.strip()
+
+    return {
+        "commit": git("rev-parse", "--short", "HEAD") or None,
+        "subject": git("log", "-1", "--format=%s") or None,
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+    }
+
+
+def _env_info() -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+    }
+
+
+def _write_workspace(
+    workspace: Path,
+    backend: str,
+    base_url: Optional[str],
+    frame_interval_sec: float,
+) -> None:
+    """作業ディレクトリに settings.yaml（手元の設定 + data_root 差し替え）と models.yaml を書く。"""
+    config_dir = workspace / "config"
+    config_dir.mkdir(parents=True, exist_ok=True)
+
+    settings = config_loader._safe_load_yaml(REPO_DIR / "config" / "settings.yaml")
+    settings["data_root"] = str(workspace / "outputs")
+    settings["frame_interval_sec"] = frame_interval_sec
+    settings.setdefault("audio", {})["enabled"] = False
+    (config_dir / "settings.yaml").write_text(
+        yaml.safe_dump(settings, allow_unicode=True, sort_keys=False), encoding="utf-8"
+    )
+
+    if backend == "mock":
+        role = {"backend": "sambanova", "model_name": "mock-model", "base_url": base_url}
+    else:
+        role = {"backend": "dummy"}
+    models = {
+        "vision_caption": dict(role, type="vision"),
+        "diary_writer": dict(role, type="text"),
+    }
+    (config_dir / "models.yaml").write_text(
+        yaml.safe_dump(models, allow_unicode=True, sort_keys=False), encoding="utf-8"
+    )
+
+
+def run_case(
+    duration_sec: float,
+    width: int,
+    height: int,
+    fps: float,
+    repeat: int,
+    backend: str,
+    server: Optional[MockChatServer],
+    frame_interval_sec: float,
+    captioning_mode: str,
+    seed: int,
+) -> Dict[str, Any]:
+    name = f"{int(duration_sec)}s_{width}x{height}_{fps:g}fps"
+    with tempfile.TemporaryDirectory(prefix="bench_") as tmp:
+        workspace = Path(tmp)
+        _write_workspace(workspace, backend, server.base_url if server else None, frame_interval_sec)
+        video_path = workspace / "outputs" / "raw_videos" / f"{BENCH_VIDEO_ID}.mp4"
+
+        t0 = time.perf_counter()
+        make_synthetic_video(video_path, duration_sec, width, height, fps, seed=seed)
+        synth_sec = time.perf_counter() - t0
+
+        if server is not None:
+            server.reset_stats()
+        out_path = workspace / "result.json"
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(REPO_DIR), env.get("PYTHONPATH")]))
+        env.setdefault("SAMBANOVA_API_KEY", "benchmark")
+        proc = subprocess.run(
+            [
+                sys.executable, str(REPO_DIR / "benchmark.py"), "_stages",
+                "--out", str(out_path), "--repeat", str(repeat), "--captioning-mode", captioning_mode,
+            ],
+            cwd=workspace,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        if proc.returncode != 0:
+            raise RuntimeError(f"benchmark case {name} failed:\n{proc.stderr[-4000:]}")
+        result = json.loads(out_path.read_text(encoding="utf-8"))
+
+        return {
+            "name": name,
+            "video": {
+                "duration_sec": duration_sec,
+                "width": width,
+                "height": height,
+                "fps": fps,
+                "bytes": video_path.stat().st_size,
+                "synthesis_sec": round(synth_sec, 3),
+            },
+            "frames": result["frames"],
+            "stages": {s: _stats(result["timings"][s]) for s in STAGES},
+            "counters": result["counters"],
+            "mock": dict(server.stats) if server is not None else None,
+        }
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    server = None
+    if args.backend == "mock":
+        server = MockChatServer(
+            latency_ms=args.latency_ms,
+            jitter_ms=args.jitter_ms,
+            error_rate=args.error_rate,
+            malformed_rate=args.malformed_rate,
+            seed=args.seed,
+        ).start()
+
+    cases = []
+    try:
+        for duration in args.durations:
+            for res in args.resolutions:
+                width, height = (int(x) for x in res.lower().split("x"))
+                for fps in args.fps:
+                    case = run_case(
+                        duration, width, height, fps, args.repeat, args.backend, server,
+                        args.frame_interval_sec, args.captioning_mode, args.seed,
+                    )
+                    cases.append(case)
+                    print(format_case(case))
+    finally:
+        if server is not None:
+            server.stop()
+
+    return {
+        "benchmark_version": BENCHMARK_VERSION,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "git": _git_info(),
+        "env": _env_info(),
+        "params": {
+            "backend": args.backend,
+            "repeat": args.repeat,
+            "frame_interval_sec": args.frame_interval_sec,
+            "captioning_mode": args.captioning_mode,
+            "latency_ms": args.latency_ms,
+            "jitter_ms": args.jitter_ms,
+            "error_rate": args.error_rate,
+            "malformed_rate": args.malformed_rate,
+            "seed": args.seed,
+        },
+        "cases": cases,
+    }
+
+
+def format_case(case: Dict[str, Any]) -> str:
+    lines = [f"{case['name']}: {case['frames']} frames"]
+    for s in STAGES:
+        st = case["stages"][s]
+        lines.append(f"  {s:<18} median {st['median']:>8.3f}s  min {st['min']:>8.3f}s")
+    return "\n".join(lines)
+
+
+def compare(a: Dict[str, Any], b: Dict[str, Any]) -> str:
+    """2つの結果の共通ケースについて、ステージごとの中央値と比（b / a）を並べる。"""
+    def label(r: Dict[str, Any]) -> str:
+        g = r.get("git", {})
+        return f"{g.get('commit')}{'+' if g.get('dirty') else ''}"
+
+    lines = [f"A = {label(a)} ({a['created_at']}), B = {label(b)} ({b['created_at']})"]
+    if a.get("params") != b.get("params"):
+        lines.append("[WARN] params differ; results may not be comparable")
+    b_cases = {c["name"]: c for c in b["cases"]}
+    for ca in a["cases"]:
+        cb = b_cases.get(ca["name"])
+        if cb is None:
+            continue
+        lines.append(ca["name"])
+        for s in STAGES:
+            ma, mb = ca["stages"][s]["median"], cb["stages"][s]["median"]
+            ratio = f"{mb / ma:6.2f}x" if ma > 0 else "     -"
+            lines.append(f"  {s:<18} A {ma:>8.3f}s  B {mb:>8.3f}s  {ratio}")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="合成動画とモック LLM サーバーでパイプラインを計測する")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_run = sub.add_parser("run", help="ベンチマークを実行して outputs/benchmarks に保存する")
+    p_run.add_argument("--durations", type=float, nargs="+", default=[60.0], help="動画の長さ（秒）")
+    p_run.add_argument("--resolutions", nargs="+", default=["640x360"], help="例: 640x360 1280x720")
+    p_run.add_argument("--fps", type=float, nargs="+", default=[30.0])
+    p_run.add_argument("--repeat", type=int, default=3)
+    p_run.add_argument("--backend", choices=["mock", "dummy"], default="mock")
+    p_run.add_argument("--latency-ms", type=float, default=200.0)
+    p_run.add_argument("--jitter-ms", type=float, default=50.0)
+    p_run.add_argument("--error-rate", type=float, default=0.0)
+    p_run.add_argument("--malformed-rate", type=float, default=0.0)
+    p_run.add_argument("--frame-interval-sec", type=float, default=2.0)
+    p_run.add_argument("--captioning-mode", choices=["all", "candidates"], default="all")
+    p_run.add_argument("--seed", type=int, default=0)
+    p_run.add_argument("--out", type=Path, default=None, help="結果 JSON の保存先（省略時は outputs/benchmarks/）")
+
+    p_cmp = sub.add_parser("compare", help="2つの結果 JSON を比較する")
+    p_cmp.add_argument("a", type=Path)
+    p_cmp.add_argument("b", type=Path)
+
+    p_serve = sub.add_parser("serve-mock", help="モックサーバーだけを起動する（手動での動作確認用）")
+    p_serve.add_argument("--port", type=int, default=8765)
+    p_serve.add_argument("--latency-ms", type=float, default=200.0)
+    p_serve.add_argument("--error-rate", type=float, default=0.0)
+
+    # 子プロセス用（作業ディレクトリで各ステージを計測する）
+    p_stages = sub.add_parser("_stages")
+    p_stages.add_argument("--out", type=Path, required=True)
+    p_stages.add_argument("--repeat", type=int, default=1)
+    p_stages.add_argument("--captioning-mode", default="all")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "_stages":
+        result = _run_stages(args.repeat, args.captioning_mode)
+        args.out.write_text(json.dumps(result, ensure_ascii=False), encoding="utf-8")
+        return 0
+
+    if args.command == "compare":
+        a = json.loads(args.a.read_text(encoding="utf-8"))
+        b = json.loads(args.b.read_text(encoding="utf-8"))
+        print(compare(a, b))
+        return 0
+
+    if args.command == "serve-mock":
+        server = MockChatServer(latency_ms=args.latency_ms, error_rate=args.error_rate, port=args.port).start()
+        print(f"Mock chat API: {server.base_url}/chat/completions (Ctrl+C で終了)")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.stop()
+        return 0
+
+    report = run_benchmark(args)
+    git = report["git"]
+    out = args.out or get_benchmarks_dir() / (
+        f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{git['commit'] or 'nogit'}{'_dirty' if git['dirty'] else ''}.json"
+    )
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"Saved: {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
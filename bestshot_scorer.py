@@ -2,50 +2,368 @@
 FrameAnalysis の JSONL からベストショットを選定し、画像のコピーと
 メタ情報 JSON を出力するモジュール。
 ベースでは単純なスコアリングを使い、あとから LLM ベースに置き換え可能。
+
+選定は「ヒープで上位候補を絞る → 時間方向 NMS + 見た目の類似度による MMR」で行い、
+連続するほぼ同じフレームが全枠を埋めないようにする。
+見た目の類似度は前処理で作った特徴ベクトル（frame_embeddings）のコサイン類似度。無ければ dHash で測る。
 """
 
 from __future__ import annotations
 
+import heapq
 import json
+import os
 import shutil
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import cv2  # type: ignore
+import numpy as np  # type: ignore
 
 import importlib
 import paths
 import schemas
 import jsonl_io
 import config_loader
+import frame_store
+import frame_embeddings
 
 importlib.reload(paths)
 importlib.reload(schemas)
 importlib.reload(jsonl_io)
 importlib.reload(config_loader)
+importlib.reload(frame_store)
+importlib.reload(frame_embeddings)
 
-from paths import get_analysis_path, get_bestshot_image_path, get_bestshot_meta_path
+from paths import (
+    get_analysis_path,
+    get_bestshot_image_path,
+    get_bestshot_meta_path,
+    get_bestshot_thumbnail_path,
+)
 from schemas import FrameAnalysis, BestShotMeta
 from jsonl_io import read_jsonl_as_dataclasses
 from config_loader import SETTINGS
+from frame_store import read_frame_bytes, read_frame_image
+from frame_embeddings import frame_vectors
+
 
+# 重み付きスコアに使う特徴量（settings.yaml の bestshot.weights のキー）
+FEATURE_NAMES = [
+    "cuteness",
+    "interesting",
+    "representative",
+    "has_child",
+    "center",
+    "subject_size",
+    "sharpness",
+    "blurry",
+    "too_dark",
+]
+LLM_SCORE_KEYS = ("cuteness", "interesting", "representative")
+SHARPNESS_SCALE = 300.0   # ラプラシアン分散をこの値で割って 0〜1 にクリップ
 
-def _compute_score(fa: FrameAnalysis) -> float:
+
+def _feature_matrix(analyses: Sequence[FrameAnalysis]) -> np.ndarray:
     """
-    ベースとなるスコアを計算する簡易ロジック。
-    - すでに scores.cuteness があればそれを優先
-    - 無ければ 0.5 固定など
-    TODO: 後から洗練したロジックに差し替え可能。
+    全フレームの特徴量を (フレーム数 × len(FEATURE_NAMES)) の行列にまとめる。
+    値はいずれも 0〜1。
+    - LLM スコア: 欠けている項目はそのフレームの scores の平均（scores 自体が無ければ 0.5）
+    - center / subject_size: bbox から算出（無ければ grid 位置、どちらも無ければ 0）
+    - sharpness: 前処理のシャープネス（無い古いデータは is_blurry から代用）
     """
-    if fa.scores:
-        if "cuteness" in fa.scores:
-            return float(fa.scores["cuteness"])
-        # 他のスコアも適当に組み合わせられる
-        return float(sum(fa.scores.values()) / max(len(fa.scores), 1))
-    return 0.5
+    n = len(analyses)
+    llm = np.full((n, len(LLM_SCORE_KEYS)), np.nan)
+    llm_mean = np.full(n, 0.5)
+    bbox = np.full((n, 4), np.nan)
+    grid = np.full((n, 2), np.nan)
+    sharp = np.full(n, np.nan)
+    has_child = np.zeros(n)
+    blurry = np.zeros(n)
+    dark = np.zeros(n)
+
+    # dataclass からの値の取り出しだけはループ。以降の計算は配列演算
+    for i, fa in enumerate(analyses):
+        if fa.scores:
+            llm_mean[i] = float(sum(fa.scores.values())) / len(fa.scores)
+            for j, key in enumerate(LLM_SCORE_KEYS):
+                if key in fa.scores:
+                    llm[i, j] = float(fa.scores[key])
+        if fa.bbox and len(fa.bbox) >= 4:
+            bbox[i] = fa.bbox[:4]
+        if fa.grid_row is not None and fa.grid_col is not None:
+            grid[i] = (fa.grid_row, fa.grid_col)
+        if fa.sharpness is not None:
+            sharp[i] = fa.sharpness
+        has_child[i] = float(fa.has_child)
+        blurry[i] = float(fa.is_blurry)
+        dark[i] = float(fa.is_too_dark)
+
+    llm = np.where(np.isnan(llm), llm_mean[:, None], llm)
+
+    # 面積 0 の bbox（子どもがいない場合の [0,0,0,0]）は「bbox 無し」として扱う
+    area = (bbox[:, 2] - bbox[:, 0]) * (bbox[:, 3] - bbox[:, 1])
+    valid = area > 0
+    cx = np.where(valid, (bbox[:, 0] + bbox[:, 2]) / 2.0, (grid[:, 1] + 0.5) / 10.0)
+    cy = np.where(valid, (bbox[:, 1] + bbox[:, 3]) / 2.0, (grid[:, 0] + 0.5) / 10.0)
+    dist = np.sqrt((cx - 0.5) ** 2 + (cy - 0.5) ** 2) / np.sqrt(0.5)
+    center = np.nan_to_num(np.clip(1.0 - dist, 0.0, 1.0), nan=0.0)
+    subject_size = np.where(valid, np.sqrt(np.clip(np.where(valid, area, 0.0), 0.0, 1.0)), 0.0)
+
+    sharpness = np.where(np.isnan(sharp), 1.0 - blurry, np.clip(sharp / SHARPNESS_SCALE, 0.0, 1.0))
+
+    return np.column_stack(
+        [llm, has_child, center, subject_size, sharpness, blurry, dark]
+    )
+
+
+def _compute_scores(
+    analyses: Sequence[FrameAnalysis],
+    weights: Optional[Dict[str, float]] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    全フレームの重み付きスコアを1回の行列演算で計算する。
+    スコア = Σ 重み × 特徴量 / 正の重みの合計
+    戻り値: (スコア配列, 特徴量ごとの寄与行列)。寄与行列の行和がスコアになる。
+    """
+    weights = SETTINGS.bestshot_weights if weights is None else weights
+    w = np.array([float(weights.get(name, 0.0)) for name in FEATURE_NAMES])
+    norm = w[w > 0].sum() or 1.0
+
+    contributions = _feature_matrix(analyses) * (w / norm)
+    return contributions.sum(axis=1), contributions
+
+
+def _score_breakdown(
+    contributions: np.ndarray,
+    idx: int,
+    weights: Optional[Dict[str, float]] = None,
+) -> Dict[str, float]:
+    """idx 番目のフレームの特徴量ごとの寄与（weights は _compute_scores に渡したものと同じにする）。"""
+    weights = SETTINGS.bestshot_weights if weights is None else weights
+    return {
+        name: round(float(contributions[idx, j]), 4) + 0.0
+        for j, name in enumerate(FEATURE_NAMES)
+        if weights.get(name, 0.0) != 0.0
+    }
 
 
-def select_bestshots(video_id: str) -> List[BestShotMeta]:
+def _dhash(image_path: str, hash_size: int = 8) -> Optional[int]:
+    """
+    差分ハッシュ（dHash）。ほぼ同じ構図のフレームはハミング距離が小さくなる。
+    """
+    img = read_frame_image(image_path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return None
+    small = cv2.resize(img, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+
+def _hash_similarity(a: Optional[int], b: Optional[int], n_bits: int = 64) -> float:
+    """dHash 同士の類似度（1.0 = 同一, 0.0 = 全ビット異なる）。"""
+    if a is None or b is None:
+        return 0.0
+    return 1.0 - bin(a ^ b).count("1") / n_bits
+
+
+def select_diverse_topk(
+    scores: np.ndarray,
+    times: np.ndarray,
+    k: int,
+    similarity: Callable[[int, int], float],
+    min_gap_sec: float,
+    mmr_lambda: float,
+    pool_factor: int,
+    duplicate_similarity: float = 1.0,
+) -> List[int]:
+    """
+    スコア上位から多様性を考慮して k 件のインデックスを選ぶ。
+
+    1. 全フレームをヒープに積み、スコアの高い順に「残りの枠 × pool_factor」件だけ取り出して候補にする（O(n + m log n)）
+    2. 既に選んだショットと min_gap_sec 以内の候補は除外（時間 NMS）。
+       既に選んだショットとの類似度が duplicate_similarity 以上の候補も、ほぼ同じ写真として除外
+    3. 残りから MMR（λ·score − (1−λ)·max 類似度）が最大のものを順に選ぶ
+    除外で候補が減ったら、ヒープから次に高いスコアのフレームを取り出して補充する。
+    除外した候補は二度と使わないので隣り合うほぼ同じフレームは並ばず、
+    k 件選ぶか全フレームを調べ終えるまで続ける（k 件未満になるのは、条件を満たすフレームが本当に無いときだけ）。
+    """
+    n = len(scores)
+    k = min(k, n)
+    if k <= 0:
+        return []
+
+    heap = [(-float(scores[i]), i) for i in range(n)]
+    heapq.heapify(heap)
+    per_slot = max(pool_factor, 1)
+
+    selected: List[int] = []
+    candidates: List[int] = []   # ヒープから取り出し、まだ除外されていない候補
+    while len(selected) < k:
+        while heap and len(candidates) < (k - len(selected)) * per_slot:
+            candidates.append(heapq.heappop(heap)[1])
+
+        best_i, best_val = -1, -np.inf
+        kept: List[int] = []
+        for i in candidates:
+            if any(abs(times[i] - times[j]) < min_gap_sec for j in selected):
+                continue  # 時間 NMS（選んだショットは減らないので、以後も選ばれない）
+            max_sim = max((similarity(i, j) for j in selected), default=0.0)
+            if max_sim >= duplicate_similarity:
+                continue  # ほぼ同じ写真（同上）
+            kept.append(i)
+            val = mmr_lambda * scores[i] - (1.0 - mmr_lambda) * max_sim
+            if best_i < 0 or val > best_val:
+                best_i, best_val = i, val
+        candidates = kept
+        if best_i < 0:
+            if not heap:
+                break  # 全フレームを調べ終えた
+            continue  # 候補が尽きたのでヒープから補充する
+        selected.append(best_i)
+        candidates.remove(best_i)
+
+    return sorted(selected, key=lambda i: -scores[i])
+
+
+# Linux の FICLONE ioctl（btrfs / XFS などでの reflink）
+_FICLONE = 0x40049409
+
+
+def _materialize(src: str, dst: Path) -> str:
+    """
+    フレーム画像を bestshots/ 側に配置する。データの複製を避けるため
+    ハードリンク → reflink → コピー の順に試し、使った方法を返す。
+    元フレームがパック（frame_store）にしか無ければ、パックから書き出す。
+    ※ ハードリンクは元フレームと同じ実体を指すので、元フレームを上書きすると
+      ベストショット側も変わる（パイプライン再実行時は選び直されるので問題ない）。
+    """
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    if dst.exists() or dst.is_symlink():
+        dst.unlink()
+
+    if not os.path.exists(src):
+        dst.write_bytes(read_frame_bytes(src))
+        return "pack"
+
+    try:
+        os.link(src, dst)
+        return "hardlink"
+    except OSError:
+        pass
+
+    try:
+        import fcntl
+
+        with open(src, "rb") as fs, open(dst, "wb") as fd:
+            fcntl.ioctl(fd.fileno(), _FICLONE, fs.fileno())
+        shutil.copystat(src, dst)
+        return "reflink"
+    except (ImportError, OSError):
+        if dst.exists():
+            dst.unlink()
+
+    shutil.copy2(src, dst)
+    return "copy"
+
+
+def _make_thumbnails(video_id: str, rank: int, src: str) -> Dict[str, str]:
+    """
+    ベストショット1枚分のサムネイル（長辺 SETTINGS.bestshot_thumbnail_sizes px）を作る。
+    元画像より大きいサイズは作らない。
+    """
+    img = cv2.imread(src)
+    if img is None:
+        return {}
+
+    fmt = SETTINGS.bestshot_thumbnail_format
+    quality = SETTINGS.bestshot_thumbnail_quality
+    if fmt == "webp":
+        ext, params = ".webp", [cv2.IMWRITE_WEBP_QUALITY, quality]
+    else:
+        ext, params = ".jpg", [cv2.IMWRITE_JPEG_QUALITY, quality]
+
+    h, w = img.shape[:2]
+    long_side = max(h, w)
+    thumbs: Dict[str, str] = {}
+    for size in sorted(SETTINGS.bestshot_thumbnail_sizes):
+        if size >= long_side and thumbs:
+            break
+        scale = min(size / long_side, 1.0)
+        resized = cv2.resize(
+            img,
+            (max(int(w * scale), 1), max(int(h * scale), 1)),
+            interpolation=cv2.INTER_AREA,
+        )
+        out_path = get_bestshot_thumbnail_path(video_id, rank, size, ext=ext)
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        cv2.imwrite(str(out_path), resized, params)
+        thumbs[str(size)] = str(out_path)
+    return thumbs
+
+
+def pick_thumbnail(meta: Dict, display_px: int) -> str:
+    """
+    表示幅 display_px 以上で最小のサムネイルを返す（無ければ最大のもの、さらに無ければ原寸）。
+    UI から BestShotMeta の dict を渡して使う。
+    """
+    thumbs = meta.get("thumbnails") or {}
+    if not thumbs:
+        return meta["frame_path"]
+    sizes = sorted(int(s) for s in thumbs)
+    for size in sizes:
+        if size >= display_px:
+            return thumbs[str(size)]
+    return thumbs[str(sizes[-1])]
+
+
+def pick_bestshots(
+    analyses: Sequence[FrameAnalysis],
+    weights: Optional[Dict[str, float]] = None,
+) -> Tuple[List[int], np.ndarray, np.ndarray]:
+    """
+    ファイル出力を伴わない選定部分。
+    weights: 特徴量の重み（省略時は settings.yaml の bestshot.weights）
+    戻り値: (選ばれた analyses のインデックス（順位順）, スコア配列, 寄与行列)
+    """
+    # スコア計算（全フレームを配列で一括）
+    scores, contributions = _compute_scores(analyses, weights)
+    times = np.array([fa.time_sec for fa in analyses], dtype=np.float64)
+
+    # 見た目の類似度: 特徴ベクトルがあればその内積（コサイン類似度）
+    vectors = frame_vectors(analyses[0].video_id) if SETTINGS.embeddings_enabled and analyses else {}
+    # 無いフレームは dHash。候補に残ったフレームだけ、必要になった時点で計算する
+    hashes: dict = {}
+
+    def _similarity(i: int, j: int) -> float:
+        vi, vj = vectors.get(analyses[i].frame_index), vectors.get(analyses[j].frame_index)
+        if vi is not None and vj is not None:
+            return float(np.dot(vi, vj))
+        for idx in (i, j):
+            if idx not in hashes:
+                hashes[idx] = _dhash(analyses[idx].frame_path)
+        return _hash_similarity(hashes[i], hashes[j])
+
+    picked = select_diverse_topk(
+        scores,
+        times,
+        SETTINGS.max_bestshots,
+        similarity=_similarity,
+        min_gap_sec=SETTINGS.bestshot_min_gap_sec,
+        mmr_lambda=SETTINGS.bestshot_mmr_lambda,
+        pool_factor=SETTINGS.bestshot_candidate_pool_factor,
+        duplicate_similarity=SETTINGS.bestshot_duplicate_similarity,
+    )
+    return picked, scores, contributions
+
+
+def select_bestshots(video_id: str, weights: Optional[Dict[str, float]] = None) -> List[BestShotMeta]:
     """
     analysis/{video_id}_analysis.jsonl を読み込み、ベストショットを選定して
-    bestshots/{video_id}_best_XX.png とメタ情報 JSON を出力する。
+    bestshots/{video_id}_best_XX.png（可能ならハードリンク）、サムネイルと
+    メタ情報 JSON を出力する。
+    weights: 特徴量の重み（省略時は settings.yaml の bestshot.weights。score_breakdown も同じ重みで出す）
     """
     analysis_path = get_analysis_path(video_id)
     analyses: List[FrameAnalysis] = read_jsonl_as_dataclasses(analysis_path, FrameAnalysis)
@@ -53,17 +371,13 @@ def select_bestshots(video_id: str) -> List[BestShotMeta]:
         print(f"No analysis found: {analysis_path}")
         return []
 
-    # スコア計算
-    scored = [(fa, _compute_score(fa)) for fa in analyses]
-    scored.sort(key=lambda x: x[1], reverse=True)
-
-    n = min(SETTINGS.max_bestshots, len(scored))
+    picked, scores, contributions = pick_bestshots(analyses, weights)
     bestshots: List[BestShotMeta] = []
 
-    for rank in range(n):
-        fa, score = scored[rank]
+    for rank, idx in enumerate(picked):
+        fa, score = analyses[idx], scores[idx]
         dst_img = get_bestshot_image_path(video_id, rank + 1)
-        shutil.copy2(fa.frame_path, dst_img)
+        _materialize(fa.frame_path, dst_img)
 
         meta = BestShotMeta(
             video_id=fa.video_id,
@@ -72,9 +386,20 @@ def select_bestshots(video_id: str) -> List[BestShotMeta]:
             score=float(score),
             frame_path=str(dst_img),
             caption=fa.caption,
+            score_breakdown=_score_breakdown(contributions, idx, weights),
         )
         bestshots.append(meta)
 
+    # サムネイル生成（cv2 は GIL を解放するのでスレッドで並列化できる）
+    if bestshots and SETTINGS.bestshot_thumbnail_sizes:
+        with ThreadPoolExecutor(max_workers=min(len(bestshots), os.cpu_count() or 1)) as pool:
+            thumbs = pool.map(
+                lambda m: _make_thumbnails(video_id, m.rank, m.frame_path),
+                bestshots,
+            )
+            for meta, t in zip(bestshots, thumbs):
+                meta.thumbnails = t
+
     # メタ情報を JSON で保存
     meta_path = get_bestshot_meta_path(video_id)
     meta_path.parent.mkdir(parents=True, exist_ok=True)
@@ -0,0 +1,230 @@
+"""
+ベストショットだけ欲しいときに、Vision LLM へ送るフレームを事前に絞り込むモジュール。
+
+LLM を使わないローカル指標（シャープネス・暗さ・動き量、任意で OpenCV HOG の人物検出）で
+全フレームを順位付けし、上位 N 枚だけを run_captioning に渡す（2段階モード）。
+
+evaluate_candidate_mode() は、全フレーム解析済みの analysis を基準として
+「候補だけ解析した場合に最終的なベストショットがどれだけ一致するか」を LLM 呼び出し無しで再現・集計する。
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+from typing import Any, Dict, List, Optional, Sequence
+
+import cv2  # type: ignore
+import numpy as np  # type: ignore
+
+import importlib
+import config_loader
+import paths
+import schemas
+import jsonl_io
+import bestshot_scorer
+import frame_store
+
+importlib.reload(config_loader)
+importlib.reload(paths)
+importlib.reload(schemas)
+importlib.reload(jsonl_io)
+importlib.reload(bestshot_scorer)
+importlib.reload(frame_store)
+
+from config_loader import SETTINGS
+from paths import get_analysis_path, get_manifest_path
+from schemas import FrameAnalysis, FrameMeta
+from jsonl_io import read_jsonl_as_dataclasses
+from bestshot_scorer import SHARPNESS_SCALE, pick_bestshots, select_diverse_topk
+from frame_store import read_frame_image
+
+
+# ローカルスコアの重み
+QUALITY_WEIGHT = 0.5
+MOTION_WEIGHT = 0.5
+PERSON_WEIGHT = 0.5
+
+# 人物検出は重いので、ローカルスコア上位のこの倍数の枚数だけに適用する
+PERSON_DETECTION_POOL_FACTOR = 3
+
+_HOG: Optional[Any] = None
+
+
+def _get_person_detector() -> Any:
+    global _HOG
+    if _HOG is None:
+        _HOG = cv2.HOGDescriptor()
+        _HOG.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
+    return _HOG
+
+
+def _has_person(frame_path: str) -> bool:
+    img = read_frame_image(frame_path)
+    if img is None:
+        return False
+    rects, _ = _get_person_detector().detectMultiScale(img, winStride=(8, 8))
+    return len(rects) > 0
+
+
+def default_candidate_count() -> int:
+    return SETTINGS.max_bestshots * SETTINGS.captioning_candidate_factor
+
+
+def local_scores(frames: Sequence[FrameMeta]) -> np.ndarray:
+    """
+    前処理の指標だけで計算する安価なスコア（0〜1程度）。
+    - quality: シャープネス（0〜1 に正規化）。暗い / ブレたフレームは 0
+    - motion : 直前フレームとの差分を動画内の 95 パーセンタイルで正規化
+    """
+    n = len(frames)
+    sharp = np.array(
+        [f.sharpness if f.sharpness is not None else np.nan for f in frames], dtype=np.float64
+    )
+    blurry = np.array([f.is_blurry for f in frames], dtype=bool)
+    dark = np.array([f.is_too_dark for f in frames], dtype=bool)
+    motion = np.array(
+        [f.motion if f.motion is not None else 0.0 for f in frames], dtype=np.float64
+    )
+
+    quality = np.where(np.isnan(sharp), 0.5, np.clip(sharp / SHARPNESS_SCALE, 0.0, 1.0))
+    quality = np.where(blurry | dark, 0.0, quality)
+
+    scale = float(np.percentile(motion, 95)) if n else 0.0
+    motion_norm = np.clip(motion / scale, 0.0, 1.0) if scale > 0 else np.zeros(n)
+
+    return QUALITY_WEIGHT * quality + MOTION_WEIGHT * motion_norm
+
+
+def rank_candidates(
+    frames: Sequence[FrameMeta],
+    top_n: Optional[int] = None,
+    use_person_detection: Optional[bool] = None,
+) -> List[FrameMeta]:
+    """
+    ローカル指標で上位 top_n 枚の候補フレームを選ぶ（時系列順で返す）。
+    隣接フレームばかりにならないよう、フレーム間隔の 1.5 倍以内は同時に選ばない。
+    （音声イベント周辺の密なサンプリングで近くのフレームが除外されても、select_diverse_topk が
+    スコア順に次のフレームを補充するので、間隔の条件を満たすフレームがある限り top_n 枚返す）
+    """
+    if top_n is None:
+        top_n = default_candidate_count()
+    if use_person_detection is None:
+        use_person_detection = SETTINGS.captioning_person_detection
+
+    frames = list(frames)
+    if len(frames) <= top_n:
+        return frames
+
+    scores = local_scores(frames)
+
+    if use_person_detection:
+        pool_size = min(len(frames), top_n * PERSON_DETECTION_POOL_FACTOR)
+        pool = np.argpartition(-scores, pool_size - 1)[:pool_size]
+        for i in pool:
+            if _has_person(frames[i].frame_path):
+                scores[i] += PERSON_WEIGHT
+
+    times = np.array([f.time_sec for f in frames], dtype=np.float64)
+    picked = select_diverse_topk(
+        scores,
+        times,
+        top_n,
+        similarity=lambda i, j: 0.0,
+        min_gap_sec=SETTINGS.frame_interval_sec * 1.5,
+        mmr_lambda=1.0,
+        pool_factor=2,
+    )
+    return [frames[i] for i in sorted(picked)]
+
+
+def evaluate_candidate_mode(
+    video_id: str,
+    top_n: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    全フレーム解析済み（captioning.mode: all）の analysis を基準に、
+    候補モードで得られるベストショットとの一致率と、節約できる LLM 呼び出し数を返す。
+    候補モードの結果は「基準の解析結果を候補フレームだけに絞って選び直す」ことで再現する。
+    """
+    frames: List[FrameMeta] = read_jsonl_as_dataclasses(get_manifest_path(video_id), FrameMeta)
+    analyses: List[FrameAnalysis] = read_jsonl_as_dataclasses(
+        get_analysis_path(video_id), FrameAnalysis
+    )
+    if not frames or not analyses:
+        raise FileNotFoundError(f"manifest / analysis not found for video_id: {video_id}")
+    if len(analyses) < len(frames):
+        raise ValueError(
+            f"{video_id}: analysis に全フレームがありません（{len(analyses)}/{len(frames)}）。"
+            "captioning.mode: all で解析したものを基準にしてください。"
+        )
+
+    requested = default_candidate_count() if top_n is None else top_n
+    candidates = rank_candidates(frames, requested)
+    candidate_ids = {f.frame_index for f in candidates}
+
+    baseline_idx, _, _ = pick_bestshots(analyses)
+    baseline = [analyses[i].frame_index for i in baseline_idx]
+
+    restricted = [fa for fa in analyses if fa.frame_index in candidate_ids]
+    cand_idx, _, _ = pick_bestshots(restricted)
+    cand_picks = [restricted[i].frame_index for i in cand_idx]
+
+    matched = len(set(baseline) & set(cand_picks))
+    return {
+        "video_id": video_id,
+        "total_frames": len(frames),
+        "requested_candidates": min(requested, len(frames)),
+        "llm_calls": len(candidates),
+        "llm_calls_saved": len(frames) - len(candidates),
+        "baseline_picks": baseline,
+        "candidate_picks": cand_picks,
+        "match_rate": matched / len(baseline) if baseline else 1.0,
+        "baseline_recall_in_candidates": (
+            len(set(baseline) & candidate_ids) / len(baseline) if baseline else 1.0
+        ),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="候補モード（2段階キャプション）の LLM 呼び出し削減数とベストショット一致率を集計する"
+    )
+    parser.add_argument("video_ids", nargs="+", help="全フレーム解析済みの video_id")
+    parser.add_argument("--top-n", type=int, default=None)
+    args = parser.parse_args()
+
+    results = []
+    for vid in args.video_ids:
+        try:
+            r = evaluate_candidate_mode(vid, args.top_n)
+        except (FileNotFoundError, ValueError) as e:
+            print(f"[WARN] {e}")
+            continue
+        results.append(r)
+        print(
+            f"{vid}: calls {r['llm_calls']}/{r['total_frames']} "
+            f"(saved {r['llm_calls_saved']}), match {r['match_rate']:.0%}"
+        )
+        if r["llm_calls"] < r["requested_candidates"]:
+            print(f"[WARN] {vid}: only {r['llm_calls']} of {r['requested_candidates']} candidates were selected")
+
+    if results:
+        total = sum(r["total_frames"] for r in results)
+        saved = sum(r["llm_calls_saved"] for r in results)
+        mean_match = sum(r["match_rate"] for r in results) / len(results)
+        print(json.dumps(
+            {
+                "videos": len(results),
+                "total_frames": total,
+                "llm_calls_saved": saved,
+                "saved_ratio": saved / total if total else 0.0,
+                "mean_match_rate": mean_match,
+            },
+            ensure_ascii=False,
+            indent=2,
+        ))
+
+
+if __name__ == "__main__":
+    main()
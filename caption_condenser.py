@@ -0,0 +1,182 @@
+"""
+日記プロンプトに入れる前に、フレームごとの caption を圧縮・重複除去するモジュール。
+
+- 正規化したテキストの文字 n-gram 類似度で、連続する同一 / ほぼ同一の caption を1つの時間区間（span）にまとめる
+- スコアやアラートで重み付けした重要度（salience）の高い span から、トークン予算に収まるだけ残す
+- 残した span を時系列順に「- [開始-終了] caption (×n)」の行にする
+
+1日分（2秒間隔で数千行）の caption でもプロンプトが一定サイズに収まる。
+"""
+
+from __future__ import annotations
+
+import math
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence, Set
+
+import importlib
+import config_loader
+import schemas
+import alert_analyzer
+import prompt_registry
+
+importlib.reload(config_loader)
+importlib.reload(schemas)
+importlib.reload(alert_analyzer)
+importlib.reload(prompt_registry)
+
+from config_loader import SETTINGS
+from schemas import FrameAnalysis
+from alert_analyzer import match_alert_keywords
+from prompt_registry import count_tokens as estimate_tokens  # diary_generator からも使う
+
+
+# 圧縮後の箇条書きの前に付ける説明（LLM が行の書式を誤解しないように）
+SPAN_HEADER_JA = "（各行の [開始-終了] はその場面が続いた時間帯、(×n) は同じ場面が続いたフレーム数です）"
+SPAN_HEADER_EN = "(Each line shows [start-end] of a scene and (xN) the number of frames it lasted.)"
+
+ALERT_SALIENCE_BONUS = 1.0
+
+_NON_WORD = re.compile(r"[\W_]+", re.UNICODE)
+
+
+@dataclass
+class CaptionSpan:
+    """連続する似た caption をまとめた区間。"""
+    start_sec: float
+    end_sec: float
+    caption: str                 # 区間の代表 caption（区間内で最もスコアが高いもの）
+    count: int = 1
+    salience: float = 0.0
+    has_alert: bool = False
+    frame_indices: List[int] = field(default_factory=list)
+
+
+def normalize_caption(text: str) -> str:
+    """NFKC 正規化・小文字化し、空白と記号を取り除く。"""
+    return _NON_WORD.sub("", unicodedata.normalize("NFKC", text).lower())
+
+
+def char_ngrams(text: str, n: int = 2) -> Set[str]:
+    if len(text) < n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def _frame_salience(fa: FrameAnalysis) -> float:
+    if not fa.scores:
+        return 0.5
+    return float(sum(fa.scores.values())) / len(fa.scores)
+
+
+def condense_captions(
+    frames: Sequence[FrameAnalysis],
+    similarity_threshold: Optional[float] = None,
+) -> List[CaptionSpan]:
+    """
+    時系列順の FrameAnalysis を1パスで span にまとめる。
+    直前の span の代表 caption と文字 bigram の Jaccard 類似度が閾値以上なら同じ span とみなす。
+    """
+    th = SETTINGS.diary_similarity_threshold if similarity_threshold is None else similarity_threshold
+
+    spans: List[CaptionSpan] = []
+    span_grams: Set[str] = set()
+    best_in_span = -math.inf
+
+    for fa in sorted(frames, key=lambda f: f.time_sec):
+        norm = normalize_caption(fa.caption)
+        if not norm:
+            continue
+        grams = char_ngrams(norm)
+        sal = _frame_salience(fa)
+        alert = bool(match_alert_keywords(fa))
+
+        if spans and jaccard(grams, span_grams) >= th:
+            sp = spans[-1]
+            sp.end_sec = fa.time_sec
+            sp.count += 1
+            sp.has_alert = sp.has_alert or alert
+            sp.frame_indices.append(fa.frame_index)
+            if sal > best_in_span:
+                best_in_span = sal
+                sp.caption = fa.caption
+        else:
+            spans.append(
+                CaptionSpan(
+                    start_sec=fa.time_sec,
+                    end_sec=fa.time_sec,
+                    caption=fa.caption,
+                    has_alert=alert,
+                    frame_indices=[fa.frame_index],
+                )
+            )
+            span_grams = grams
+            best_in_span = sal
+
+        # salience: 区間内の最高スコア + 長く続いた場面ほど少し加点 + アラート加点
+        sp = spans[-1]
+        sp.salience = (
+            max(best_in_span, 0.0)
+            + 0.1 * math.log1p(sp.count)
+            + (ALERT_SALIENCE_BONUS if sp.has_alert else 0.0)
+        )
+
+    return spans
+
+
+def format_timestamp(sec: float) -> str:
+    sec = int(sec)
+    return f"{sec // 3600:02d}:{sec % 3600 // 60:02d}:{sec % 60:02d}"
+
+
+def format_span(span: CaptionSpan) -> str:
+    if span.count > 1:
+        return (
+            f"- [{format_timestamp(span.start_sec)}-{format_timestamp(span.end_sec)}] "
+            f"{span.caption} (×{span.count})"
+        )
+    return f"- [{format_timestamp(span.start_sec)}] {span.caption}"
+
+
+def select_spans_within_budget(
+    spans: Sequence[CaptionSpan],
+    token_budget: Optional[int] = None,
+) -> List[CaptionSpan]:
+    """
+    salience の高い順に、行のトークン数の合計が token_budget に収まるだけ残す。
+    戻り値は時系列順。
+    """
+    budget = SETTINGS.diary_prompt_token_budget if token_budget is None else token_budget
+
+    kept: List[CaptionSpan] = []
+    used = 0
+    for sp in sorted(spans, key=lambda s: -s.salience):
+        cost = estimate_tokens(format_span(sp)) + 1
+        if used + cost > budget:
+            continue
+        kept.append(sp)
+        used += cost
+    kept.sort(key=lambda s: s.start_sec)
+    return kept
+
+
+def condensed_caption_lines(
+    frames: Sequence[FrameAnalysis],
+    language: str = "ja",
+    token_budget: Optional[int] = None,
+) -> List[str]:
+    """
+    diary 用の箇条書き行を返す（先頭に書式の説明行を付ける）。
+    """
+    spans = select_spans_within_budget(condense_captions(frames), token_budget)
+    header = SPAN_HEADER_JA if language == "ja" else SPAN_HEADER_EN
+    return [header] + [format_span(sp) for sp in spans]
+
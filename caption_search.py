@@ -0,0 +1,335 @@
+"""
+全動画の画像解析結果（caption / tags / main_subject）を横断して探す全文検索。
+
+- SQLite FTS5（outputs/search.sqlite3）に索引を作る。日本語は単語の区切りが無いので、
+  かな・漢字の連続は文字 bigram（「滑り台」→「滑り」「り台」＋末尾の1文字「台」）に分けて入れる
+- 検索語も同じように bigram に分け、連続した位置に並んでいるもの（フレーズ）だけを当てる。1文字の語は前方一致
+- run_captioning が解析結果を書くたびに、その動画の分だけ入れ替える（index_analyses）
+- 撮影日（recorded_at）で絞り込める。video_id の日時（generate_video_id の形式）→ カタログの取り込み日時の順で決める
+
+実行例:
+    python caption_search.py reindex --all
+    python caption_search.py query "滑り台" --since 2024-05-01
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import re
+import sqlite3
+import sys
+import time
+import unicodedata
+from contextlib import contextmanager
+from dataclasses import asdict, is_dataclass
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import cv2  # type: ignore
+
+import importlib
+import paths
+import jsonl_io
+import catalog
+import frame_store
+
+importlib.reload(paths)
+importlib.reload(jsonl_io)
+importlib.reload(catalog)
+importlib.reload(frame_store)
+
+from paths import get_analysis_path, get_search_db_path
+from jsonl_io import read_jsonl_as_dicts
+from catalog import get_video, list_videos
+from frame_store import read_frame_image
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS caption_docs (
+    id           INTEGER PRIMARY KEY,
+    video_id     TEXT NOT NULL,
+    frame_index  INTEGER NOT NULL,
+    time_sec     REAL NOT NULL,
+    frame_path   TEXT NOT NULL,
+    caption      TEXT NOT NULL,
+    tags         TEXT NOT NULL DEFAULT '[]',
+    main_subject TEXT NOT NULL DEFAULT '',
+    recorded_at  TEXT,
+    UNIQUE (video_id, frame_index)
+);
+CREATE INDEX IF NOT EXISTS idx_caption_docs_recorded ON caption_docs (recorded_at);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS caption_fts USING fts5(
+    caption, tags, subject, tokenize = 'unicode61'
+);
+"""
+
+# 列ごとの重み（bm25）。タグ・主な被写体に当たったものを少し上に出す
+_BM25_WEIGHTS = (1.0, 2.0, 1.5)
+
+# かな・カタカナ・漢字（と「々」「ー」）の連続。ここは bigram に分ける
+_CJK_RUN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff々〆]+")
+_WORD = re.compile(r"\w+")
+
+_VIDEO_ID_TIME = re.compile(r"^(\d{8}_\d{6})")
+
+
+@contextmanager
+def _connect() -> Iterator[sqlite3.Connection]:
+    conn = sqlite3.connect(str(get_search_db_path()), timeout=30.0, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        conn.executescript(_SCHEMA)
+        yield conn
+    finally:
+        conn.close()
+
+
+# ---------------------------------------------------------------------------
+# 分かち書き（文字 bigram）
+# ---------------------------------------------------------------------------
+
+def _normalize(text: str) -> str:
+    # 全角英数・半角カナをそろえる
+    return unicodedata.normalize("NFKC", text or "").lower()
+
+
+def _split_runs(text: str) -> List[Tuple[bool, str]]:
+    """text を (is_cjk, 文字列) の並びに分ける。CJK 以外は \\w+ の単語ごと。"""
+    runs: List[Tuple[bool, str]] = []
+    pos = 0
+    for m in _CJK_RUN.finditer(text):
+        runs += [(False, w) for w in _WORD.findall(text[pos:m.start()])]
+        runs.append((True, m.group()))
+        pos = m.end()
+    runs += [(False, w) for w in _WORD.findall(text[pos:])]
+    return runs
+
+
+def to_grams(text: str) -> str:
+    """
+    索引に入れる形（空白区切りのトークン列）。
+    CJK の連続は bigram ＋ 末尾の1文字（1文字の検索語が末尾の文字にも当たるように）、それ以外は単語のまま。
+    """
+    tokens: List[str] = []
+    for is_cjk, run in _split_runs(_normalize(text)):
+        if is_cjk:
+            tokens += [run[i:i + 2] for i in range(len(run) - 1)]
+            tokens.append(run[-1])
+        else:
+            tokens.append(run)
+    return " ".join(tokens)
+
+
+def build_match_query(query: str) -> Optional[str]:
+    """
+    検索語を FTS5 の MATCH 式にする（空白区切りの語はすべて含むもの＝AND）。
+    CJK の語は bigram のフレーズ、1文字なら前方一致。当てる語が無ければ None。
+    """
+    terms: List[str] = []
+    for is_cjk, run in _split_runs(_normalize(query)):
+        if is_cjk and len(run) == 1:
+            terms.append(f'"{run}"*')
+        elif is_cjk:
+            terms.append('"' + " ".join(run[i:i + 2] for i in range(len(run) - 1)) + '"')
+        else:
+            terms.append(f'"{run}"')
+    return " AND ".join(terms) if terms else None
+
+
+# ---------------------------------------------------------------------------
+# 索引の更新
+# ---------------------------------------------------------------------------
+
+def _recorded_at(video_id: str) -> Optional[str]:
+    """撮影（取り込み）日時。video_id の日時 → カタログの取り込み日時。分からなければ None。"""
+    m = _VIDEO_ID_TIME.match(video_id)
+    if m:
+        try:
+            return datetime.strptime(m.group(1), "%Y%m%d_%H%M%S").isoformat(timespec="seconds")
+        except ValueError:
+            pass
+    video = get_video(video_id)
+    return video["saved_at"] if video else None
+
+
+def index_analyses(video_id: str, analyses: Sequence[Any]) -> int:
+    """
+    video_id の解析結果（FrameAnalysis か dict の並び）で索引を入れ替える。
+    戻り値: 入れた件数（失敗したら [WARN] を出して 0）
+    """
+    records = [asdict(a) if is_dataclass(a) else a for a in analyses]
+    recorded_at = _recorded_at(video_id)
+    try:
+        with _connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "DELETE FROM caption_fts WHERE rowid IN (SELECT id FROM caption_docs WHERE video_id = ?)",
+                    (video_id,),
+                )
+                conn.execute("DELETE FROM caption_docs WHERE video_id = ?", (video_id,))
+                for r in records:
+                    tags = [str(t) for t in (r.get("tags") or [])]
+                    cur = conn.execute(
+                        "INSERT INTO caption_docs (video_id, frame_index, time_sec, frame_path, caption, "
+                        "tags, main_subject, recorded_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (
+                            video_id,
+                            r["frame_index"],
+                            r["time_sec"],
+                            r["frame_path"],
+                            r.get("caption") or "",
+                            json.dumps(tags, ensure_ascii=False),
+                            r.get("main_subject") or "",
+                            recorded_at,
+                        ),
+                    )
+                    conn.execute(
+                        "INSERT INTO caption_fts (rowid, caption, tags, subject) VALUES (?, ?, ?, ?)",
+                        (
+                            cur.lastrowid,
+                            to_grams(r.get("caption") or ""),
+                            " ".join(to_grams(t) for t in tags),
+                            to_grams(r.get("main_subject") or ""),
+                        ),
+                    )
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+    except sqlite3.Error as e:
+        print(f"[WARN] Failed to update caption search index ({video_id}): {e}")
+        return 0
+    return len(records)
+
+
+def reindex(video_id: str) -> int:
+    """analysis/{video_id}_analysis.jsonl から索引を作り直す（解析結果が無ければ索引から消す）。"""
+    return index_analyses(video_id, read_jsonl_as_dicts(get_analysis_path(video_id)))
+
+
+# ---------------------------------------------------------------------------
+# 検索
+# ---------------------------------------------------------------------------
+
+def search_captions(
+    query: str,
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    video_ids: Optional[Sequence[str]] = None,
+    limit: int = 50,
+    order: str = "recent",
+) -> List[Dict[str, Any]]:
+    """
+    caption / tags / main_subject に query を含むフレームを返す。
+    since / until: 撮影日（recorded_at）の範囲（両端を含む）
+    order:
+      - "recent": 新しく索引に入れた動画から順に limit 件（FTS5 が途中で打ち切れるので、よく出る語でも速い）。
+        返す limit 件は撮影日の新しい順・動画内の時刻順に並べ直す
+      - "relevance": bm25 のよく当たる順（当たった全件に点数を付けるので、よく出る語だと遅くなる）
+    戻り値の各要素: video_id, frame_index, time_sec, frame_path, caption, tags, main_subject, recorded_at, score
+    """
+    if order not in ("recent", "relevance"):
+        raise ValueError(f"Unsupported search order: {order}")
+    match = build_match_query(query)
+    if match is None:
+        return []
+
+    where = ["caption_fts MATCH ?"]
+    args: List[Any] = [match]
+    if since is not None:
+        where.append("d.recorded_at >= ?")
+        args.append(since.isoformat())
+    if until is not None:
+        where.append("d.recorded_at < ?")
+        args.append((until + timedelta(days=1)).isoformat())
+    if video_ids:
+        where.append(f"d.video_id IN ({','.join('?' for _ in video_ids)})")
+        args += list(video_ids)
+    args.append(limit)
+
+    weights = ", ".join(str(w) for w in _BM25_WEIGHTS)
+    sql = (
+        f"SELECT d.*, bm25(caption_fts, {weights}) AS score FROM caption_fts "
+        "JOIN caption_docs AS d ON d.id = caption_fts.rowid "
+        f"WHERE {' AND '.join(where)} "
+        + ("ORDER BY caption_fts.rowid DESC LIMIT ?" if order == "recent" else "ORDER BY score LIMIT ?")
+    )
+    with _connect() as conn:
+        rows = conn.execute(sql, args).fetchall()
+
+    hits = []
+    for r in rows:
+        hit = dict(r)
+        hit.pop("id")
+        hit["tags"] = json.loads(hit["tags"] or "[]")
+        hits.append(hit)
+    if order == "recent":
+        hits.sort(key=lambda h: (h["recorded_at"] or "", h["video_id"], -h["time_sec"]), reverse=True)
+    return hits
+
+
+def frame_thumbnail(frame_path: str, max_side: int = 240) -> Optional[bytes]:
+    """検索結果の表示用に、フレームを長辺 max_side px の JPEG にする（読めなければ None）。"""
+    img = read_frame_image(frame_path)
+    if img is None:
+        return None
+    h, w = img.shape[:2]
+    scale = max_side / max(h, w)
+    if scale < 1.0:
+        img = cv2.resize(img, (max(int(w * scale), 1), max(int(h * scale), 1)), interpolation=cv2.INTER_AREA)
+    ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 80])
+    return buf.tobytes() if ok else None
+
+
+def format_time(sec: float) -> str:
+    m, s = divmod(int(sec), 60)
+    h, m = divmod(m, 60)
+    return f"{h}:{m:02d}:{s:02d}" if h else f"{m}:{s:02d}"
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="画像解析結果（キャプション・タグ）の全文検索")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_reindex = sub.add_parser("reindex", help="解析結果から索引を作り直す")
+    p_reindex.add_argument("video_ids", nargs="*")
+    p_reindex.add_argument("--all", action="store_true", help="カタログに記録された全動画")
+
+    p_query = sub.add_parser("query", help="検索する")
+    p_query.add_argument("query")
+    p_query.add_argument("--since", type=date.fromisoformat, default=None, help="YYYY-MM-DD")
+    p_query.add_argument("--until", type=date.fromisoformat, default=None, help="YYYY-MM-DD")
+    p_query.add_argument("--limit", type=int, default=20)
+    p_query.add_argument("--order", choices=["recent", "relevance"], default="recent")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "query":
+        t0 = time.perf_counter()
+        hits = search_captions(
+            args.query, since=args.since, until=args.until, limit=args.limit, order=args.order
+        )
+        elapsed = time.perf_counter() - t0
+        for h in hits:
+            print(f"{h['recorded_at'] or '-':<19} {h['video_id']:<30} {format_time(h['time_sec']):>8}  {h['caption']}")
+        print(f"{len(hits)} hits ({elapsed * 1000:.1f} ms)")
+        return 0
+
+    video_ids: List[str] = list(args.video_ids)
+    if args.all:
+        # 撮影日の古い順に入れ直す（order="recent" は索引に入れた順なので）
+        video_ids += sorted((v["video_id"] for v in list_videos()), key=lambda vid: _recorded_at(vid) or "")
+    if not video_ids:
+        parser.error("video_id か --all を指定してください")
+    for vid in video_ids:
+        print(f"{vid}: {reindex(vid)} frames indexed")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
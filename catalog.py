@@ -0,0 +1,547 @@
+"""
+取り込んだ動画・パイプラインの実行・成果物を記録する SQLite のカタログ。
+
+- パイプラインは成果物を書くたびに（record_artifacts）、実行が終わるたびに（record_run）ここへ記録する
+- 画面（streamlit_app）や inspection・video_ingest はファイルを glob せずにここを引く
+  （list_runs / list_frames / latest_analysis など）
+- 正はあくまで outputs/ の下のファイル。カタログが無い・古いときは `python catalog.py reindex --all` で作り直せる
+- 記録に失敗してもパイプラインは止めない（[WARN] を出して続ける）
+
+DB: outputs/catalog.sqlite3
+
+実行例:
+    python catalog.py reindex --all
+    python catalog.py runs --limit 10
+    python catalog.py frames 20240501_093000_ui
+"""
+
+from __future__ import annotations
+
+import argparse
+import dataclasses
+import json
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import importlib
+import config_loader
+import paths
+import jsonl_io
+
+importlib.reload(config_loader)
+importlib.reload(paths)
+importlib.reload(jsonl_io)
+
+from config_loader import SETTINGS
+from paths import (
+    get_catalog_db_path,
+    get_manifest_path,
+    get_metrics_path,
+    get_pipeline_report_path,
+    get_raw_video_dir,
+    get_video_meta_path,
+)
+from jsonl_io import read_jsonl_as_dicts
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    video_id     TEXT PRIMARY KEY,
+    file         TEXT NOT NULL,
+    sha256       TEXT,
+    size         INTEGER,
+    saved_at     TEXT,
+    duration_sec REAL,
+    fps          REAL,
+    width        INTEGER,
+    height       INTEGER,
+    codec        TEXT,
+    meta         TEXT,
+    updated_at   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_videos_sha256 ON videos (sha256);
+
+CREATE TABLE IF NOT EXISTS runs (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    video_id     TEXT NOT NULL,
+    run_id       TEXT,
+    started_at   TEXT NOT NULL,
+    elapsed_sec  REAL,
+    hits         INTEGER,
+    misses       INTEGER,
+    force        INTEGER NOT NULL DEFAULT 0,
+    totals       TEXT NOT NULL DEFAULT '{}',
+    settings     TEXT NOT NULL DEFAULT '{}',
+    recorded_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_runs_video ON runs (video_id, id);
+
+CREATE TABLE IF NOT EXISTS run_stages (
+    run          INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    stage        TEXT NOT NULL,
+    status       TEXT NOT NULL,
+    reason       TEXT,
+    elapsed_sec  REAL,
+    counters     TEXT NOT NULL DEFAULT '{}',
+    PRIMARY KEY (run, stage)
+);
+CREATE INDEX IF NOT EXISTS idx_run_stages_stage ON run_stages (stage, status);
+
+CREATE TABLE IF NOT EXISTS artifacts (
+    path         TEXT PRIMARY KEY,
+    video_id     TEXT NOT NULL,
+    stage        TEXT NOT NULL,
+    digest       TEXT,
+    size         INTEGER,
+    records      INTEGER,
+    updated_at   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_artifacts_video ON artifacts (video_id, stage);
+CREATE INDEX IF NOT EXISTS idx_artifacts_stage ON artifacts (stage, updated_at);
+
+CREATE TABLE IF NOT EXISTS frames (
+    video_id     TEXT NOT NULL,
+    frame_index  INTEGER NOT NULL,
+    time_sec     REAL NOT NULL,
+    frame_path   TEXT NOT NULL,
+    is_blurry    INTEGER NOT NULL DEFAULT 0,
+    is_too_dark  INTEGER NOT NULL DEFAULT 0,
+    brightness   REAL,
+    sharpness    REAL,
+    motion       REAL,
+    PRIMARY KEY (video_id, frame_index)
+);
+"""
+
+
+@contextmanager
+def _connect() -> Iterator[sqlite3.Connection]:
+    conn = sqlite3.connect(str(get_catalog_db_path()), timeout=30.0, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.executescript(_SCHEMA)
+        yield conn
+    finally:
+        conn.close()
+
+
+@contextmanager
+def _transaction(conn: sqlite3.Connection) -> Iterator[None]:
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+# 成果物の中身が壊れている・途中で消えたときのエラー（カタログに載らないだけで、パイプラインは止めない）
+_ARTIFACT_ERRORS = (json.JSONDecodeError, KeyError, TypeError, ValueError, OSError)
+
+
+def _warn_on_error(what: str, e: Exception) -> None:
+    print(f"[WARN] Failed to update catalog ({what}): {e}")
+
+
+# ---------------------------------------------------------------------------
+# 記録（video_loader / pipeline から呼ぶ）
+# ---------------------------------------------------------------------------
+
+def register_video(video_id: str, file: str, sha256: str, size: int, saved_at: str) -> None:
+    """取り込んだ動画を記録する（同じ video_id なら上書き）。カタログに書けなくても取り込みは止めない。"""
+    try:
+        with _connect() as conn:
+            conn.execute(
+                "INSERT INTO videos (video_id, file, sha256, size, saved_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (video_id) DO UPDATE SET "
+                "file = excluded.file, sha256 = excluded.sha256, size = excluded.size, "
+                "saved_at = excluded.saved_at, updated_at = excluded.updated_at",
+                (video_id, file, sha256, size, saved_at, time.time()),
+            )
+    except (sqlite3.Error, OSError) as e:
+        _warn_on_error(f"{video_id} video", e)
+
+
+def _index_video_meta(conn: sqlite3.Connection, video_id: str, path: Path) -> None:
+    meta = json.loads(path.read_text(encoding="utf-8"))
+    info = meta.get("video") or {}
+    conn.execute(
+        "INSERT INTO videos (video_id, file, size, updated_at) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT (video_id) DO NOTHING",
+        (video_id, meta.get("file") or f"{video_id}.mp4", meta.get("size"), time.time()),
+    )
+    conn.execute(
+        "UPDATE videos SET duration_sec = ?, fps = ?, width = ?, height = ?, codec = ?, meta = ?, "
+        "updated_at = ? WHERE video_id = ?",
+        (
+            info.get("duration_sec"),
+            info.get("fps"),
+            info.get("width"),
+            info.get("height"),
+            info.get("codec"),
+            json.dumps(meta, ensure_ascii=False),
+            time.time(),
+            video_id,
+        ),
+    )
+
+
+def _index_manifest(conn: sqlite3.Connection, video_id: str, path: Path) -> int:
+    records = read_jsonl_as_dicts(path)
+    # 先に全行を組み立てる（壊れた行で失敗したときに古いフレーム一覧を消してしまわないように）
+    rows = [
+        (
+            video_id,
+            r["frame_index"],
+            r["time_sec"],
+            r["frame_path"],
+            int(bool(r.get("is_blurry"))),
+            int(bool(r.get("is_too_dark"))),
+            r.get("brightness"),
+            r.get("sharpness"),
+            r.get("motion"),
+        )
+        for r in records
+    ]
+    conn.execute("DELETE FROM frames WHERE video_id = ?", (video_id,))
+    conn.executemany(
+        "INSERT OR REPLACE INTO frames (video_id, frame_index, time_sec, frame_path, is_blurry, "
+        "is_too_dark, brightness, sharpness, motion) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        rows,
+    )
+    return len(records)
+
+
+def _count_records(path: Path) -> Optional[int]:
+    """jsonl は行数、JSON の配列は要素数。それ以外は None。"""
+    if path.suffix == ".jsonl":
+        with path.open("rb") as f:
+            return sum(1 for line in f if line.strip())
+    if path.suffix == ".json":
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except json.JSONDecodeError:
+            return None
+        return len(data) if isinstance(data, list) else None
+    return None
+
+
+def record_artifacts(video_id: str, stage: str, outputs: Dict[str, Optional[str]]) -> None:
+    """
+    ステージの成果物（パス -> sha256。pipeline の outputs）を記録する。
+    前回と内容が変わったものだけ中身を読み、フレーム一覧（マニフェスト）・動画情報・レコード数を更新する。
+    中身が読めなかった成果物は警告して飛ばす（記録しないので、次に呼ばれたときに読み直す）。
+    """
+    try:
+        with _connect() as conn, _transaction(conn):
+            for path_str, digest in outputs.items():
+                prev = conn.execute(
+                    "SELECT digest FROM artifacts WHERE path = ?", (path_str,)
+                ).fetchone()
+                if digest is None:
+                    conn.execute("DELETE FROM artifacts WHERE path = ?", (path_str,))
+                    continue
+                if prev is not None and prev["digest"] == digest:
+                    continue
+
+                path = Path(path_str)
+                try:
+                    if path == get_manifest_path(video_id):
+                        records = _index_manifest(conn, video_id, path)
+                    elif path == get_video_meta_path(video_id):
+                        _index_video_meta(conn, video_id, path)
+                        records = None
+                    else:
+                        records = _count_records(path)
+                    size = path.stat().st_size
+                except _ARTIFACT_ERRORS as e:
+                    _warn_on_error(f"{video_id} {stage} {path.name}", e)
+                    continue
+                conn.execute(
+                    "INSERT OR REPLACE INTO artifacts (path, video_id, stage, digest, size, records, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (path_str, video_id, stage, digest, size, records, time.time()),
+                )
+    except (sqlite3.Error, OSError) as e:
+        _warn_on_error(f"{video_id} {stage}", e)
+
+
+def record_run(report: Dict[str, Any], metrics: Optional[Dict[str, Any]] = None) -> Optional[int]:
+    """
+    パイプラインの実行報告（pipeline.run_pipeline の戻り値）とメトリクス（instrumentation.end_run）を記録する。
+    そのときの設定（settings.yaml）も丸ごと残す。戻り値: 実行の id（失敗したら None）
+    """
+    metrics = metrics or {}
+    stage_metrics = metrics.get("stages", {})
+    try:
+        with _connect() as conn, _transaction(conn):
+            cur = conn.execute(
+                "INSERT INTO runs (video_id, run_id, started_at, elapsed_sec, hits, misses, force, "
+                "totals, settings, recorded_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    report["video_id"],
+                    metrics.get("run_id"),
+                    report["started_at"],
+                    report.get("elapsed_sec"),
+                    report.get("hits"),
+                    report.get("misses"),
+                    int(bool(report.get("force"))),
+                    json.dumps(report.get("metrics") or {}, ensure_ascii=False),
+                    json.dumps(dataclasses.asdict(SETTINGS), ensure_ascii=False, default=str),
+                    time.time(),
+                ),
+            )
+            run = int(cur.lastrowid)
+            conn.executemany(
+                "INSERT OR REPLACE INTO run_stages (run, stage, status, reason, elapsed_sec, counters) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        run,
+                        e["stage"],
+                        e["status"],
+                        e.get("reason"),
+                        stage_metrics.get(e["stage"], {}).get("wall_sec", e.get("elapsed_sec")),
+                        json.dumps(stage_metrics.get(e["stage"], {}).get("counters", {})),
+                    )
+                    for e in report.get("stages", [])
+                ],
+            )
+        return run
+    except sqlite3.Error as e:
+        _warn_on_error(f"run {report.get('video_id')}", e)
+        return None
+
+
+# ---------------------------------------------------------------------------
+# 問い合わせ
+# ---------------------------------------------------------------------------
+
+def _row_to_video(row: sqlite3.Row) -> Dict[str, Any]:
+    video = dict(row)
+    video["meta"] = json.loads(video["meta"]) if video["meta"] else None
+    return video
+
+
+def get_video(video_id: str) -> Optional[Dict[str, Any]]:
+    with _connect() as conn:
+        row = conn.execute("SELECT * FROM videos WHERE video_id = ?", (video_id,)).fetchone()
+    return _row_to_video(row) if row else None
+
+
+def find_video_by_sha256(sha256: str) -> Optional[Dict[str, Any]]:
+    """同じ内容（sha256）の動画。複数あれば最初に取り込んだもの。"""
+    with _connect() as conn:
+        row = conn.execute(
+            "SELECT * FROM videos WHERE sha256 = ? ORDER BY saved_at, video_id LIMIT 1", (sha256,)
+        ).fetchone()
+    return _row_to_video(row) if row else None
+
+
+def list_videos(limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """新しく記録された順の動画。"""
+    with _connect() as conn:
+        rows = conn.execute(
+            "SELECT * FROM videos ORDER BY updated_at DESC LIMIT ?", (-1 if limit is None else limit,)
+        ).fetchall()
+    return [_row_to_video(r) for r in rows]
+
+
+def _row_to_run(row: sqlite3.Row) -> Dict[str, Any]:
+    run = dict(row)
+    run["force"] = bool(run["force"])
+    run["totals"] = json.loads(run["totals"] or "{}")
+    run["settings"] = json.loads(run["settings"] or "{}")
+    return run
+
+
+def list_runs(video_id: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+    """新しい順の実行（video_id を指定するとその動画の分だけ）。"""
+    with _connect() as conn:
+        if video_id is None:
+            rows = conn.execute("SELECT * FROM runs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT * FROM runs WHERE video_id = ? ORDER BY id DESC LIMIT ?", (video_id, limit)
+            ).fetchall()
+    return [_row_to_run(r) for r in rows]
+
+
+def get_run_stages(run: int) -> List[Dict[str, Any]]:
+    with _connect() as conn:
+        rows = conn.execute(
+            "SELECT * FROM run_stages WHERE run = ? ORDER BY rowid", (run,)
+        ).fetchall()
+    stages = [dict(r) for r in rows]
+    for s in stages:
+        s["counters"] = json.loads(s["counters"] or "{}")
+    return stages
+
+
+def stage_history(limit_runs: int = 20) -> List[Dict[str, Any]]:
+    """
+    直近 limit_runs 回の実行のうち、実際に計算した（キャッシュミスの）ステージの所要時間と、その動画の情報。
+    video_ingest.learned_stage_rates が使う。
+    """
+    with _connect() as conn:
+        rows = conn.execute(
+            "SELECT s.stage, s.elapsed_sec, v.meta FROM run_stages AS s "
+            "JOIN runs AS r ON r.id = s.run "
+            "JOIN videos AS v ON v.video_id = r.video_id "
+            "WHERE s.status = 'miss' AND s.elapsed_sec IS NOT NULL AND v.meta IS NOT NULL "
+            "AND r.id IN (SELECT id FROM runs ORDER BY id DESC LIMIT ?)",
+            (limit_runs,),
+        ).fetchall()
+    return [
+        {"stage": r["stage"], "elapsed_sec": r["elapsed_sec"], "meta": json.loads(r["meta"])}
+        for r in rows
+    ]
+
+
+def list_frames(video_id: str) -> List[Dict[str, Any]]:
+    """video_id のフレーム（マニフェストの内容。フレーム番号順）。"""
+    with _connect() as conn:
+        rows = conn.execute(
+            "SELECT * FROM frames WHERE video_id = ? ORDER BY frame_index", (video_id,)
+        ).fetchall()
+    frames = [dict(r) for r in rows]
+    for f in frames:
+        f["is_blurry"] = bool(f["is_blurry"])
+        f["is_too_dark"] = bool(f["is_too_dark"])
+    return frames
+
+
+def list_artifacts(video_id: str, stage: Optional[str] = None) -> List[Dict[str, Any]]:
+    with _connect() as conn:
+        if stage is None:
+            rows = conn.execute(
+                "SELECT * FROM artifacts WHERE video_id = ? ORDER BY stage, path", (video_id,)
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT * FROM artifacts WHERE video_id = ? AND stage = ? ORDER BY path",
+                (video_id, stage),
+            ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def latest_analysis(video_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    最後に更新された画像解析結果（analysis ステージの成果物: path, digest, records, updated_at）。
+    video_id を省略すると全動画の中で最新のもの。
+    """
+    with _connect() as conn:
+        if video_id is None:
+            row = conn.execute(
+                "SELECT * FROM artifacts WHERE stage = 'analysis' ORDER BY updated_at DESC LIMIT 1"
+            ).fetchone()
+        else:
+            row = conn.execute(
+                "SELECT * FROM artifacts WHERE stage = 'analysis' AND video_id = ? "
+                "ORDER BY updated_at DESC LIMIT 1",
+                (video_id,),
+            ).fetchone()
+    return dict(row) if row else None
+
+
+# ---------------------------------------------------------------------------
+# 作り直し
+# ---------------------------------------------------------------------------
+
+def reindex(video_id: str) -> Dict[str, Any]:
+    """
+    outputs/ の下のファイルから video_id の記録を作り直す（カタログ導入前の成果物の取り込み用）。
+    直近の実行報告（pipeline_report.json）とメトリクスがあれば、未記録なら実行として記録する。
+    """
+    import pipeline
+
+    result: Dict[str, Any] = {"video_id": video_id, "artifacts": 0, "run": None}
+    outputs_by_stage = pipeline.stage_outputs(video_id)
+
+    raw = pipeline.get_raw_video_path(video_id)
+    video_digest = outputs_by_stage.pop(pipeline.VIDEO, {}).get("video")
+    if video_digest is not None:
+        st = raw.stat()
+        saved_at = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(st.st_mtime))
+        register_video(video_id, raw.name, video_digest, st.st_size, saved_at)
+
+    for stage, outputs in outputs_by_stage.items():
+        outputs = {p: d for p, d in outputs.items() if d is not None}
+        if outputs:
+            record_artifacts(video_id, stage, outputs)
+            result["artifacts"] += len(outputs)
+
+    report_path = get_pipeline_report_path(video_id)
+    if report_path.exists():
+        report = json.loads(report_path.read_text(encoding="utf-8"))
+        if all(r["started_at"] != report["started_at"] for r in list_runs(video_id)):
+            metrics_path = get_metrics_path(video_id)
+            metrics = json.loads(metrics_path.read_text(encoding="utf-8")) if metrics_path.exists() else None
+            result["run"] = record_run(report, metrics)
+    return result
+
+
+def _known_video_ids() -> List[str]:
+    """raw_videos/ の動画ファイル名から video_id を集める（reindex --all 用）。"""
+    ids = set()
+    for p in get_raw_video_dir().iterdir():
+        if p.is_file() and not p.name.startswith("."):
+            ids.add(p.stem)
+    return sorted(ids)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="成果物カタログ（outputs/catalog.sqlite3）の確認と作り直し")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_reindex = sub.add_parser("reindex", help="outputs/ の下のファイルから記録を作り直す")
+    p_reindex.add_argument("video_ids", nargs="*")
+    p_reindex.add_argument("--all", action="store_true", help="raw_videos/ の全動画")
+
+    p_runs = sub.add_parser("runs", help="最近の実行")
+    p_runs.add_argument("video_id", nargs="?")
+    p_runs.add_argument("--limit", type=int, default=20)
+
+    p_frames = sub.add_parser("frames", help="動画のフレーム一覧")
+    p_frames.add_argument("video_id")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "runs":
+        for r in list_runs(args.video_id, limit=args.limit):
+            print(
+                f"#{r['id']:<5} {r['started_at']}  {r['video_id']:<30} "
+                f"{r['hits']} hit / {r['misses']} miss  {r['elapsed_sec']:.1f}s"
+            )
+        return 0
+
+    if args.command == "frames":
+        for f in list_frames(args.video_id):
+            flags = "".join(
+                [" blurry" if f["is_blurry"] else "", " dark" if f["is_too_dark"] else ""]
+            )
+            print(f"{f['frame_index']:>6} {f['time_sec']:>9.2f}s  {f['frame_path']}{flags}")
+        return 0
+
+    video_ids: List[str] = list(args.video_ids)
+    if args.all:
+        video_ids += _known_video_ids()
+    if not video_ids:
+        parser.error("video_id か --all を指定してください")
+    for vid in video_ids:
+        r = reindex(vid)
+        print(f"{vid}: {r['artifacts']} artifacts" + (f", run #{r['run']}" if r["run"] else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
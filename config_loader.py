@@ -7,7 +7,7 @@ from __future__ import annotations
 
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional
 import os
 
 import yaml
@@ -18,6 +18,20 @@ SETTINGS_PATH = CONFIG_DIR / "settings.yaml"
 MODELS_PATH = CONFIG_DIR / "models.yaml"
 
 
+# ベストショットのスコア重み（bestshot_scorer の特徴量名 -> 重み）。負の値は減点
+DEFAULT_BESTSHOT_WEIGHTS: Dict[str, float] = {
+    "cuteness": 1.0,
+    "interesting": 0.5,
+    "representative": 0.5,
+    "has_child": 0.5,
+    "center": 0.3,
+    "subject_size": 0.3,
+    "sharpness": 0.2,
+    "blurry": -0.5,
+    "too_dark": -0.5,
+}
+
+
 @dataclass
 class Settings:
     # データ保存ルート
@@ -26,12 +40,96 @@ class Settings:
     # 動画関連
     frame_interval_sec: float = 5.0
 
+    # 取り込み時の動画情報・デコード用プロキシ（video_ingest）
+    ingest_proxy_enabled: bool = False        # 重い動画（高解像度 / HEVC など）を軽い H.264 に変換して後段で使う
+    ingest_proxy_max_height: int = 720        # これより高い解像度の動画は縮小する
+    ingest_proxy_codecs: List[str] = field(default_factory=lambda: ["hevc", "vp9", "av1"])  # 常に変換するコーデック
+    ingest_proxy_crf: int = 23
+    ingest_proxy_preset: str = "veryfast"
+    ingest_proxy_gop_sec: float = 1.0         # キーフレーム間隔（短いほどシークが速い）
+
+    # フレーム画像のパック（frame_store）
+    frame_pack_enabled: bool = False                 # フレーム抽出後に1本ぶんを1つの zip にまとめる
+    frame_pack_keep_raw_days: Optional[float] = None # パック後に個別の画像を消すまでの日数（None なら消さない）
+
+    # フレームの見た目の特徴ベクトル（frame_embeddings）。類似画像検索とベストショットの多様性に使う
+    embeddings_enabled: bool = True
+
     # ベストショット
     max_bestshots: int = 2
+    bestshot_min_gap_sec: float = 10.0        # 選ばれたショット同士の最小時間間隔（時間方向 NMS）
+    bestshot_mmr_lambda: float = 0.7          # MMR のスコア重視度（1.0 で多様性を考慮しない）
+    bestshot_candidate_pool_factor: int = 5   # 多様性選択に回す候補数 = 残りの枠 × この値（除外で減ったら補充）
+    bestshot_duplicate_similarity: float = 0.95  # 選んだショットとの類似度がこれ以上の候補はほぼ同じ写真として外す
+    bestshot_weights: Dict[str, float] = field(
+        default_factory=lambda: dict(DEFAULT_BESTSHOT_WEIGHTS)
+    )
+    bestshot_thumbnail_sizes: List[int] = field(default_factory=lambda: [160, 320, 640])
+    bestshot_thumbnail_format: str = "webp"   # "webp" / "jpg"
+    bestshot_thumbnail_quality: int = 80
+
+    # キャプション（vision_captioner）
+    captioning_mode: str = "all"             # "all" / "candidates"（ローカル指標で絞った候補だけ解析）
+    captioning_candidate_factor: int = 4     # candidates モードの候補数 = max_bestshots × この値
+    captioning_person_detection: bool = False  # 候補選定に OpenCV HOG の人物検出を使うか
+    captioning_max_workers: int = 4          # 1本の動画内で並列に投げる Vision LLM 呼び出し数
+    captioning_prompt_version: str = "full-v1"  # Vision プロンプトの版（prompt_registry.py list で一覧）
+    captioning_max_reasks: int = 1           # 出力に欠けた項目があるとき、その項目だけを聞き直す回数の上限
 
     # 日記関連
     diary_max_chars: int = 500
     diary_language: str = "ja"
+    diary_condense: bool = True                 # caption を区間にまとめてからプロンプトに入れる
+    diary_similarity_threshold: float = 0.6     # 文字 bigram の Jaccard 類似度がこれ以上なら同じ場面
+    diary_prompt_token_budget: int = 3000       # 箇条書き部分のトークン予算（概算）
+    diary_mode: str = "auto"                    # "single" / "hierarchical" / "auto"
+    diary_chunk_minutes: float = 30.0           # 階層モードで要約する時間帯の長さ
+    diary_chunk_max_chars: int = 300            # 時間帯ごとの要約の最大文字数
+    diary_max_workers: int = 4                  # 時間帯ごとの要約を並列に生成する数
+
+    # アラート集約（alert_analyzer.AlertAggregator）
+    alert_gap_tolerance_sec: float = 6.0      # この秒数以内のヒットは同じ区間にまとめる
+    alert_enter_hits: int = 1                 # 区間を確定させるのに必要なヒット数
+    alert_exit_misses: int = 2                # 連続でこの回数ミスしたら区間を閉じる
+    alert_critical_duration_sec: float = 20.0 # この長さ以上続いたら critical
+    alert_critical_density: float = 0.8       # ヒット密度がこれ以上なら critical
+    alert_critical_min_hits: int = 3          # 密度による昇格に必要な最小ヒット数
+
+    # ライブ監視（live_monitor）
+    live_max_pending_frames: int = 2     # 解析待ちフレームの上限（超えたら古い方を捨てる）
+    live_poll_interval_sec: float = 0.5  # 伸長中ファイル / ストリームの再読込間隔
+    live_idle_timeout_sec: float = 30.0  # 新しいフレームが来なくなってから終了するまでの秒数
+
+    # 音声解析（audio_analyzer）
+    audio_enabled: bool = True
+    audio_sample_rate: int = 16000
+    audio_window_sec: float = 0.5
+    audio_hop_sec: float = 0.25
+    audio_loud_margin_db: float = 15.0     # 中央値からこれ以上大きい窓を「大きな音」とみなす
+    audio_min_loud_db: float = -35.0       # 絶対的な下限（dBFS）
+    audio_cry_band_ratio: float = 0.6      # 泣き声帯域（300〜3500Hz）のエネルギー比の下限
+    audio_cry_max_flatness: float = 0.3    # スペクトル平坦度の上限（泣き声は倍音的で低い）
+    audio_min_event_sec: float = 1.0       # これより短い区間はアラートにしない
+    audio_gap_sec: float = 1.5             # この秒数以内の途切れは同じ区間として扱う
+    audio_dense_interval_sec: float = 0.5  # 音声イベント周辺でのフレーム抽出間隔
+    audio_focus_padding_sec: float = 2.0   # 音声イベントの前後に足す秒数
+
+    # バッチ処理（batch_runner）
+    batch_workers: int = 2             # 並列に処理する動画数（プロセス数）
+    batch_api_concurrency: int = 4     # 全プロセス合計での LLM API 同時呼び出し数の上限
+
+    # バックグラウンドジョブ（job_queue）
+    jobs_workers: int = 2                 # Streamlit から起動しておくワーカープロセス数
+    jobs_poll_interval_sec: float = 1.0   # ワーカーが待ち行列を見に行く間隔 / 画面の更新間隔
+    jobs_stale_timeout_sec: float = 120.0 # heartbeat がこの秒数途絶えたジョブは拾い直す
+    jobs_max_attempts: int = 3            # ワーカーが落ちて拾い直すのはこの回数まで（超えたら failed）
+
+    # プロファイリング（profiler）。遅い実行の原因調査用で、普段は無効
+    profiling_enabled: bool = False
+    profiling_mode: str = "sampling"        # "sampling"（全スレッドのスタックを定期取得）/ "cprofile"
+    profiling_interval_ms: float = 5.0      # sampling のサンプル間隔
+    profiling_top_n: int = 30               # ホットスポット表に出す関数の数
+    profiling_memory: bool = True           # tracemalloc でステージごとのピークメモリを測る
 
     # ログなど
     log_level: str = "INFO"
@@ -71,11 +169,161 @@ def load_settings() -> Settings:
     if "max_bestshots" in raw:
         settings.max_bestshots = int(raw["max_bestshots"])
 
+    frame_store = raw.get("frame_store", {})
+    if "pack" in frame_store:
+        settings.frame_pack_enabled = bool(frame_store["pack"])
+    if "keep_raw_days" in frame_store:
+        days = frame_store["keep_raw_days"]
+        settings.frame_pack_keep_raw_days = None if days is None else float(days)
+
+    embeddings = raw.get("embeddings", {})
+    if "enabled" in embeddings:
+        settings.embeddings_enabled = bool(embeddings["enabled"])
+
+    ingest = raw.get("ingest", {})
+    proxy = ingest.get("proxy", {})
+    if "enabled" in proxy:
+        settings.ingest_proxy_enabled = bool(proxy["enabled"])
+    if "max_height" in proxy:
+        settings.ingest_proxy_max_height = int(proxy["max_height"])
+    if "codecs" in proxy:
+        settings.ingest_proxy_codecs = [str(c).lower() for c in proxy["codecs"]]
+    if "crf" in proxy:
+        settings.ingest_proxy_crf = int(proxy["crf"])
+    if "preset" in proxy:
+        settings.ingest_proxy_preset = str(proxy["preset"])
+    if "gop_sec" in proxy:
+        settings.ingest_proxy_gop_sec = float(proxy["gop_sec"])
+
+    bestshot = raw.get("bestshot", {})
+    if "min_gap_sec" in bestshot:
+        settings.bestshot_min_gap_sec = float(bestshot["min_gap_sec"])
+    if "mmr_lambda" in bestshot:
+        settings.bestshot_mmr_lambda = float(bestshot["mmr_lambda"])
+    if "candidate_pool_factor" in bestshot:
+        settings.bestshot_candidate_pool_factor = int(bestshot["candidate_pool_factor"])
+    if "duplicate_similarity" in bestshot:
+        settings.bestshot_duplicate_similarity = float(bestshot["duplicate_similarity"])
+    if "thumbnail_sizes" in bestshot:
+        settings.bestshot_thumbnail_sizes = [int(x) for x in bestshot["thumbnail_sizes"]]
+    if "thumbnail_format" in bestshot:
+        settings.bestshot_thumbnail_format = str(bestshot["thumbnail_format"]).lower().lstrip(".")
+    if "thumbnail_quality" in bestshot:
+        settings.bestshot_thumbnail_quality = int(bestshot["thumbnail_quality"])
+    if "weights" in bestshot:
+        settings.bestshot_weights.update(
+            {str(k): float(v) for k, v in (bestshot["weights"] or {}).items()}
+        )
+
+    captioning = raw.get("captioning", {})
+    if "mode" in captioning:
+        settings.captioning_mode = str(captioning["mode"])
+    if "candidate_factor" in captioning:
+        settings.captioning_candidate_factor = int(captioning["candidate_factor"])
+    if "person_detection" in captioning:
+        settings.captioning_person_detection = bool(captioning["person_detection"])
+    if "max_workers" in captioning:
+        settings.captioning_max_workers = int(captioning["max_workers"])
+    if "prompt_version" in captioning:
+        settings.captioning_prompt_version = str(captioning["prompt_version"])
+    if "max_reasks" in captioning:
+        settings.captioning_max_reasks = int(captioning["max_reasks"])
+
     diary = raw.get("diary", {})
     if "max_chars" in diary:
         settings.diary_max_chars = int(diary["max_chars"])
     if "language" in diary:
         settings.diary_language = str(diary["language"])
+    if "condense" in diary:
+        settings.diary_condense = bool(diary["condense"])
+    if "similarity_threshold" in diary:
+        settings.diary_similarity_threshold = float(diary["similarity_threshold"])
+    if "prompt_token_budget" in diary:
+        settings.diary_prompt_token_budget = int(diary["prompt_token_budget"])
+    if "mode" in diary:
+        settings.diary_mode = str(diary["mode"])
+    if "chunk_minutes" in diary:
+        settings.diary_chunk_minutes = float(diary["chunk_minutes"])
+    if "chunk_max_chars" in diary:
+        settings.diary_chunk_max_chars = int(diary["chunk_max_chars"])
+    if "max_workers" in diary:
+        settings.diary_max_workers = int(diary["max_workers"])
+
+    alerts = raw.get("alerts", {})
+    if "gap_tolerance_sec" in alerts:
+        settings.alert_gap_tolerance_sec = float(alerts["gap_tolerance_sec"])
+    if "enter_hits" in alerts:
+        settings.alert_enter_hits = int(alerts["enter_hits"])
+    if "exit_misses" in alerts:
+        settings.alert_exit_misses = int(alerts["exit_misses"])
+    if "critical_duration_sec" in alerts:
+        settings.alert_critical_duration_sec = float(alerts["critical_duration_sec"])
+    if "critical_density" in alerts:
+        settings.alert_critical_density = float(alerts["critical_density"])
+    if "critical_min_hits" in alerts:
+        settings.alert_critical_min_hits = int(alerts["critical_min_hits"])
+
+    live = raw.get("live", {})
+    if "max_pending_frames" in live:
+        settings.live_max_pending_frames = int(live["max_pending_frames"])
+    if "poll_interval_sec" in live:
+        settings.live_poll_interval_sec = float(live["poll_interval_sec"])
+    if "idle_timeout_sec" in live:
+        settings.live_idle_timeout_sec = float(live["idle_timeout_sec"])
+
+    audio = raw.get("audio", {})
+    if "enabled" in audio:
+        settings.audio_enabled = bool(audio["enabled"])
+    if "sample_rate" in audio:
+        settings.audio_sample_rate = int(audio["sample_rate"])
+    if "window_sec" in audio:
+        settings.audio_window_sec = float(audio["window_sec"])
+    if "hop_sec" in audio:
+        settings.audio_hop_sec = float(audio["hop_sec"])
+    if "loud_margin_db" in audio:
+        settings.audio_loud_margin_db = float(audio["loud_margin_db"])
+    if "min_loud_db" in audio:
+        settings.audio_min_loud_db = float(audio["min_loud_db"])
+    if "cry_band_ratio" in audio:
+        settings.audio_cry_band_ratio = float(audio["cry_band_ratio"])
+    if "cry_max_flatness" in audio:
+        settings.audio_cry_max_flatness = float(audio["cry_max_flatness"])
+    if "min_event_sec" in audio:
+        settings.audio_min_event_sec = float(audio["min_event_sec"])
+    if "gap_sec" in audio:
+        settings.audio_gap_sec = float(audio["gap_sec"])
+    if "dense_interval_sec" in audio:
+        settings.audio_dense_interval_sec = float(audio["dense_interval_sec"])
+    if "focus_padding_sec" in audio:
+        settings.audio_focus_padding_sec = float(audio["focus_padding_sec"])
+
+    batch = raw.get("batch", {})
+    if "workers" in batch:
+        settings.batch_workers = int(batch["workers"])
+    if "api_concurrency" in batch:
+        settings.batch_api_concurrency = int(batch["api_concurrency"])
+
+    jobs = raw.get("jobs", {})
+    if "workers" in jobs:
+        settings.jobs_workers = int(jobs["workers"])
+    if "poll_interval_sec" in jobs:
+        settings.jobs_poll_interval_sec = float(jobs["poll_interval_sec"])
+    if "stale_timeout_sec" in jobs:
+        settings.jobs_stale_timeout_sec = float(jobs["stale_timeout_sec"])
+    if "max_attempts" in jobs:
+        settings.jobs_max_attempts = int(jobs["max_attempts"])
+
+    profiling = raw.get("profiling", {})
+    if "enabled" in profiling:
+        settings.profiling_enabled = bool(profiling["enabled"])
+    if "mode" in profiling:
+        settings.profiling_mode = str(profiling["mode"])
+    if "interval_ms" in profiling:
+        settings.profiling_interval_ms = float(profiling["interval_ms"])
+    if "top_n" in profiling:
+        settings.profiling_top_n = int(profiling["top_n"])
+    if "memory" in profiling:
+        settings.profiling_memory = bool(profiling["memory"])
 
     if "logging" in raw and "level" in raw["logging"]:
         settings.log_level = str(raw["logging"]["level"])
@@ -10,7 +10,11 @@ backend:
 
 from __future__ import annotations
 
-from typing import List
+import hashlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import importlib
 import paths
@@ -19,6 +23,8 @@ import jsonl_io
 import config_loader
 import model_loader
 import prompt_templates
+import caption_condenser
+import instrumentation
 
 importlib.reload(paths)
 importlib.reload(schemas)
@@ -26,16 +32,30 @@ importlib.reload(jsonl_io)
 importlib.reload(config_loader)
 importlib.reload(model_loader)
 importlib.reload(prompt_templates)
+importlib.reload(caption_condenser)
+importlib.reload(instrumentation)
 
-from paths import get_analysis_path, get_diary_path
+from paths import (
+    get_analysis_path,
+    get_diary_path,
+    get_diary_stats_path,
+    get_diary_chunk_path,
+)
 from schemas import FrameAnalysis
 from jsonl_io import read_jsonl_as_dataclasses
 from config_loader import SETTINGS
-from model_loader import load_model_for_role
-from prompt_templates import build_diary_prompt
+from model_loader import api_slot, load_model_for_role
+from prompt_templates import (
+    build_diary_prompt,
+    build_diary_prompt_from_lines,
+    build_chunk_summary_prompt,
+    build_diary_reduce_prompt,
+)
+from caption_condenser import condensed_caption_lines, estimate_tokens, format_timestamp
+from instrumentation import bind_stage, count, record_usage
 
 
-def _call_text_model_gemini(model_info, prompt: str) -> str:
+def _call_text_model_gemini(model_info, prompt: str, max_chars: Optional[int] = None) -> str:
     """
     Gemini Text モデルを呼び出して日記テキストを生成する。
     """
@@ -46,15 +66,16 @@ def _call_text_model_gemini(model_info, prompt: str) -> str:
         model=model_name,
         contents=prompt,
     )
+    record_usage(resp)
     text = resp.text or ""
     # 文字数制限に合わせて切り詰め
-    max_chars = SETTINGS.diary_max_chars
+    max_chars = max_chars or SETTINGS.diary_max_chars
     if len(text) > max_chars:
         text = text[: max_chars - 3] + "..."
     return text.strip()
 
 
-def _call_text_model_sambanova(model_info, prompt: str) -> str:
+def _call_text_model_sambanova(model_info, prompt: str, max_chars: Optional[int] = None) -> str:
     """
     SambaNova API (Llama) Text モデルを呼び出して日記テキストを生成する。
     """
@@ -72,16 +93,17 @@ def _call_text_model_sambanova(model_info, prompt: str) -> str:
         temperature=0.2,
         top_p=0.9,
     )
+    record_usage(response)
 
     text = response.choices[0].message.content or ""
     # 文字数制限に合わせて切り詰め
-    max_chars = SETTINGS.diary_max_chars
+    max_chars = max_chars or SETTINGS.diary_max_chars
     if len(text) > max_chars:
         text = text[: max_chars - 3] + "..."
     return text.strip()
 
 
-def _call_text_model_dummy(prompt: str) -> str:
+def _call_text_model_dummy(prompt: str, max_chars: Optional[int] = None) -> str:
     """
     LLM を使わないダミー実装。
     prompt 内の "- " で始まる行を抜き出して簡単な日記を組み立てる。
@@ -106,16 +128,264 @@ def _call_text_model_dummy(prompt: str) -> str:
 
         diary = "\n".join(diary_lines)
 
-    max_chars = SETTINGS.diary_max_chars
+    max_chars = max_chars or SETTINGS.diary_max_chars
     if len(diary) > max_chars:
         diary = diary[: max_chars - 3] + "..."
     return diary
 
 
+def _stream_text_model_gemini(model_info, prompt: str) -> Iterator[str]:
+    """
+    Gemini Text モデルをストリーミングで呼び出し、テキスト片を順に返す。
+    usage_metadata は各チャンクに累計で付くので、最後に受け取ったチャンクの分だけ記録する
+    （途中で読むのをやめた場合もそこまでの分を記録する）。
+    """
+    client = model_info["client"]
+    model_name = model_info["model_name"]
+
+    last = None
+    try:
+        for chunk in client.models.generate_content_stream(
+            model=model_name,
+            contents=prompt,
+        ):
+            last = chunk
+            if chunk.text:
+                yield chunk.text
+    finally:
+        if last is not None:
+            record_usage(last)
+
+
+def _stream_text_model_sambanova(model_info, prompt: str) -> Iterator[str]:
+    """
+    SambaNova API (Llama) Text モデルをストリーミング（stream=True）で呼び出し、テキスト片を順に返す。
+    トークン数は stream_options.include_usage で最後のチャンクに付けてもらい、記録する。
+    """
+    client = model_info["client"]
+    model_name = model_info["model_name"]
+
+    stream = client.chat.completions.create(
+        model=model_name,
+        messages=[
+            {
+                "role": "user",
+                "content": [{"type": "text", "text": prompt}],
+            }
+        ],
+        temperature=0.2,
+        top_p=0.9,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    for chunk in stream:
+        if getattr(chunk, "usage", None) is not None:
+            record_usage(chunk)
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            yield delta
+
+
+def _stream_text_model_dummy(prompt: str) -> Iterator[str]:
+    """ダミー実装の日記を、行単位でストリーミング風に返す。"""
+    for line in _call_text_model_dummy(prompt).splitlines(keepends=True):
+        yield line
+
+
+def _stream_text_model(model_info: Dict[str, Any], prompt: str) -> Iterator[str]:
+    backend = model_info["backend"]
+    if backend == "gemini":
+        stream = _stream_text_model_gemini(model_info, prompt)
+    elif backend == "sambanova":
+        stream = _stream_text_model_sambanova(model_info, prompt)
+    else:
+        stream = _stream_text_model_dummy(prompt)
+    with api_slot(model_info.get("role", "diary_writer")):
+        yield from stream
+
+
+def _truncate_stream(chunks: Iterable[str], max_chars: int) -> Iterator[str]:
+    """
+    テキスト片を max_chars 文字まで流す。超える場合は非ストリーミング版と同じく
+    末尾を "..." にして打ち切る（そのために最後の3文字分だけは確定するまで出さない）。
+    先頭の空白は落とす。
+    """
+    limit = max(max_chars - 3, 0)
+    emitted = 0
+    pending = ""
+    for piece in chunks:
+        if not emitted and not pending:
+            piece = piece.lstrip()
+        pending += piece
+        if emitted + len(pending) > max_chars:
+            yield pending[: limit - emitted] + "..."
+            return
+        safe = max(limit - emitted, 0)
+        out, pending = pending[:safe], pending[safe:]
+        if out:
+            emitted += len(out)
+            yield out
+    if pending:
+        yield pending
+
+
+def _call_text_model(model_info: Dict[str, Any], prompt: str, max_chars: Optional[int] = None) -> str:
+    backend = model_info["backend"]
+    with api_slot(model_info.get("role", "diary_writer")):
+        if backend == "gemini":
+            return _call_text_model_gemini(model_info, prompt, max_chars)
+        if backend == "sambanova":
+            return _call_text_model_sambanova(model_info, prompt, max_chars)
+        return _call_text_model_dummy(prompt, max_chars)
+
+
+def _caption_lines(frames: List[FrameAnalysis]) -> List[str]:
+    if SETTINGS.diary_condense:
+        # 似た caption を区間にまとめ、トークン予算内に収める
+        return condensed_caption_lines(frames, language=SETTINGS.diary_language)
+    return [f"- {fa.caption}" for fa in frames]
+
+
+def _use_hierarchical(frames: List[FrameAnalysis]) -> bool:
+    mode = SETTINGS.diary_mode
+    if mode == "hierarchical":
+        return True
+    if mode == "auto":
+        times = [fa.time_sec for fa in frames]
+        return max(times) - min(times) > SETTINGS.diary_chunk_minutes * 60.0
+    return False
+
+
+def _summarize_chunk(
+    video_id: str,
+    model_info: Dict[str, Any],
+    chunk_index: int,
+    frames: List[FrameAnalysis],
+    chunk_sec: float,
+) -> Tuple[str, str, bool]:
+    """
+    1つの時間帯の要約を生成する（map 段）。
+    プロンプトとモデルのハッシュでキャッシュし、同じ入力なら LLM を呼ばない。
+    戻り値: (時間帯ラベル, 要約, キャッシュヒットしたか)
+    """
+    time_range = (
+        f"{format_timestamp(chunk_index * chunk_sec)}-{format_timestamp((chunk_index + 1) * chunk_sec)}"
+    )
+    prompt = build_chunk_summary_prompt(
+        _caption_lines(frames),
+        time_range=time_range,
+        max_chars=SETTINGS.diary_chunk_max_chars,
+        language=SETTINGS.diary_language,
+    )
+    key = f"{model_info['backend']}\n{model_info['model_name']}\n{prompt}"
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    cache_path = get_diary_chunk_path(video_id, chunk_index, digest)
+    if cache_path.exists():
+        count("cache_hits")
+        return time_range, cache_path.read_text(encoding="utf-8"), True
+    count("cache_misses")
+
+    summary = _call_text_model(model_info, prompt, SETTINGS.diary_chunk_max_chars)
+
+    # 同じ時間帯の古いキャッシュ（入力が変わる前のもの）は消しておく
+    for old in cache_path.parent.glob(f"chunk_{chunk_index:04d}_*.txt"):
+        if old != cache_path:
+            old.unlink()
+    cache_path.write_text(summary, encoding="utf-8")
+    return time_range, summary, False
+
+
+def _build_hierarchical_prompt(
+    video_id: str,
+    frames: List[FrameAnalysis],
+    model_info: Dict[str, Any],
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    時間帯ごとに要約（map, 並列）→ 要約群から日記を書かせる reduce プロンプトを返す。
+    時間帯の区切りは動画の先頭からの固定長なので、映像が追記されても既存の区切りは変わらず、
+    再計算されるのは入力が変わった時間帯（通常は末尾と新しい時間帯）だけになる。
+    """
+    chunk_sec = SETTINGS.diary_chunk_minutes * 60.0
+    chunks: Dict[int, List[FrameAnalysis]] = {}
+    for fa in sorted(frames, key=lambda f: f.time_sec):
+        chunks.setdefault(int(fa.time_sec // chunk_sec), []).append(fa)
+
+    with ThreadPoolExecutor(max_workers=max(SETTINGS.diary_max_workers, 1)) as pool:
+        results = list(
+            pool.map(
+                bind_stage(lambda item: _summarize_chunk(video_id, model_info, item[0], item[1], chunk_sec)),
+                sorted(chunks.items()),
+            )
+        )
+
+    summary_lines = [
+        f"- [{time_range}] {' '.join(summary.split())}" for time_range, summary, _ in results
+    ]
+    prompt = build_diary_reduce_prompt(
+        summary_lines,
+        max_chars=SETTINGS.diary_max_chars,
+        language=SETTINGS.diary_language,
+    )
+    stats = {
+        "chunks": len(results),
+        "chunk_cache_hits": sum(1 for _, _, hit in results if hit),
+    }
+    return prompt, stats
+
+
+def prepare_diary_prompt(
+    video_id: str,
+    frames: List[FrameAnalysis],
+    model_info: Dict[str, Any],
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    最終的に LLM に送る日記プロンプトを組み立てる（階層モードでは map 段の LLM 呼び出しもここで行う）。
+    戻り値: (プロンプト, 統計情報)
+    """
+    full_prompt = build_diary_prompt(
+        frame_analyses=frames,
+        max_chars=SETTINGS.diary_max_chars,
+        language=SETTINGS.diary_language,
+    )
+
+    stats: Dict[str, Any] = {
+        "video_id": video_id,
+        "backend": model_info["backend"],
+        "num_frames": len(frames),
+        "condensed": SETTINGS.diary_condense,
+        "mode": "single",
+    }
+
+    if _use_hierarchical(frames):
+        prompt, chunk_stats = _build_hierarchical_prompt(video_id, frames, model_info)
+        stats["mode"] = "hierarchical"
+        stats.update(chunk_stats)
+    else:
+        prompt = build_diary_prompt_from_lines(
+            _caption_lines(frames),
+            max_chars=SETTINGS.diary_max_chars,
+            language=SETTINGS.diary_language,
+        )
+
+    # プロンプト圧縮の効果（圧縮前はプロンプトを組み立てただけで送っていない）
+    stats.update(
+        {
+            "prompt_chars_full": len(full_prompt),
+            "prompt_tokens_full_est": estimate_tokens(full_prompt),
+            "prompt_chars": len(prompt),
+            "prompt_tokens_est": estimate_tokens(prompt),
+        }
+    )
+    return prompt, stats
+
+
 def generate_diary(video_id: str) -> str:
     """
     analysis/{video_id}_analysis.jsonl を読み込み、1本の日記テキストを生成。
     diary/{video_id}_diary.md に保存してテキストを返す。
+    長い動画（diary.mode: auto / hierarchical）では時間帯ごとの要約を経由する。
     """
     analysis_path = get_analysis_path(video_id)
     frames: List[FrameAnalysis] = read_jsonl_as_dataclasses(analysis_path, FrameAnalysis)
@@ -123,25 +393,60 @@ def generate_diary(video_id: str) -> str:
         print(f"No analysis found: {analysis_path}")
         return ""
 
-    prompt = build_diary_prompt(
-        frame_analyses=frames,
-        max_chars=SETTINGS.diary_max_chars,
-        language=SETTINGS.diary_language,
-    )
+    model_info = load_model_for_role("diary_writer")
+
+    started = time.perf_counter()
+    prompt, stats = prepare_diary_prompt(video_id, frames, model_info)
+    prepared = time.perf_counter()
+    diary_text = _call_text_model(model_info, prompt)
+    finished = time.perf_counter()
+
+    stats["map_latency_sec"] = round(prepared - started, 3)
+    stats["latency_sec"] = round(finished - prepared, 3)
+    _write_diary(video_id, diary_text, stats)
+    return diary_text
+
+
+def stream_diary(video_id: str) -> Iterator[str]:
+    """
+    generate_diary のストリーミング版。日記テキストを生成されたそばから返すジェネレータ。
+    Streamlit の st.write_stream にそのまま渡せる。
+    最後まで読み切った時点で diary/{video_id}_diary.md と統計情報を書き出す。
+    """
+    analysis_path = get_analysis_path(video_id)
+    frames: List[FrameAnalysis] = read_jsonl_as_dataclasses(analysis_path, FrameAnalysis)
+    if not frames:
+        print(f"No analysis found: {analysis_path}")
+        return
 
     model_info = load_model_for_role("diary_writer")
-    backend = model_info["backend"]
 
-    if backend == "gemini":
-        diary_text = _call_text_model_gemini(model_info, prompt)
-    elif backend == "sambanova":
-        diary_text = _call_text_model_sambanova(model_info, prompt)
-    else:
-        diary_text = _call_text_model_dummy(prompt)
+    started = time.perf_counter()
+    prompt, stats = prepare_diary_prompt(video_id, frames, model_info)
+    prepared = time.perf_counter()
+
+    pieces: List[str] = []
+    first_token_at: Optional[float] = None
+    for piece in _truncate_stream(_stream_text_model(model_info, prompt), SETTINGS.diary_max_chars):
+        if first_token_at is None:
+            first_token_at = time.perf_counter()
+        pieces.append(piece)
+        yield piece
+    finished = time.perf_counter()
+
+    stats["map_latency_sec"] = round(prepared - started, 3)
+    stats["time_to_first_token_sec"] = round((first_token_at or finished) - started, 3)
+    stats["latency_sec"] = round(finished - prepared, 3)
+    stats["streamed"] = True
+    _write_diary(video_id, "".join(pieces).strip(), stats)
 
+
+def _write_diary(video_id: str, diary_text: str, stats: Dict[str, Any]) -> None:
     out_path = get_diary_path(video_id)
     out_path.parent.mkdir(parents=True, exist_ok=True)
     out_path.write_text(diary_text, encoding="utf-8")
 
+    get_diary_stats_path(video_id).write_text(
+        json.dumps(stats, ensure_ascii=False, indent=2), encoding="utf-8"
+    )
     print(f"Wrote diary markdown: {out_path}")
-    return diary_text
@@ -0,0 +1,262 @@
+"""
+フレームの見た目の特徴ベクトル（embedding）と、それを使った「似ている写真」の検索。
+
+- embed_image: 色（HSV の 8×4×4 ヒストグラム）と形（64×64 の HOG、4×4 セル × 9 方向）をつないだ
+  EMBED_DIM 次元の float32 ベクトル。長さ 1 に正規化してあるので内積がそのままコサイン類似度（0〜1）
+- frame_preprocessor がフレームを読んだついでに計算し、動画ごとに embeddings/{video_id}_emb.npy
+  （フレーム数 × 次元）と、各行のフレーム番号 embeddings/{video_id}_emb_frames.npy に保存する
+- search_similar / similar_frames: 全動画の .npy を memmap で開き、BLOCK_ROWS 行ずつ内積を取って上位 k 件を残す
+  （総当たり。1年分・数十万フレームでも 1 クエリ数百 ms 程度なので、近似索引は持たない）
+- bestshot_scorer は同じベクトルで候補同士の類似度を測る（多様性の MMR と、ほぼ同じ写真の除外）
+
+実行例:
+    python frame_embeddings.py build --all
+    python frame_embeddings.py similar 20240501_093000_ui 120 -k 10
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import cv2  # type: ignore
+import numpy as np  # type: ignore
+
+import importlib
+import paths
+import jsonl_io
+import catalog
+import frame_store
+import instrumentation
+
+importlib.reload(paths)
+importlib.reload(jsonl_io)
+importlib.reload(catalog)
+importlib.reload(frame_store)
+importlib.reload(instrumentation)
+
+from paths import get_embedding_frames_path, get_embedding_path, get_manifest_path
+from jsonl_io import read_jsonl_as_dicts
+from catalog import list_frames, list_videos
+from frame_store import read_frame_image
+from instrumentation import count
+
+
+COLOR_BINS = (8, 4, 4)      # H, S, V
+HOG_SIZE = 64               # HOG を取る画像の一辺（px）
+HOG_CELL = 16
+HOG_BINS = 9
+COLOR_WEIGHT = 0.5          # 類似度のうち色が占める割合（残りが HOG）
+EMBED_DIM = int(np.prod(COLOR_BINS)) + (HOG_SIZE // HOG_CELL) ** 2 * HOG_BINS   # 128 + 144 = 272
+
+BLOCK_ROWS = 65536          # 検索で一度に内積を取る行数（メモリ使用量はこれ × 次元 × 4 バイトで頭打ち）
+
+# HOG の各画素が入るセル番号（cv2.HOGDescriptor は OpenCV のビルドによって無いので numpy で数える）
+_CELL_ID = (
+    (np.arange(HOG_SIZE)[:, None] // HOG_CELL) * (HOG_SIZE // HOG_CELL)
+    + np.arange(HOG_SIZE)[None, :] // HOG_CELL
+).ravel()
+
+
+def _hog(gray: np.ndarray) -> np.ndarray:
+    """HOG_SIZE 四方のグレー画像の、セルごとの勾配方向ヒストグラム（向きは区別しない 0〜180°）。"""
+    g = gray.astype(np.float32)
+    gx = cv2.Sobel(g, cv2.CV_32F, 1, 0, ksize=1)
+    gy = cv2.Sobel(g, cv2.CV_32F, 0, 1, ksize=1)
+    mag, ang = cv2.cartToPolar(gx, gy, angleInDegrees=True)
+    bins = (np.mod(ang, 180.0) * (HOG_BINS / 180.0)).astype(np.int64).ravel() % HOG_BINS
+    n_cells = (HOG_SIZE // HOG_CELL) ** 2
+    return np.bincount(_CELL_ID * HOG_BINS + bins, weights=mag.ravel(), minlength=n_cells * HOG_BINS).astype(np.float32)
+
+
+def embed_image(img: np.ndarray) -> np.ndarray:
+    """BGR 画像の特徴ベクトル（EMBED_DIM 次元、長さ 1）。"""
+    small = cv2.resize(img, (HOG_SIZE * 2, HOG_SIZE * 2), interpolation=cv2.INTER_AREA)
+
+    hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+    hist = cv2.calcHist([hsv], [0, 1, 2], None, list(COLOR_BINS), [0, 180, 0, 256, 0, 256]).ravel()
+    # 割合の平方根（Hellinger）。これで長さ 1 になり、内積が Bhattacharyya 係数になる
+    hist = np.sqrt(hist / max(float(hist.sum()), 1.0))
+
+    gray = cv2.cvtColor(cv2.resize(small, (HOG_SIZE, HOG_SIZE), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+    hog = _hog(gray)
+    hog = hog / max(float(np.linalg.norm(hog)), 1e-6)
+
+    return np.concatenate([np.sqrt(COLOR_WEIGHT) * hist, np.sqrt(1.0 - COLOR_WEIGHT) * hog]).astype(np.float32)
+
+
+# ---------------------------------------------------------------------------
+# 保存・読み込み
+# ---------------------------------------------------------------------------
+
+def save_embeddings(video_id: str, frame_indices: Sequence[int], vectors: Sequence[np.ndarray]) -> None:
+    emb = np.asarray(vectors, dtype=np.float32).reshape(len(frame_indices), EMBED_DIM)
+    frames = np.asarray(frame_indices, dtype=np.int32)
+    for path, arr in ((get_embedding_path(video_id), emb), (get_embedding_frames_path(video_id), frames)):
+        tmp = path.with_name(f".{path.stem}.part.npy")
+        np.save(tmp, arr)
+        os.replace(tmp, path)
+        count("bytes_written", path.stat().st_size)
+
+
+def load_embeddings(video_id: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """(特徴ベクトル（memmap, フレーム数 × 次元）, 各行のフレーム番号)。無い・壊れていれば None。"""
+    emb_path, frames_path = get_embedding_path(video_id), get_embedding_frames_path(video_id)
+    if not emb_path.exists() or not frames_path.exists():
+        return None
+    try:
+        emb = np.load(emb_path, mmap_mode="r")
+        frames = np.load(frames_path)
+    except ValueError as e:
+        print(f"[WARN] Broken embeddings, ignoring: {emb_path} ({e})")
+        return None
+    if emb.ndim != 2 or emb.shape[1] != EMBED_DIM or len(frames) != len(emb):
+        print(f"[WARN] Embeddings do not match this version, ignoring: {emb_path}")
+        return None
+    return emb, frames
+
+
+def frame_vectors(video_id: str) -> Dict[int, np.ndarray]:
+    """フレーム番号 -> 特徴ベクトル（無ければ空）。"""
+    loaded = load_embeddings(video_id)
+    if loaded is None:
+        return {}
+    emb, frames = loaded
+    return {int(fi): emb[row] for row, fi in enumerate(frames)}
+
+
+def build_embeddings(video_id: str) -> int:
+    """
+    マニフェストのフレームを読み直して特徴ベクトルを作る（前処理より前の成果物の取り込み用）。
+    戻り値: ベクトルを作ったフレーム数
+    """
+    indices: List[int] = []
+    vectors: List[np.ndarray] = []
+    for r in read_jsonl_as_dicts(get_manifest_path(video_id)):
+        img = read_frame_image(r["frame_path"])
+        if img is None:
+            continue
+        indices.append(int(r["frame_index"]))
+        vectors.append(embed_image(img))
+    if indices:
+        save_embeddings(video_id, indices, vectors)
+    return len(indices)
+
+
+# ---------------------------------------------------------------------------
+# 検索
+# ---------------------------------------------------------------------------
+
+def indexed_video_ids() -> List[str]:
+    """特徴ベクトルがある動画（カタログに記録された動画のうち）。"""
+    return [v["video_id"] for v in list_videos() if get_embedding_path(v["video_id"]).exists()]
+
+
+def search_similar(
+    query: np.ndarray,
+    k: int = 12,
+    video_ids: Optional[Sequence[str]] = None,
+    exclude: Sequence[Tuple[str, int]] = (),
+    block_rows: int = BLOCK_ROWS,
+) -> List[Tuple[str, int, float]]:
+    """
+    query に似たフレームを類似度の高い順に k 件。戻り値: [(video_id, frame_index, 類似度)]
+    video_ids: 探す動画（省略時は indexed_video_ids()）
+    exclude: 結果に含めない (video_id, frame_index)（問い合わせたフレーム自身など）
+    """
+    query = np.asarray(query, dtype=np.float32)
+    excluded = set(exclude)
+    want = k + len(excluded)
+
+    best_scores = np.empty(0, dtype=np.float32)
+    best_refs: List[Tuple[str, int]] = []
+    for vid in video_ids if video_ids is not None else indexed_video_ids():
+        loaded = load_embeddings(vid)
+        if loaded is None:
+            continue
+        emb, frames = loaded
+        for start in range(0, len(emb), block_rows):
+            sims = np.asarray(emb[start:start + block_rows]) @ query
+            top = np.argpartition(-sims, want - 1)[:want] if len(sims) > want else np.arange(len(sims))
+            best_scores = np.concatenate([best_scores, sims[top]])
+            best_refs += [(vid, int(frames[start + i])) for i in top]
+            if len(best_scores) > want:
+                keep = np.argpartition(-best_scores, want - 1)[:want]
+                best_scores = best_scores[keep]
+                best_refs = [best_refs[i] for i in keep]
+
+    order = np.argsort(-best_scores, kind="stable")
+    hits = [(best_refs[i][0], best_refs[i][1], float(best_scores[i])) for i in order]
+    return [h for h in hits if (h[0], h[1]) not in excluded][:k]
+
+
+def similar_frames(
+    video_id: str,
+    frame_index: int,
+    k: int = 12,
+    include_same_video: bool = True,
+) -> List[Dict[str, Any]]:
+    """
+    video_id のフレーム frame_index に似たフレーム（全動画から。自分自身は除く）。
+    戻り値の各要素: video_id, frame_index, time_sec, frame_path, similarity
+    """
+    vectors = frame_vectors(video_id)
+    if frame_index not in vectors:
+        return []
+    video_ids = indexed_video_ids()
+    if not include_same_video:
+        video_ids = [v for v in video_ids if v != video_id]
+    hits = search_similar(vectors[frame_index], k=k, video_ids=video_ids, exclude=[(video_id, frame_index)])
+
+    frames_by_video: Dict[str, Dict[int, Dict[str, Any]]] = {}
+    results = []
+    for vid, fi, sim in hits:
+        if vid not in frames_by_video:
+            frames_by_video[vid] = {f["frame_index"]: f for f in list_frames(vid)}
+        f = frames_by_video[vid].get(fi)
+        if f is None:
+            continue
+        results.append(
+            {"video_id": vid, "frame_index": fi, "time_sec": f["time_sec"], "frame_path": f["frame_path"], "similarity": sim}
+        )
+    return results
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="フレームの特徴ベクトルの作成と、似ているフレームの検索")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_build = sub.add_parser("build", help="マニフェストのフレームから特徴ベクトルを作る")
+    p_build.add_argument("video_ids", nargs="*")
+    p_build.add_argument("--all", action="store_true", help="カタログに記録された全動画（特徴ベクトルが無いもの）")
+
+    p_similar = sub.add_parser("similar", help="似ているフレームを探す")
+    p_similar.add_argument("video_id")
+    p_similar.add_argument("frame_index", type=int)
+    p_similar.add_argument("-k", type=int, default=10)
+    p_similar.add_argument("--other-videos", action="store_true", help="同じ動画のフレームは除く")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "similar":
+        hits = similar_frames(args.video_id, args.frame_index, k=args.k, include_same_video=not args.other_videos)
+        for h in hits:
+            print(f"{h['similarity']:.3f}  {h['video_id']:<30} {h['time_sec']:>9.2f}s  {h['frame_path']}")
+        if not hits:
+            print("No similar frames (no embeddings for this frame?)")
+        return 0
+
+    video_ids: List[str] = list(args.video_ids)
+    if args.all:
+        video_ids += [v["video_id"] for v in list_videos() if not get_embedding_path(v["video_id"]).exists()]
+    if not video_ids:
+        parser.error("video_id か --all を指定してください")
+    for vid in video_ids:
+        print(f"{vid}: {build_embeddings(vid)} frames")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,15 @@
 """
 動画から一定間隔でフレーム画像を抽出し、FrameMeta のリストとして返すモジュール。
 OpenCV を想定。Colab では !pip install opencv-python が必要。
+
+video_ingest で作ったプロキシ動画があればそちらを読み、fps も取り込み時に調べた値を使う。
+保存しないフレームは grab() だけで進め、画像への変換（retrieve）は保存するフレームだけ行う。
 """
 
 from __future__ import annotations
 
 from pathlib import Path
-from typing import List
+from typing import List, Optional, Sequence, Tuple, Union
 
 import cv2  # type: ignore
 
@@ -14,47 +17,93 @@ import importlib
 import config_loader
 import paths
 import schemas
+import instrumentation
+import video_ingest
 
 importlib.reload(config_loader)
 importlib.reload(paths)
 importlib.reload(schemas)
+importlib.reload(instrumentation)
+importlib.reload(video_ingest)
 
 from config_loader import SETTINGS
-from paths import get_raw_video_path, get_frame_path
+from paths import forget_dirs, get_raw_video_path, get_frame_path
 from schemas import FrameMeta
+from instrumentation import count, count_file_bytes
+from video_ingest import decode_source
+
+
+def open_capture(source: Union[str, Path]) -> "cv2.VideoCapture":
+    """
+    ファイルパス / ストリーム URL (rtsp://, http:// など) から VideoCapture を開く。
+    """
+    cap = cv2.VideoCapture(str(source))
+    if not cap.isOpened():
+        raise RuntimeError(f"Cannot open video: {source}")
+    return cap
 
 
-def extract_frames(video_id: str) -> List[FrameMeta]:
+def write_frame(video_id: str, saved_index: int, frame) -> Path:
+    """
+    切り出したフレーム画像を規定のパスに保存し、そのパスを返す。
+    """
+    out_path = get_frame_path(video_id, saved_index)
+    if not cv2.imwrite(str(out_path), frame):
+        # 実行中にディレクトリが消された場合など。作り直して1回だけやり直す
+        forget_dirs()
+        out_path = get_frame_path(video_id, saved_index)
+        if not cv2.imwrite(str(out_path), frame):
+            raise RuntimeError(f"Cannot write frame: {out_path}")
+    count_file_bytes("bytes_written", out_path)
+    return out_path
+
+
+def extract_frames(
+    video_id: str,
+    focus_segments: Optional[Sequence[Tuple[float, float]]] = None,
+) -> List[FrameMeta]:
     """
     video_id に対応する動画ファイルから、設定された間隔ごとにフレームを抽出する。
+    focus_segments（(start_sec, end_sec) の昇順リスト。audio_analyzer などが作る）の中では
+    SETTINGS.audio_dense_interval_sec の間隔でより密に抽出する。
     戻り値: FrameMeta のリスト
     """
-    video_path = get_raw_video_path(video_id)
-    if not video_path.exists():
-        raise FileNotFoundError(f"Video not found: {video_path}")
+    raw_path = get_raw_video_path(video_id)
+    if not raw_path.exists():
+        raise FileNotFoundError(f"Video not found: {raw_path}")
 
-    cap = cv2.VideoCapture(str(video_path))
-    if not cap.isOpened():
-        raise RuntimeError(f"Cannot open video: {video_path}")
+    video_path, info = decode_source(video_id)
+    cap = open_capture(video_path)
+    count_file_bytes("bytes_read", video_path)
 
-    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    fps = (info or {}).get("fps") or cap.get(cv2.CAP_PROP_FPS)
+    if not fps:
+        print(f"[WARN] fps が分からないため 30fps とみなします: {video_path}")
+        fps = 30.0
     interval_sec = SETTINGS.frame_interval_sec
     interval_frames = max(int(round(fps * interval_sec)), 1)
+    dense_frames = max(int(round(fps * SETTINGS.audio_dense_interval_sec)), 1)
+    segments = sorted(focus_segments or [])
+    seg_pos = 0
 
     frame_metas: List[FrameMeta] = []
     frame_index = 0
     saved_index = 0
 
     while True:
-        ret, frame = cap.read()
-        if not ret:
+        if not cap.grab():
             break
 
-        if frame_index % interval_frames == 0:
-            time_sec = frame_index / fps
-            out_path = get_frame_path(video_id, saved_index)
-            out_path.parent.mkdir(parents=True, exist_ok=True)
-            cv2.imwrite(str(out_path), frame)
+        time_sec = frame_index / fps
+        while seg_pos < len(segments) and segments[seg_pos][1] < time_sec:
+            seg_pos += 1
+        in_focus = seg_pos < len(segments) and segments[seg_pos][0] <= time_sec
+
+        if frame_index % interval_frames == 0 or (in_focus and frame_index % dense_frames == 0):
+            ret, frame = cap.retrieve()
+            if not ret:
+                break
+            out_path = write_frame(video_id, saved_index, frame)
             frame_metas.append(
                 FrameMeta(
                     video_id=video_id,
@@ -68,4 +117,5 @@ def extract_frames(video_id: str) -> List[FrameMeta]:
         frame_index += 1
 
     cap.release()
+    count("frames_processed", len(frame_metas))
     return frame_metas
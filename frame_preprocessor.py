@@ -1,10 +1,12 @@
 """
 抽出したフレーム画像に対して、リサイズや簡単な画質チェックを行うモジュール。
 （ブレ判定や暗さ判定など）
+読んだ画像から見た目の特徴ベクトル（frame_embeddings）も作って保存する。
 """
 
 from __future__ import annotations
 
+from pathlib import Path
 from typing import List
 
 import cv2  # type: ignore
@@ -12,20 +14,40 @@ import numpy as np  # type: ignore
 
 import importlib
 import schemas
+import instrumentation
+import config_loader
+import frame_embeddings
 importlib.reload(schemas)
+importlib.reload(instrumentation)
+importlib.reload(config_loader)
+importlib.reload(frame_embeddings)
 
 from schemas import FrameMeta
+from instrumentation import count, count_file_bytes
+from config_loader import SETTINGS
+from frame_embeddings import embed_image, save_embeddings
 
 
-def _is_too_dark(img, threshold: float = 40.0) -> bool:
+DARK_THRESHOLD = 40.0
+BLUR_THRESHOLD = 100.0
+MOTION_THUMB_SIZE = (64, 36)   # 動き量を測るときの縮小サイズ
+
+
+def _brightness(gray) -> float:
+    return float(np.mean(gray))
+
+
+def _sharpness(gray) -> float:
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+def _is_too_dark(img, threshold: float = DARK_THRESHOLD) -> bool:
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    mean_val = float(np.mean(gray))
-    return bool(mean_val < threshold)   # ★ ここをキャスト
+    return bool(_brightness(gray) < threshold)   # ★ ここをキャスト
 
-def _is_blurry(img, threshold: float = 100.0) -> bool:
+def _is_blurry(img, threshold: float = BLUR_THRESHOLD) -> bool:
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    fm = cv2.Laplacian(gray, cv2.CV_64F).var()
-    return bool(fm < threshold)         # ★ 同じくキャスト
+    return bool(_sharpness(gray) < threshold)    # ★ 同じくキャスト
 
 
 def preprocess_frames(
@@ -33,15 +55,20 @@ def preprocess_frames(
     resize_long_side: int = 640,
 ) -> List[FrameMeta]:
     """
-    フレーム画像をリサイズし、暗さ/ブレのフラグを付与する。
+    フレーム画像をリサイズし、暗さ/ブレのフラグと画質指標（平均輝度・シャープネス）、
+    直前フレームとの差分による動き量（motion, 0〜1）を付与する。
     実際のモデル入力用の画像にもそのまま使える。
+    embeddings.enabled なら、リサイズ後の画像の特徴ベクトルを embeddings/{video_id}_emb.npy に保存する。
     """
     updated: List[FrameMeta] = []
+    prev_thumb = None
+    vectors: List[np.ndarray] = []
 
     for meta in frames:
         img = cv2.imread(meta.frame_path)
         if img is None:
             continue
+        count_file_bytes("bytes_read", Path(meta.frame_path))
 
         h, w = img.shape[:2]
         scale = resize_long_side / max(h, w)
@@ -51,9 +78,23 @@ def preprocess_frames(
 
         # 上書き保存（簡易）
         cv2.imwrite(meta.frame_path, img)
+        count_file_bytes("bytes_written", Path(meta.frame_path))
+
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        meta.brightness = _brightness(gray)
+        meta.sharpness = _sharpness(gray)
+        meta.is_too_dark = bool(meta.brightness < DARK_THRESHOLD)
+        meta.is_blurry = bool(meta.sharpness < BLUR_THRESHOLD)
 
-        meta.is_too_dark = _is_too_dark(img)
-        meta.is_blurry = _is_blurry(img)
+        thumb = cv2.resize(gray, MOTION_THUMB_SIZE, interpolation=cv2.INTER_AREA).astype(np.float32)
+        if prev_thumb is not None:
+            meta.motion = float(np.mean(np.abs(thumb - prev_thumb)) / 255.0)
+        prev_thumb = thumb
+        if SETTINGS.embeddings_enabled:
+            vectors.append(embed_image(img))
         updated.append(meta)
 
+    if vectors:
+        save_embeddings(updated[0].video_id, [m.frame_index for m in updated], vectors)
+    count("frames_processed", len(updated))
     return updated
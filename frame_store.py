@@ -0,0 +1,287 @@
+"""
+動画1本ぶんのフレーム画像を1つのパック（無圧縮 zip）にまとめ、ファイルでもパックでも
+同じように読めるようにするモジュール。
+
+- pack_frames: frames/{video_id}/ の画像を frame_packs/{video_id}_frames.zip にまとめる
+  （PNG / JPEG は圧縮済みなので ZIP_STORED。zip の中央ディレクトリがそのまま索引になる）
+- read_frame_bytes / read_frame_image: frame_path の画像を読む。ファイルが無ければパックから読む
+  （vision_captioner / bestshot_scorer / candidate_ranker / UI はこちらを使う）
+- list_frames: ファイルとパックの両方から、その動画のフレームのパスを返す
+- drop_raw_frames / apply_retention: パックに入っている個別の画像を消す
+  （frame_store.keep_raw_days。0 ならフレーム抽出直後に消す）
+
+パックの中のエントリ名はフレームのファイル名（{video_id}_f{index}.png）。
+frame_path（マニフェストに書かれたパス）はそのまま使い続けられる。
+
+実行例:
+    python frame_store.py pack --all
+    python frame_store.py prune --days 7
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import re
+import sys
+import threading
+import time
+import zipfile
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cv2  # type: ignore
+import numpy as np  # type: ignore
+
+import importlib
+import config_loader
+import paths
+import instrumentation
+
+importlib.reload(config_loader)
+importlib.reload(paths)
+importlib.reload(instrumentation)
+
+from config_loader import SETTINGS
+from paths import (
+    forget_dirs,
+    get_data_root,
+    get_frame_pack_dir,
+    get_frame_pack_path,
+    get_frame_path,
+    get_frames_dir,
+)
+from instrumentation import count
+
+
+FRAME_SUFFIXES = {".png", ".jpg", ".jpeg", ".webp"}
+
+_FRAME_NAME = re.compile(r"^(?P<video_id>.+)_f(?P<index>\d+)(?P<ext>\.\w+)$")
+
+# 開いたパック（video_id -> (mtime_ns, ZipFile)）。パックを作り直したら開き直す
+_PACKS: Dict[str, Tuple[int, zipfile.ZipFile]] = {}
+_LOCK = threading.Lock()
+
+
+def _parse_frame_name(name: str) -> Optional[Tuple[str, int, str]]:
+    m = _FRAME_NAME.match(name)
+    if m is None:
+        return None
+    return m.group("video_id"), int(m.group("index")), m.group("ext")
+
+
+def _frame_files(video_id: str) -> List[Path]:
+    frames_dir = get_frames_dir(video_id, create=False)
+    if not frames_dir.exists():
+        return []
+    return [p for p in sorted(frames_dir.rglob("*")) if p.suffix.lower() in FRAME_SUFFIXES]
+
+
+def _open_pack(video_id: str) -> Optional[zipfile.ZipFile]:
+    """video_id のパックを開く（無ければ None）。呼び出し側で _LOCK を取ること。"""
+    path = get_frame_pack_path(video_id)
+    try:
+        mtime = path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+    cached = _PACKS.get(video_id)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    if cached is not None:
+        cached[1].close()
+    zf = zipfile.ZipFile(path)
+    _PACKS[video_id] = (mtime, zf)
+    return zf
+
+
+def _close_pack(video_id: str) -> None:
+    with _LOCK:
+        cached = _PACKS.pop(video_id, None)
+        if cached is not None:
+            cached[1].close()
+
+
+# ---------------------------------------------------------------------------
+# 読み出し
+# ---------------------------------------------------------------------------
+
+def read_frame_bytes(frame_path: str) -> bytes:
+    """フレーム画像の中身。ファイルが無ければパックから読む。どちらにも無ければ FileNotFoundError。"""
+    try:
+        with open(frame_path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        name = Path(frame_path).name
+        parsed = _parse_frame_name(name)
+        if parsed is None:
+            raise
+        with _LOCK:
+            zf = _open_pack(parsed[0])
+            try:
+                data = zf.read(name) if zf is not None else None
+            except KeyError:
+                data = None
+        if data is None:
+            raise FileNotFoundError(f"Frame not found in files or pack: {frame_path}")
+    count("bytes_read", len(data))
+    return data
+
+
+def read_frame_image(frame_path: str, flags: int = cv2.IMREAD_COLOR) -> Optional[np.ndarray]:
+    """cv2.imread と同じく画像を返す（読めなければ None）。パックの中の画像も読める。"""
+    try:
+        data = read_frame_bytes(frame_path)
+    except FileNotFoundError:
+        return None
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+
+
+def frame_exists(frame_path: str) -> bool:
+    if os.path.exists(frame_path):
+        return True
+    parsed = _parse_frame_name(Path(frame_path).name)
+    if parsed is None:
+        return False
+    with _LOCK:
+        zf = _open_pack(parsed[0])
+        return zf is not None and Path(frame_path).name in zf.NameToInfo
+
+
+def list_frames(video_id: str) -> List[str]:
+    """video_id のフレームのパス（個別ファイルとパックの両方。フレーム番号順）。"""
+    found: Dict[str, str] = {p.name: str(p) for p in _frame_files(video_id)}
+    with _LOCK:
+        zf = _open_pack(video_id)
+        names = zf.namelist() if zf is not None else []
+    for name in names:
+        parsed = _parse_frame_name(name)
+        if parsed is not None and name not in found:
+            found[name] = str(get_frame_path(video_id, parsed[1], ext=parsed[2], create=False))
+    return [found[name] for name in sorted(found)]
+
+
+# ---------------------------------------------------------------------------
+# パック・保持期間
+# ---------------------------------------------------------------------------
+
+def pack_frames(video_id: str) -> Optional[Path]:
+    """
+    frames/{video_id}/ の画像をパックにまとめる（既存のパックは作り直す）。
+    個別の画像がもう無い（消した後）なら既存のパックをそのまま使う。
+    戻り値: パックのパス（画像が1枚も無ければ None）
+    """
+    files = _frame_files(video_id)
+    pack_path = get_frame_pack_path(video_id)
+    if not files:
+        return pack_path if pack_path.exists() else None
+
+    tmp = pack_path.with_name(f".{pack_path.name}.part")
+    with zipfile.ZipFile(tmp, "w", compression=zipfile.ZIP_STORED) as zf:
+        for p in files:
+            zf.write(p, arcname=p.name)
+    _close_pack(video_id)
+    os.replace(tmp, pack_path)
+    count("bytes_written", pack_path.stat().st_size)
+    return pack_path
+
+
+def drop_raw_frames(video_id: str) -> int:
+    """
+    パックに同じ内容（名前とサイズ）が入っている個別の画像を消し、空になったディレクトリも消す。
+    戻り値: 消した枚数
+    """
+    with _LOCK:
+        zf = _open_pack(video_id)
+        packed = {info.filename: info.file_size for info in zf.infolist()} if zf is not None else {}
+    if not packed:
+        return 0
+
+    removed = 0
+    for p in _frame_files(video_id):
+        if packed.get(p.name) == p.stat().st_size:
+            p.unlink()
+            removed += 1
+
+    frames_dir = get_frames_dir(video_id, create=False)
+    for d in sorted((d for d in frames_dir.rglob("*") if d.is_dir()), reverse=True):
+        if not any(d.iterdir()):
+            d.rmdir()
+    if frames_dir.exists() and not any(frames_dir.iterdir()):
+        frames_dir.rmdir()
+    forget_dirs()  # 消したディレクトリを「作成済み」のままにしない
+    return removed
+
+
+def apply_retention(keep_raw_days: Optional[float] = None) -> Dict[str, int]:
+    """
+    パックが作られてから keep_raw_days 日以上たった動画の個別の画像を消す。
+    keep_raw_days が None なら settings.yaml の frame_store.keep_raw_days（それも None なら何もしない）。
+    戻り値: video_id -> 消した枚数
+    """
+    days = SETTINGS.frame_pack_keep_raw_days if keep_raw_days is None else keep_raw_days
+    if days is None:
+        return {}
+    cutoff = time.time() - days * 86400
+    removed: Dict[str, int] = {}
+    for pack in sorted(get_frame_pack_dir().glob("*_frames.zip")):
+        if pack.stat().st_mtime <= cutoff:
+            video_id = pack.name[: -len("_frames.zip")]
+            n = drop_raw_frames(video_id)
+            if n:
+                removed[video_id] = n
+    return removed
+
+
+def pack_after_extraction(video_id: str) -> None:
+    """フレーム抽出後の処理（pipeline の frames ステージから呼ぶ）。設定に応じてパックし、必要なら消す。"""
+    if not SETTINGS.frame_pack_enabled:
+        return
+    pack_frames(video_id)
+    if SETTINGS.frame_pack_keep_raw_days == 0:
+        drop_raw_frames(video_id)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="フレーム画像のパック作成と、個別の画像の削除")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_pack = sub.add_parser("pack", help="フレーム画像をパックにまとめる")
+    p_pack.add_argument("video_ids", nargs="*")
+    p_pack.add_argument("--all", action="store_true", help="frames/ の下の全 video_id")
+    p_pack.add_argument("--drop-raw", action="store_true", help="パック後に個別の画像を消す")
+
+    p_prune = sub.add_parser("prune", help="パック済みで古い動画の個別の画像を消す")
+    p_prune.add_argument("--days", type=float, default=None, help="既定: frame_store.keep_raw_days")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "prune":
+        removed = apply_retention(args.days)
+        for vid, n in removed.items():
+            print(f"{vid}: removed {n} raw frames")
+        if not removed:
+            print("Nothing to remove.")
+        return 0
+
+    video_ids: List[str] = list(args.video_ids)
+    if args.all:
+        frames_root = get_data_root() / "frames"
+        if frames_root.exists():
+            video_ids += sorted(p.name for p in frames_root.iterdir() if p.is_dir())
+    if not video_ids:
+        parser.error("video_id か --all を指定してください")
+
+    for vid in video_ids:
+        pack = pack_frames(vid)
+        if pack is None:
+            print(f"{vid}: no frames")
+            continue
+        line = f"{vid}: {pack} ({pack.stat().st_size / 1e6:.1f} MB)"
+        if args.drop_raw:
+            line += f", removed {drop_raw_frames(vid)} raw frames"
+        print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
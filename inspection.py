@@ -16,22 +16,28 @@ import importlib
 import paths
 import schemas
 import jsonl_io
+import frame_store
+import catalog
 
 importlib.reload(paths)
 importlib.reload(schemas)
 importlib.reload(jsonl_io)
+importlib.reload(frame_store)
+importlib.reload(catalog)
 
-from paths import get_frames_dir, get_manifest_path
+from paths import get_manifest_path
 from schemas import FrameMeta
 from jsonl_io import read_jsonl_as_dataclasses
+from frame_store import list_frames, read_frame_image
+from catalog import list_frames as list_catalog_frames
 
 
 def show_sample_frames(video_id: str, n: int = 5) -> None:
     """
     指定 video_id のフレームからランダムに n 枚を表示。
     """
-    frames_dir = get_frames_dir(video_id)
-    all_paths = list(frames_dir.glob("*.png"))
+    # カタログ（マニフェストの内容）から引く。カタログに無い古い成果物はファイルを探す
+    all_paths = [f["frame_path"] for f in list_catalog_frames(video_id)] or list_frames(video_id)
     if not all_paths:
         print("No frames found.")
         return
@@ -39,7 +45,7 @@ def show_sample_frames(video_id: str, n: int = 5) -> None:
     sample_paths = random.sample(all_paths, min(n, len(all_paths)))
 
     for p in sample_paths:
-        img = cv2.imread(str(p))
+        img = read_frame_image(p)
         img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
         plt.figure(figsize=(4, 4))
         plt.imshow(img)
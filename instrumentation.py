@@ -0,0 +1,333 @@
+"""
+パイプライン実行の計測（span・カウンタ）と、実行ごとのメトリクスレポートを扱うモジュール。
+
+- span("frames") のように処理を囲むと、経過時間（wall time）を記録する
+  - kind="stage" はパイプラインのステージ、kind="llm" は LLM API 呼び出し（model_loader.api_slot が付ける）
+- count("bytes_written", n) のようにカウンタを足すと、そのとき実行中のステージに紐づけて集計する
+  - 主なカウンタ: frames_processed / bytes_read / bytes_written / api_calls / api_errors /
+    retries / cache_hits / cache_misses / prompt_tokens / completion_tokens / cached_prompt_tokens /
+    vision_salvaged（崩れた JSON を手直しして読めた）/ vision_incomplete（聞き直しても項目が欠けた）
+- start_run() 〜 end_run() の間だけ記録する。実行中でなければ何もしない（オーバーヘッドはほぼ無い）
+- end_run() で runs/{video_id}/metrics.json（構造化レポート）と metrics.prom（Prometheus テキスト形式）を書く
+- プロファイリング（profiler.py）が有効なら、ステージの span ごとにプロファイルとピークメモリも取る
+
+1プロセスで同時に実行するパイプラインは1本（Streamlit はジョブキュー、バッチはプロセスプール）なので、
+実行中の記録先はモジュール変数で持つ。ステージ内のスレッド（並列キャプションなど）からの記録も同じ先に入る。
+各モジュールが importlib.reload(instrumentation) しても実行中の記録先が消えないよう、
+記録先と「いまのステージ」は reload をまたいで引き継ぐ（reload はモジュールの名前空間を使い回す）。
+
+いまのステージはスレッドごと（contextvars）に持つ。ステージ内でスレッドプールに処理を渡すときは
+bind_stage(fn) で包むと、そのスレッドでの記録も呼び出し元のステージに紐づく。
+"""
+
+from __future__ import annotations
+
+import contextvars
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, TypeVar
+
+import importlib
+import config_loader
+import paths
+import profiler
+
+importlib.reload(config_loader)
+importlib.reload(paths)
+importlib.reload(profiler)
+
+from config_loader import SETTINGS
+from paths import get_metrics_path, get_metrics_prom_path
+from profiler import RunProfiler
+
+
+METRIC_PREFIX = "kids_digest"
+
+_T = TypeVar("_T")
+
+# reload されても前の値を引き継ぐ（globals() は reload の前後で同じ dict）
+_LOGGING_CONFIGURED: bool = globals().get("_LOGGING_CONFIGURED", False)
+
+
+def get_logger(name: str) -> logging.Logger:
+    """settings.yaml の logging.level を反映したロガーを返す。"""
+    global _LOGGING_CONFIGURED
+    if not _LOGGING_CONFIGURED:
+        logging.basicConfig(
+            level=getattr(logging, SETTINGS.log_level.upper(), logging.INFO),
+            format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+        )
+        _LOGGING_CONFIGURED = True
+    return logging.getLogger(name)
+
+
+logger = get_logger(__name__)
+
+
+class RunMetrics:
+    """1回のパイプライン実行で集めた span とカウンタ。"""
+
+    def __init__(self, video_id: str, profiler: Optional[RunProfiler] = None) -> None:
+        self.video_id = video_id
+        self.profiler = profiler
+        self.run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+        self.started = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+        self.counters: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        self.lock = threading.Lock()
+
+    def add(self, name: str, value: float, stage: Optional[str] = None) -> None:
+        with self.lock:
+            self.counters[stage or current_stage() or "-"][name] += value
+
+
+# 実行中の記録先と、スレッドごとのいまのステージ（reload されても引き継ぐ）
+_ACTIVE: Optional[RunMetrics] = globals().get("_ACTIVE")
+_STAGE: "contextvars.ContextVar[Optional[str]]" = globals().get("_STAGE") or contextvars.ContextVar(
+    "instrumentation_stage", default=None
+)
+
+
+def current_stage() -> Optional[str]:
+    """このスレッドで実行中のステージ名（ステージの外なら None）。"""
+    return _STAGE.get()
+
+
+def bind_stage(fn: Callable[..., _T]) -> Callable[..., _T]:
+    """
+    fn を呼び出し元のステージに紐づけて実行する関数にする（スレッドプールに渡す処理用）。
+    例: pool.map(bind_stage(lambda fm: analyze_frame(...)), frames)
+    """
+    stage = _STAGE.get()
+
+    def run(*args: Any, **kwargs: Any) -> _T:
+        token = _STAGE.set(stage)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _STAGE.reset(token)
+
+    return run
+
+
+def start_run(video_id: str, profile: Optional[bool] = None) -> RunMetrics:
+    """
+    計測を開始する（以後の span / count はこの実行に記録される）。
+    profile: True ならステージごとにプロファイルを取る（None なら settings.yaml の profiling.enabled）
+    """
+    global _ACTIVE
+    if profile is None:
+        profile = SETTINGS.profiling_enabled
+    _ACTIVE = RunMetrics(video_id, RunProfiler(video_id) if profile else None)
+    return _ACTIVE
+
+
+def active_run() -> Optional[RunMetrics]:
+    return _ACTIVE
+
+
+def count(name: str, value: float = 1.0) -> None:
+    """実行中のステージのカウンタに value を足す。計測中でなければ何もしない。"""
+    run = _ACTIVE
+    if run is not None and value:
+        run.add(name, float(value))
+
+
+def count_file_bytes(name: str, path: Any) -> None:
+    """ファイルサイズを bytes_read / bytes_written などに足す。"""
+    if _ACTIVE is None:
+        return
+    try:
+        count(name, path.stat().st_size)
+    except OSError:
+        pass
+
+
+def record_usage(response: Any) -> Dict[str, int]:
+    """
+    API のレスポンスにトークン数が含まれていれば prompt_tokens / completion_tokens に足す。
+    プレフィックスキャッシュから読まれた入力トークンがあれば cached_prompt_tokens にも足す。
+    OpenAI 互換（SambaNova）の usage と、Gemini の usage_metadata の両方に対応する。
+    戻り値: prompt_tokens / completion_tokens / cached_tokens（レスポンスに無ければ空の dict。計測中でなくても返す）
+    """
+    usage = getattr(response, "usage", None)
+    meta = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        details = getattr(usage, "prompt_tokens_details", None)
+        tokens = {
+            "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+            "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+            "cached_tokens": (getattr(details, "cached_tokens", 0) or 0) if details is not None else 0,
+        }
+    elif meta is not None:
+        tokens = {
+            "prompt_tokens": getattr(meta, "prompt_token_count", 0) or 0,
+            "completion_tokens": getattr(meta, "candidates_token_count", 0) or 0,
+            "cached_tokens": getattr(meta, "cached_content_token_count", 0) or 0,
+        }
+    else:
+        return {}
+    count("prompt_tokens", tokens["prompt_tokens"])
+    count("completion_tokens", tokens["completion_tokens"])
+    count("cached_prompt_tokens", tokens["cached_tokens"])
+    return tokens
+
+
+@contextmanager
+def span(name: str, kind: str = "stage", **attrs: Any) -> Iterator[Dict[str, Any]]:
+    """
+    処理を囲んで経過時間を記録する。yield する dict に値を入れると span の属性として残る。
+    例外が起きた場合は error 属性を付けて記録し、そのまま送出する。
+    """
+    run = _ACTIVE
+    if run is None:
+        yield attrs
+        return
+
+    token = None
+    prof = None
+    if kind == "stage":
+        token = _STAGE.set(name)
+        if run.profiler is not None:
+            prof = run.profiler.start_stage(name)
+    started = time.perf_counter()
+    record: Dict[str, Any] = {
+        "name": name,
+        "kind": kind,
+        "stage": _STAGE.get(),
+        "start_sec": round(started - run.started, 6),
+    }
+    try:
+        yield attrs
+    except Exception as e:
+        attrs["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        record["wall_sec"] = round(time.perf_counter() - started, 6)
+        if prof is not None:
+            record["profile"] = run.profiler.stop_stage(prof)
+        record.update(attrs)
+        with run.lock:
+            run.spans.append(record)
+        if token is not None:
+            _STAGE.reset(token)
+            logger.info("stage %s finished in %.2fs", name, record["wall_sec"])
+        else:
+            logger.debug("%s %s finished in %.3fs", kind, name, record["wall_sec"])
+
+
+def _summarize(run: RunMetrics) -> Dict[str, Any]:
+    """span とカウンタをステージごとに集計したレポート。"""
+    stages: Dict[str, Dict[str, Any]] = {}
+    for sp in run.spans:
+        if sp["kind"] == "stage":
+            stages.setdefault(sp["name"], {})["wall_sec"] = sp["wall_sec"]
+            if "cache" in sp:
+                stages[sp["name"]]["cache"] = sp["cache"]
+            if "profile" in sp:
+                stages[sp["name"]]["profile"] = sp["profile"]
+
+    llm: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    for sp in run.spans:
+        if sp["kind"] == "llm":
+            s = llm[sp["stage"] or "-"]
+            s["calls"] += 1
+            s["wall_sec"] += sp["wall_sec"]
+            s["wait_sec"] += sp.get("wait_sec", 0.0)
+
+    for stage, counters in run.counters.items():
+        stages.setdefault(stage, {})["counters"] = dict(counters)
+    for stage, s in llm.items():
+        stages.setdefault(stage, {})["llm"] = {k: round(v, 6) for k, v in s.items()}
+
+    totals: Dict[str, float] = defaultdict(float)
+    for counters in run.counters.values():
+        for k, v in counters.items():
+            totals[k] += v
+
+    return {
+        "run_id": run.run_id,
+        "video_id": run.video_id,
+        "started_at": run.started_at,
+        "wall_sec": round(time.perf_counter() - run.started, 6),
+        "stages": stages,
+        "totals": dict(totals),
+        "spans": run.spans,
+    }
+
+
+def _escape_label(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels: Any) -> str:
+    return "{" + ",".join(f'{k}="{_escape_label(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    """Prometheus のサンプル値。整数はそのまま、小数は丸めずに書く（{:g} だと 6 桁に丸められる）。"""
+    value = float(value)
+    if value.is_integer():
+        return f"{int(value):d}"
+    return repr(value)
+
+
+def to_prometheus(report: Dict[str, Any]) -> str:
+    """レポートを Prometheus のテキスト形式（node_exporter の textfile collector などで読める形）にする。"""
+    vid = report["video_id"]
+    lines = [
+        f"# HELP {METRIC_PREFIX}_run_seconds Wall time of the whole pipeline run.",
+        f"# TYPE {METRIC_PREFIX}_run_seconds gauge",
+        f"{METRIC_PREFIX}_run_seconds{_labels(video_id=vid)} {report['wall_sec']}",
+        f"# HELP {METRIC_PREFIX}_stage_seconds Wall time per pipeline stage.",
+        f"# TYPE {METRIC_PREFIX}_stage_seconds gauge",
+    ]
+    for stage, s in sorted(report["stages"].items()):
+        if "wall_sec" in s:
+            lines.append(f"{METRIC_PREFIX}_stage_seconds{_labels(video_id=vid, stage=stage)} {s['wall_sec']}")
+
+    lines += [
+        f"# HELP {METRIC_PREFIX}_llm_call_seconds Wall time spent in LLM API calls.",
+        f"# TYPE {METRIC_PREFIX}_llm_call_seconds summary",
+    ]
+    for stage, s in sorted(report["stages"].items()):
+        if "llm" in s:
+            lab = _labels(video_id=vid, stage=stage)
+            lines.append(f"{METRIC_PREFIX}_llm_call_seconds_sum{lab} {s['llm']['wall_sec']}")
+            lines.append(f"{METRIC_PREFIX}_llm_call_seconds_count{lab} {int(s['llm']['calls'])}")
+
+    names = sorted({k for s in report["stages"].values() for k in s.get("counters", {})})
+    for name in names:
+        metric = f"{METRIC_PREFIX}_{name}_total"
+        lines.append(f"# TYPE {metric} counter")
+        for stage, s in sorted(report["stages"].items()):
+            if name in s.get("counters", {}):
+                lines.append(f"{metric}{_labels(video_id=vid, stage=stage)} {_format_value(s['counters'][name])}")
+    return "\n".join(lines) + "\n"
+
+
+def end_run(run: Optional[RunMetrics] = None) -> Optional[Dict[str, Any]]:
+    """
+    計測を終了し、runs/{video_id}/metrics.json と metrics.prom を書いてレポートを返す。
+    """
+    global _ACTIVE
+    run = run or _ACTIVE
+    if run is None:
+        return None
+    if _ACTIVE is run:
+        _ACTIVE = None
+    if run.profiler is not None:
+        run.profiler.finish()
+
+    report = _summarize(run)
+    get_metrics_path(run.video_id).write_text(
+        json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8"
+    )
+    get_metrics_prom_path(run.video_id).write_text(to_prometheus(report), encoding="utf-8")
+    return report
@@ -0,0 +1,455 @@
+"""
+パイプラインをバックグラウンドで実行するための、SQLite ベースの永続ジョブキュー。
+
+- Streamlit はジョブを登録（submit_job）して、状態とステージごとの進捗を読むだけ（get_job）
+- 実際の処理は別プロセスのワーカー（python job_queue.py worker）が行うので、
+  画面操作やリロードでパイプラインが止まったりやり直しになったりしない
+- 取り出し順は「実行中ジョブが少ない利用者（owner）を優先 → 古い順」。1人が大量に登録しても他の人が待たされにくい
+- ワーカーは一定間隔で heartbeat を書き、途絶えた実行中ジョブは別のワーカーが拾い直す
+  （jobs_max_attempts 回実行しても終わらなかったジョブは failed にして、ワーカーを落とし続けないようにする）
+
+DB: outputs/jobs/jobs.sqlite3
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+import importlib
+import config_loader
+import paths
+
+importlib.reload(config_loader)
+importlib.reload(paths)
+
+from config_loader import SETTINGS
+from paths import get_job_db_path, get_job_log_path
+
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    owner        TEXT NOT NULL,
+    video_id     TEXT NOT NULL,
+    params       TEXT NOT NULL DEFAULT '{}',
+    status       TEXT NOT NULL,
+    created_at   REAL NOT NULL,
+    started_at   REAL,
+    finished_at  REAL,
+    heartbeat_at REAL,
+    worker       TEXT,
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    current_stage TEXT,
+    progress     TEXT NOT NULL DEFAULT '[]',
+    report       TEXT,
+    error        TEXT,
+    video_info   TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_owner ON jobs (owner, created_at);
+
+CREATE TABLE IF NOT EXISTS workers (
+    name         TEXT PRIMARY KEY,
+    pid          INTEGER NOT NULL,
+    host         TEXT NOT NULL,
+    started_at   REAL NOT NULL,
+    heartbeat_at REAL NOT NULL
+);
+
+-- ensure_workers が起動したが、まだ workers に登録していないプロセス
+CREATE TABLE IF NOT EXISTS spawns (
+    pid          INTEGER PRIMARY KEY,
+    spawned_at   REAL NOT NULL
+);
+"""
+
+# 同じ owner の実行中ジョブが少ないものを優先し、その中で古い順に取り出す
+# （同じ video_id が実行中のジョブは、成果物を取り合わないよう後回し）
+_CLAIM_SQL = """
+SELECT j.id FROM jobs AS j
+WHERE j.status = ?
+  AND NOT EXISTS (SELECT 1 FROM jobs AS v WHERE v.video_id = j.video_id AND v.status = ?)
+ORDER BY
+    (SELECT COUNT(*) FROM jobs AS r WHERE r.owner = j.owner AND r.status = ?),
+    j.created_at,
+    j.id
+LIMIT 1
+"""
+
+
+@contextmanager
+def _connect() -> Iterator[sqlite3.Connection]:
+    conn = sqlite3.connect(str(get_job_db_path()), timeout=30.0, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        conn.executescript(_SCHEMA)
+        _migrate(conn)
+        yield conn
+    finally:
+        conn.close()
+
+
+def _migrate(conn: sqlite3.Connection) -> None:
+    """以前の版で作った DB に、後から足した列を追加する。"""
+    columns = {r["name"] for r in conn.execute("PRAGMA table_info(jobs)")}
+    if "video_info" not in columns:
+        try:
+            conn.execute("ALTER TABLE jobs ADD COLUMN video_info TEXT")
+        except sqlite3.OperationalError:
+            pass  # 別のプロセスが同時に追加した
+
+
+def _row_to_job(row: sqlite3.Row) -> Dict[str, Any]:
+    job = dict(row)
+    job["params"] = json.loads(job["params"] or "{}")
+    job["progress"] = json.loads(job["progress"] or "[]")
+    job["report"] = json.loads(job["report"]) if job["report"] else None
+    job["video_info"] = json.loads(job["video_info"]) if job.get("video_info") else None
+    return job
+
+
+# ---------------------------------------------------------------------------
+# 利用側（Streamlit など）
+# ---------------------------------------------------------------------------
+
+def submit_job(
+    video_id: str,
+    owner: str,
+    params: Optional[Dict[str, Any]] = None,
+    video_info: Optional[Dict[str, Any]] = None,
+) -> int:
+    """
+    ジョブを登録して job_id を返す。params は pipeline.run_pipeline のキーワード引数。
+    video_info: 登録時に調べた動画情報（video_ingest.probe_video）。取り込み前でも残り時間の目安を出すのに使う
+    """
+    with _connect() as conn:
+        cur = conn.execute(
+            "INSERT INTO jobs (owner, video_id, params, status, created_at, video_info) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                owner,
+                video_id,
+                json.dumps(params or {}, ensure_ascii=False),
+                QUEUED,
+                time.time(),
+                json.dumps(video_info, ensure_ascii=False) if video_info is not None else None,
+            ),
+        )
+        return int(cur.lastrowid)
+
+
+def get_job(job_id: int) -> Optional[Dict[str, Any]]:
+    with _connect() as conn:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return _row_to_job(row) if row else None
+
+
+def list_jobs(owner: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+    """新しい順にジョブを返す（owner を指定するとその利用者の分だけ）。"""
+    with _connect() as conn:
+        if owner is None:
+            rows = conn.execute(
+                "SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE owner = ? ORDER BY created_at DESC LIMIT ?",
+                (owner, limit),
+            ).fetchall()
+    return [_row_to_job(r) for r in rows]
+
+
+def queue_position(job_id: int) -> int:
+    """待ち行列での大まかな順番（0 なら次に実行される）。実行中・完了なら 0。"""
+    with _connect() as conn:
+        row = conn.execute("SELECT status, created_at FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or row["status"] != QUEUED:
+            return 0
+        return int(
+            conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at < ?",
+                (QUEUED, row["created_at"]),
+            ).fetchone()[0]
+        )
+
+
+def alive_workers() -> List[Dict[str, Any]]:
+    """heartbeat が途絶えていないワーカー。"""
+    deadline = time.time() - SETTINGS.jobs_stale_timeout_sec
+    with _connect() as conn:
+        rows = conn.execute(
+            "SELECT * FROM workers WHERE heartbeat_at >= ?", (deadline,)
+        ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def ensure_workers(count: Optional[int] = None) -> int:
+    """
+    生きているワーカーが count 未満なら、足りない分をバックグラウンドプロセスとして起動する。
+    ワーカーは Streamlit のセッションと無関係に動き続ける。戻り値: 新たに起動した数。
+
+    画面の更新（1秒ごと）や複数のセッションから同時に呼ばれても起動しすぎないよう、
+    数える〜起動を記録するまでを DB の書き込みロック（BEGIN IMMEDIATE）の中で行い、
+    起動したがまだ登録していないプロセス（spawns）も生きているワーカーとして数える。
+    """
+    count = SETTINGS.jobs_workers if count is None else count
+    now = time.time()
+    deadline = now - SETTINGS.jobs_stale_timeout_sec
+    with _connect() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM spawns WHERE spawned_at < ?", (deadline,))
+            alive = conn.execute(
+                "SELECT COUNT(*) FROM workers WHERE heartbeat_at >= ?", (deadline,)
+            ).fetchone()[0]
+            pending = conn.execute("SELECT COUNT(*) FROM spawns").fetchone()[0]
+            missing = max(count - alive - pending, 0)
+            for _ in range(missing):
+                with get_job_log_path().open("ab") as log:
+                    proc = subprocess.Popen(
+                        [sys.executable, str(Path(__file__).resolve()), "worker"],
+                        cwd=os.getcwd(),
+                        stdout=log,
+                        stderr=subprocess.STDOUT,
+                        stdin=subprocess.DEVNULL,
+                        start_new_session=True,
+                    )
+                conn.execute(
+                    "INSERT OR REPLACE INTO spawns (pid, spawned_at) VALUES (?, ?)", (proc.pid, now)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    return missing
+
+
+# ---------------------------------------------------------------------------
+# ワーカー側
+# ---------------------------------------------------------------------------
+
+def _register_worker(name: str) -> None:
+    now = time.time()
+    with _connect() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO workers (name, pid, host, started_at, heartbeat_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (name, os.getpid(), socket.gethostname(), now, now),
+        )
+        conn.execute("DELETE FROM spawns WHERE pid = ?", (os.getpid(),))
+
+
+def _unregister_worker(name: str) -> None:
+    with _connect() as conn:
+        conn.execute("DELETE FROM workers WHERE name = ?", (name,))
+
+
+def _heartbeat(name: str, job_id: Optional[int]) -> None:
+    now = time.time()
+    with _connect() as conn:
+        conn.execute("UPDATE workers SET heartbeat_at = ? WHERE name = ?", (now, name))
+        if job_id is not None:
+            conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ?", (now, job_id))
+
+
+def requeue_stale_jobs() -> int:
+    """
+    heartbeat が途絶えた実行中ジョブ（ワーカーが落ちたもの）を待ち行列に戻す。
+    すでに jobs_max_attempts 回実行したジョブは戻さずに failed にする。戻り値: 戻したジョブ数
+    """
+    now = time.time()
+    deadline = now - SETTINGS.jobs_stale_timeout_sec
+    with _connect() as conn:
+        conn.execute(
+            "UPDATE jobs SET status = ?, finished_at = ?, worker = NULL, current_stage = NULL, error = ? "
+            "WHERE status = ? AND heartbeat_at < ? AND attempts >= ?",
+            (
+                FAILED,
+                now,
+                f"Worker stopped responding {SETTINGS.jobs_max_attempts} times while running this job",
+                RUNNING,
+                deadline,
+                SETTINGS.jobs_max_attempts,
+            ),
+        )
+        cur = conn.execute(
+            "UPDATE jobs SET status = ?, worker = NULL, current_stage = NULL "
+            "WHERE status = ? AND heartbeat_at < ?",
+            (QUEUED, RUNNING, deadline),
+        )
+        conn.execute("DELETE FROM workers WHERE heartbeat_at < ?", (deadline,))
+        return cur.rowcount
+
+
+def claim_next_job(worker: str) -> Optional[Dict[str, Any]]:
+    """次のジョブを1つ取り出して running にする（複数ワーカーから同時に呼ばれても重複しない）。"""
+    with _connect() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(_CLAIM_SQL, (QUEUED, RUNNING, RUNNING)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker = ?, started_at = ?, heartbeat_at = ?, "
+                "attempts = attempts + 1, progress = '[]', error = NULL WHERE id = ?",
+                (RUNNING, worker, now, now, row["id"]),
+            )
+            job = conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    return _row_to_job(job)
+
+
+def _set_stage(job_id: int, stage: str) -> None:
+    with _connect() as conn:
+        conn.execute(
+            "UPDATE jobs SET current_stage = ?, heartbeat_at = ? WHERE id = ?",
+            (stage, time.time(), job_id),
+        )
+
+
+def _append_progress(job_id: int, entry: Dict[str, Any]) -> None:
+    with _connect() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT progress FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        progress = json.loads(row["progress"] or "[]") if row else []
+        progress.append(entry)
+        conn.execute(
+            "UPDATE jobs SET progress = ?, heartbeat_at = ? WHERE id = ?",
+            (json.dumps(progress, ensure_ascii=False), time.time(), job_id),
+        )
+        conn.execute("COMMIT")
+
+
+def _finish(job_id: int, status: str, report: Optional[Dict[str, Any]], error: Optional[str]) -> None:
+    with _connect() as conn:
+        conn.execute(
+            "UPDATE jobs SET status = ?, finished_at = ?, current_stage = NULL, report = ?, error = ? "
+            "WHERE id = ?",
+            (
+                status,
+                time.time(),
+                json.dumps(report, ensure_ascii=False) if report is not None else None,
+                error,
+                job_id,
+            ),
+        )
+
+
+def run_job(job: Dict[str, Any]) -> None:
+    """1つのジョブを実行し、ステージごとの進捗と結果を DB に書く。"""
+    import pipeline
+
+    job_id = job["id"]
+    try:
+        report = pipeline.run_pipeline(
+            job["video_id"],
+            on_stage_start=lambda name: _set_stage(job_id, name),
+            on_stage_end=lambda entry: _append_progress(job_id, entry),
+            **job["params"],
+        )
+    except Exception as e:
+        print(f"[WARN] job {job_id} failed: {e}")
+        traceback.print_exc()
+        _finish(job_id, FAILED, None, f"{type(e).__name__}: {e}")
+        return
+    _finish(job_id, DONE, report, None)
+
+
+def run_worker(
+    name: Optional[str] = None,
+    poll_interval_sec: Optional[float] = None,
+    exit_when_idle: bool = False,
+) -> None:
+    """
+    ジョブを取り出して実行し続けるワーカーのメインループ。
+    exit_when_idle=True なら待ち行列が空になった時点で終了する（テストや cron 用）。
+    """
+    name = name or f"{socket.gethostname()}:{os.getpid()}"
+    poll = SETTINGS.jobs_poll_interval_sec if poll_interval_sec is None else poll_interval_sec
+    current: Dict[str, Optional[int]] = {"job_id": None}
+    stop = threading.Event()
+
+    # 長いステージの途中でも heartbeat が途切れないよう、別スレッドで定期的に書く
+    def beat() -> None:
+        interval = max(SETTINGS.jobs_stale_timeout_sec / 4, 1.0)
+        while not stop.wait(interval):
+            _heartbeat(name, current["job_id"])
+
+    _register_worker(name)
+    beater = threading.Thread(target=beat, daemon=True)
+    beater.start()
+    print(f"Worker {name} started")
+    try:
+        while True:
+            requeue_stale_jobs()
+            job = claim_next_job(name)
+            if job is None:
+                if exit_when_idle:
+                    break
+                _heartbeat(name, None)
+                time.sleep(poll)
+                continue
+            print(f"Worker {name}: job {job['id']} ({job['video_id']})")
+            current["job_id"] = job["id"]
+            run_job(job)
+            current["job_id"] = None
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        _unregister_worker(name)
+        print(f"Worker {name} stopped")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="パイプラインのジョブキュー（ワーカー起動 / 一覧）")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_worker = sub.add_parser("worker", help="ワーカーを起動する")
+    p_worker.add_argument("--exit-when-idle", action="store_true")
+
+    p_submit = sub.add_parser("submit", help="raw_videos/{video_id}.mp4 のジョブを登録する")
+    p_submit.add_argument("video_id")
+    p_submit.add_argument("--owner", default="cli")
+    p_submit.add_argument("--force", action="store_true")
+
+    p_list = sub.add_parser("list", help="最近のジョブを表示する")
+    p_list.add_argument("--limit", type=int, default=20)
+
+    args = parser.parse_args()
+    if args.command == "worker":
+        run_worker(exit_when_idle=args.exit_when_idle)
+    elif args.command == "submit":
+        params = {"force": True} if args.force else {}
+        print(submit_job(args.video_id, args.owner, params))
+    else:
+        for job in list_jobs(limit=args.limit):
+            stage = f" ({job['current_stage']})" if job["current_stage"] else ""
+            print(f"{job['id']:>5} {job['status']:<8} {job['owner']:<12} {job['video_id']}{stage}")
+
+
+if __name__ == "__main__":
+    main()
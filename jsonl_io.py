@@ -12,7 +12,11 @@ from typing import Any, Iterable, List, Type, TypeVar
 
 import importlib
 import schemas
+import instrumentation
 importlib.reload(schemas)  # Colab用
+importlib.reload(instrumentation)
+
+from instrumentation import count_file_bytes
 
 T = TypeVar("T")
 
@@ -30,11 +34,24 @@ def write_jsonl(path: Path, records: Iterable[Any]) -> None:
                 obj = r
             json_line = json.dumps(obj, ensure_ascii=False)
             f.write(json_line + "\n")
+    count_file_bytes("bytes_written", path)
+
+
+def append_jsonl(path: Path, records: Iterable[Any]) -> None:
+    """
+    write_jsonl の追記版。ライブ処理などで1件ずつ書き足す用途。
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("a", encoding="utf-8") as f:
+        for r in records:
+            obj = asdict(r) if is_dataclass(r) else r
+            f.write(json.dumps(obj, ensure_ascii=False) + "\n")
 
 
 def read_jsonl_as_dicts(path: Path) -> List[dict]:
     if not path.exists():
         return []
+    count_file_bytes("bytes_read", path)
     out: List[dict] = []
     with path.open("r", encoding="utf-8") as f:
         for line in f:
@@ -0,0 +1,112 @@
+"""
+フレーム画像を旧レイアウト（frames/{video_id}/ 直下）からシャード分けしたレイアウト
+（frames/{video_id}/{シャード}/、paths.get_frame_path）に移すコマンド。
+
+- 画像ファイルを移動し、マニフェスト・解析結果（jsonl）の frame_path を書き換える
+- pipeline の状態を付け替える（pipeline.rebase_state）ので、移行後の実行で解析などはやり直さない
+- カタログ・キャプション検索の索引・フレーム特徴ベクトルを新しい frame_path で作り直す
+- 移行済み・フレームが無い video_id は何もしない（何度実行してもよい）
+
+実行例:
+    python layout_migration.py --all --dry-run
+    python layout_migration.py 20240501_093000_ui
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import re
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import importlib
+import paths
+import jsonl_io
+
+importlib.reload(paths)
+importlib.reload(jsonl_io)
+
+from paths import get_analysis_path, get_data_root, get_frame_path, get_frames_dir, get_manifest_path
+from jsonl_io import read_jsonl_as_dicts, write_jsonl
+
+
+def _flat_frames(video_id: str) -> Dict[str, Path]:
+    """旧レイアウトのフレーム画像（ファイル名 -> 移動先）。"""
+    pattern = re.compile(rf"^{re.escape(video_id)}_f(\d+)(\.\w+)$")
+    moves: Dict[str, Path] = {}
+    for p in get_frames_dir(video_id).iterdir():
+        m = pattern.match(p.name)
+        if p.is_file() and m:
+            moves[p.name] = get_frame_path(video_id, int(m.group(1)), ext=m.group(2))
+    return moves
+
+
+def migrate_frames(video_id: str, dry_run: bool = False) -> Dict[str, Any]:
+    """video_id のフレームを新レイアウトに移す。戻り値: 移動・書き換えの結果"""
+    frames_dir = get_frames_dir(video_id)
+    moves = _flat_frames(video_id)
+    result: Dict[str, Any] = {
+        "video_id": video_id, "moved": len(moves), "rewritten": [], "rebased": [], "reindexed": False,
+    }
+    if dry_run or not moves:
+        return result
+
+    for name, dst in moves.items():
+        os.replace(frames_dir / name, dst)
+
+    for path in (get_manifest_path(video_id), get_analysis_path(video_id)):
+        records = read_jsonl_as_dicts(path)
+        changed = False
+        for r in records:
+            old = Path(r.get("frame_path", ""))
+            if old.parent.name == video_id and old.name in moves:
+                r["frame_path"] = str(moves[old.name])
+                changed = True
+        if changed:
+            write_jsonl(path, records)
+            result["rewritten"].append(str(path))
+
+    if result["rewritten"]:
+        import pipeline
+        import catalog
+        import caption_search
+        import frame_embeddings
+
+        result["rebased"] = pipeline.rebase_state(video_id)
+        # カタログの frames・キャプション検索の索引は frame_path を持っているので作り直す
+        catalog.reindex(video_id)
+        caption_search.reindex(video_id)
+        # 特徴ベクトルはフレーム番号で引くが、移動後の画像から作り直して索引と揃えておく
+        if frame_embeddings.get_embedding_path(video_id).exists():
+            frame_embeddings.build_embeddings(video_id)
+        result["reindexed"] = True
+    return result
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="フレーム画像をシャード分けしたレイアウトに移す")
+    parser.add_argument("video_ids", nargs="*", help="移行する video_id")
+    parser.add_argument("--all", action="store_true", help="frames/ の下の全 video_id を移行する")
+    parser.add_argument("--dry-run", action="store_true", help="移動する枚数だけ表示する")
+    args = parser.parse_args(argv)
+
+    video_ids: List[str] = list(args.video_ids)
+    if args.all:
+        frames_root = get_data_root() / "frames"
+        if frames_root.exists():
+            video_ids += sorted(p.name for p in frames_root.iterdir() if p.is_dir())
+    if not video_ids:
+        parser.error("video_id か --all を指定してください")
+
+    for vid in video_ids:
+        r = migrate_frames(vid, dry_run=args.dry_run)
+        if r["moved"]:
+            verb = "would move" if args.dry_run else "moved"
+            print(f"{vid}: {verb} {r['moved']} frames, rewrote {len(r['rewritten'])} files, rebased {r['rebased']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
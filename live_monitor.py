@@ -0,0 +1,381 @@
+"""
+伸長中の動画ファイルや RTSP/HTTP ストリームを逐次読みながら、
+フレーム切り出し → 前処理 → Vision 解析 → アラート判定 をその場で回すモジュール。
+
+パイプライン全体の完了を待たずに AlertEvent をコールバック / キューへ流す。
+- 取り込みスレッド: grab() で全フレームを読み進め、サンプリング対象だけ retrieve() して保存
+- 解析スレッド: 前処理・キャプション・AlertAggregator を1フレームずつ実行
+- 解析待ちキューは上限付きで、溢れたら古いフレームから捨てる（遅延を一定以内に保つ）
+
+フレーム取得から判定/通知までの遅延を計測し、パーセンタイルで報告する。
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import queue
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterable, Optional, Union
+
+import cv2  # type: ignore
+
+import importlib
+import config_loader
+import paths
+import schemas
+import jsonl_io
+import frame_extractor
+import frame_preprocessor
+import vision_captioner
+import vision_caption_prompt
+import model_loader
+import alert_analyzer
+import video_loader
+
+importlib.reload(config_loader)
+importlib.reload(paths)
+importlib.reload(schemas)
+importlib.reload(jsonl_io)
+importlib.reload(frame_extractor)
+importlib.reload(frame_preprocessor)
+importlib.reload(vision_captioner)
+importlib.reload(vision_caption_prompt)
+importlib.reload(model_loader)
+importlib.reload(alert_analyzer)
+importlib.reload(video_loader)
+
+from config_loader import SETTINGS
+from paths import get_analysis_path, get_manifest_path
+from schemas import AlertEvent, FrameMeta
+from jsonl_io import append_jsonl
+from frame_extractor import open_capture, write_frame
+from frame_preprocessor import preprocess_frames
+from vision_captioner import analyze_frame
+from vision_caption_prompt import get_vision_prompt
+from model_loader import load_model_for_role
+from alert_analyzer import AlertAggregator
+from video_loader import generate_video_id
+
+
+def _percentile(sorted_values: list, p: float) -> float:
+    """ソート済みリストの p パーセンタイル（線形補間）。"""
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+class LatencyTracker:
+    """
+    直近 max_samples 件の遅延（秒）を保持し、パーセンタイルを返す。
+    """
+
+    def __init__(self, max_samples: int = 10000) -> None:
+        self._samples: Deque[float] = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+
+    def add(self, latency_sec: float) -> None:
+        with self._lock:
+            self._samples.append(latency_sec)
+
+    def summary(self, percentiles: Iterable[float] = (50, 90, 99)) -> Dict[str, float]:
+        with self._lock:
+            values = sorted(self._samples)
+        out: Dict[str, float] = {"count": len(values)}
+        for p in percentiles:
+            out[f"p{int(p)}"] = round(_percentile(values, p), 4)
+        out["max"] = round(values[-1], 4) if values else 0.0
+        return out
+
+
+@dataclass
+class _PendingFrame:
+    meta: FrameMeta
+    captured_at: float   # time.monotonic() でのフレーム取得時刻
+
+
+class LiveMonitor:
+    """
+    伸長中ファイル / ストリームを監視し、AlertEvent を on_alert と alert_queue に流す。
+
+    使い方:
+        monitor = LiveMonitor("rtsp://127.0.0.1:8554/cam", on_alert=print)
+        report = monitor.run()   # ブロッキング。start()/stop() で非同期にも使える
+    """
+
+    def __init__(
+        self,
+        source: Union[str, Path],
+        video_id: Optional[str] = None,
+        on_alert: Optional[Callable[[AlertEvent], None]] = None,
+        alert_queue: Optional["queue.Queue[AlertEvent]"] = None,
+        interval_sec: Optional[float] = None,
+        max_pending_frames: Optional[int] = None,
+        poll_interval_sec: Optional[float] = None,
+        idle_timeout_sec: Optional[float] = None,
+    ) -> None:
+        self.source = str(source)
+        self.is_stream = "://" in self.source
+        self.video_id = video_id or generate_video_id(prefix="live")
+        self.on_alert = on_alert
+        self.alert_queue = alert_queue
+        self.interval_sec = SETTINGS.frame_interval_sec if interval_sec is None else interval_sec
+        self.poll_interval_sec = (
+            SETTINGS.live_poll_interval_sec if poll_interval_sec is None else poll_interval_sec
+        )
+        self.idle_timeout_sec = (
+            SETTINGS.live_idle_timeout_sec if idle_timeout_sec is None else idle_timeout_sec
+        )
+        max_pending = (
+            SETTINGS.live_max_pending_frames if max_pending_frames is None else max_pending_frames
+        )
+
+        self._pending: "queue.Queue[Optional[_PendingFrame]]" = queue.Queue(
+            maxsize=max(max_pending, 1)
+        )
+        self._stop = threading.Event()
+        self._threads: list = []
+        self._counter_lock = threading.Lock()
+        self._analysis_error: Optional[BaseException] = None   # 解析スレッドが止まった原因（run() で送出する）
+
+        self.decision_latency = LatencyTracker()   # フレーム取得 → ルール判定
+        self.alert_latency = LatencyTracker()      # フレーム取得 → アラート通知
+        self.frames_captured = 0
+        self.frames_processed = 0
+        self.frames_dropped = 0
+        self.frames_failed = 0
+        self.alerts_emitted = 0
+
+    # ---------- 公開 API ----------
+
+    def start(self) -> None:
+        self._threads = [
+            threading.Thread(target=self._capture_loop, name="live-capture", daemon=True),
+            threading.Thread(target=self._analysis_loop, name="live-analysis", daemon=True),
+        ]
+        for t in self._threads:
+            t.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def join(self, timeout: Optional[float] = None) -> None:
+        for t in self._threads:
+            t.join(timeout)
+
+    def run(self) -> Dict[str, Any]:
+        """監視が終わるまでブロックしてレポートを返す。解析スレッドが例外で止まった場合はそれを送出する。"""
+        self.start()
+        try:
+            self.join()
+        except KeyboardInterrupt:
+            self.stop()
+            self.join()
+        if self._analysis_error is not None:
+            raise self._analysis_error
+        return self.report()
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "video_id": self.video_id,
+            "source": self.source,
+            "frames_captured": self.frames_captured,
+            "frames_processed": self.frames_processed,
+            "frames_dropped": self.frames_dropped,
+            "frames_failed": self.frames_failed,
+            "alerts_emitted": self.alerts_emitted,
+            "frame_to_decision_sec": self.decision_latency.summary(),
+            "frame_to_alert_sec": self.alert_latency.summary(),
+        }
+
+    # ---------- 内部処理 ----------
+
+    def _enqueue(self, item: _PendingFrame) -> None:
+        """解析待ちキューに積む。満杯なら最も古いフレームを捨てる。"""
+        while True:
+            try:
+                self._pending.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self._pending.get_nowait()
+                    with self._counter_lock:
+                        self.frames_dropped += 1
+                except queue.Empty:
+                    pass
+
+    def _close_pending(self) -> None:
+        """
+        解析スレッドに終わりの印（None）を送る。キューが満杯なら空くのを待つが、
+        解析スレッドが止まっていれば受け取る相手がいないので送らずに戻る（ここで固まらないように）。
+        """
+        while self._analysis_error is None:
+            try:
+                self._pending.put(None, timeout=self.poll_interval_sec)
+                return
+            except queue.Full:
+                continue
+
+    def _capture_loop(self) -> None:
+        cap = None
+        fps = 30.0
+        frame_pos = 0
+        saved_index = 0
+        next_sample_sec = 0.0
+        started = time.monotonic()
+        last_progress = started
+
+        try:
+            while not self._stop.is_set():
+                if cap is None:
+                    try:
+                        cap = open_capture(self.source)
+                    except RuntimeError:
+                        if time.monotonic() - last_progress > self.idle_timeout_sec:
+                            break
+                        time.sleep(self.poll_interval_sec)
+                        continue
+                    fps = cap.get(cv2.CAP_PROP_FPS) or fps
+                    if not self.is_stream and frame_pos:
+                        # 伸長中ファイル: 開き直したら読んだ位置から再開
+                        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_pos)
+
+                if not cap.grab():
+                    # 末尾に到達（ファイルが伸びるのを待つ）/ ストリーム切断
+                    cap.release()
+                    cap = None
+                    if time.monotonic() - last_progress > self.idle_timeout_sec:
+                        break
+                    time.sleep(self.poll_interval_sec)
+                    continue
+
+                last_progress = time.monotonic()
+                if self.is_stream:
+                    time_sec = last_progress - started
+                else:
+                    time_sec = frame_pos / fps
+                frame_pos += 1
+
+                if time_sec + 1e-6 < next_sample_sec:
+                    continue
+
+                ok, frame = cap.retrieve()
+                if not ok:
+                    continue
+                captured_at = time.monotonic()
+                next_sample_sec = time_sec + self.interval_sec
+
+                out_path = write_frame(self.video_id, saved_index, frame)
+                meta = FrameMeta(
+                    video_id=self.video_id,
+                    frame_index=saved_index,
+                    time_sec=time_sec,
+                    frame_path=str(out_path),
+                )
+                saved_index += 1
+                self.frames_captured += 1
+                self._enqueue(_PendingFrame(meta=meta, captured_at=captured_at))
+        finally:
+            if cap is not None:
+                cap.release()
+            self._close_pending()
+
+    def _analysis_loop(self) -> None:
+        try:
+            self._analyze_pending()
+        except BaseException as e:
+            print(f"[WARN] live analysis stopped: {type(e).__name__}: {e}")
+            self._analysis_error = e
+            self._stop.set()   # 取り込みも止める（解析されないフレームを取り込み続けないように）
+            while True:        # 取り込みスレッドが待っていれば空ける
+                try:
+                    self._pending.get_nowait()
+                except queue.Empty:
+                    break
+
+    def _analyze_pending(self) -> None:
+        model_info = load_model_for_role("vision_caption")
+        prompt = get_vision_prompt()
+        aggregator = AlertAggregator(self.video_id, emit_on_enter=True)
+        manifest_path = get_manifest_path(self.video_id)
+        analysis_path = get_analysis_path(self.video_id)
+
+        while True:
+            item = self._pending.get()
+            if item is None:
+                break
+
+            try:
+                metas = preprocess_frames([item.meta])
+                if not metas:
+                    continue
+                fa = analyze_frame(model_info, metas[0], prompt)
+            except Exception as e:
+                print(f"[WARN] live analysis failed for frame {item.meta.frame_path}: {e}")
+                self.frames_failed += 1
+                continue
+
+            # 後段のバッチ処理（ベストショット・日記）でもそのまま使えるよう書き足す
+            append_jsonl(manifest_path, metas)
+            append_jsonl(analysis_path, [fa])
+
+            events = aggregator.push(fa)
+            self.decision_latency.add(time.monotonic() - item.captured_at)
+            self.frames_processed += 1
+
+            for ev in events:
+                self._emit(ev, item.captured_at)
+
+        for ev in aggregator.flush():
+            self._emit(ev, None)
+
+    def _emit(self, ev: AlertEvent, captured_at: Optional[float]) -> None:
+        if captured_at is not None and ev.extra.get("state") == "open":
+            self.alert_latency.add(time.monotonic() - captured_at)
+        self.alerts_emitted += 1
+
+        if self.alert_queue is not None:
+            try:
+                self.alert_queue.put_nowait(ev)
+            except queue.Full:
+                print(f"[WARN] alert queue is full, dropped alert: {ev.reason}")
+        if self.on_alert is not None:
+            try:
+                self.on_alert(ev)
+            except Exception as e:
+                print(f"[WARN] on_alert callback failed: {e}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="伸長中ファイル / ストリームのライブアラート監視")
+    parser.add_argument("source", help="動画ファイルパス、または rtsp:// / http:// の URL")
+    parser.add_argument("--video-id", default=None)
+    parser.add_argument("--interval-sec", type=float, default=None)
+    args = parser.parse_args()
+
+    def _print_alert(ev: AlertEvent) -> None:
+        state = ev.extra.get("state", "")
+        print(
+            f"[ALERT:{ev.level}:{state}] {ev.start_time_sec:.1f}s-{ev.end_time_sec:.1f}s "
+            f"{ev.reason}"
+        )
+
+    monitor = LiveMonitor(
+        args.source,
+        video_id=args.video_id,
+        on_alert=_print_alert,
+        interval_sec=args.interval_sec,
+    )
+    report = monitor.run()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -12,18 +12,23 @@ model["backend"] を見て分岐する。
 
 from __future__ import annotations
 
-from typing import Any, Dict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator
 import os
+import time
 
 import importlib
 import config_loader
 import secrets_helper
+import instrumentation
 
 importlib.reload(config_loader)
 importlib.reload(secrets_helper)
+importlib.reload(instrumentation)
 
 from config_loader import MODEL_SETTINGS
 from secrets_helper import init_gemini_api_key, init_sambanova_api_key
+from instrumentation import count, span
 
 # Gemini SDK
 try:
@@ -40,7 +45,45 @@ except ImportError:
 
 _MODEL_CACHE: Dict[str, Any] = {}
 _GEMINI_CLIENT: Any = None
-_SAMBANOVA_CLIENT: Any = None
+_SAMBANOVA_CLIENTS: Dict[str, Any] = {}
+
+SAMBANOVA_DEFAULT_BASE_URL = "https://api.sambanova.ai/v1"
+
+# LLM API の同時呼び出し数の上限（batch_runner が multiprocessing.Semaphore を渡す）。None なら無制限
+_API_LIMITER: Any = None
+
+
+def set_api_limiter(limiter: Any) -> None:
+    """
+    全 API 呼び出しで共有する同時実行数の上限を設定する。
+    limiter は acquire / release を持つもの（threading / multiprocessing の Semaphore）。
+    プロセスをまたいで同じ Semaphore を渡せば、全プロセス合計での上限になる。
+    """
+    global _API_LIMITER
+    _API_LIMITER = limiter
+
+
+@contextmanager
+def api_slot(name: str = "llm") -> Iterator[Dict[str, Any]]:
+    """
+    LLM API を呼ぶ間だけ枠を1つ確保する。
+    呼び出しは instrumentation の span（kind="llm"、枠待ち時間 wait_sec 付き）と api_calls / api_errors に記録される。
+    yield する dict に値を入れると span の属性として残る（プロンプトの版など）。
+    """
+    with span(name, kind="llm") as attrs:
+        waited = time.perf_counter()
+        if _API_LIMITER is not None:
+            _API_LIMITER.acquire()
+        attrs["wait_sec"] = round(time.perf_counter() - waited, 6)
+        count("api_calls")
+        try:
+            yield attrs
+        except Exception:
+            count("api_errors")
+            raise
+        finally:
+            if _API_LIMITER is not None:
+                _API_LIMITER.release()
 
 
 def get_model_config(role: str) -> Dict[str, Any]:
@@ -78,11 +121,14 @@ def _get_gemini_client() -> Any:
     return _GEMINI_CLIENT
 
 
-def _get_sambanova_client() -> Any:
-    global _SAMBANOVA_CLIENT
-
-    if _SAMBANOVA_CLIENT is not None:
-        return _SAMBANOVA_CLIENT
+def _get_sambanova_client(base_url: str = SAMBANOVA_DEFAULT_BASE_URL) -> Any:
+    """
+    base_url ごとにクライアントを作って使い回す。
+    base_url は models.yaml の base_url か環境変数 SAMBANOVA_BASE_URL で差し替えられる
+    （OpenAI 互換のプロキシや、benchmark.py のモックサーバーに向けるときに使う）。
+    """
+    if base_url in _SAMBANOVA_CLIENTS:
+        return _SAMBANOVA_CLIENTS[base_url]
 
     # ここで Colab / Cloud Run / ローカルのいずれかから SAMBANOVA_API_KEY を初期化
     init_sambanova_api_key()
@@ -94,11 +140,12 @@ def _get_sambanova_client() -> Any:
     if not api_key:
         raise RuntimeError("SAMBANOVA_API_KEY が設定されていません。")
 
-    _SAMBANOVA_CLIENT = SambaNova(
+    client = SambaNova(
         api_key=api_key,
-        base_url="https://api.sambanova.ai/v1",
+        base_url=base_url,
     )
-    return _SAMBANOVA_CLIENT
+    _SAMBANOVA_CLIENTS[base_url] = client
+    return client
 
 
 def load_model_for_role(role: str) -> Dict[str, Any]:
@@ -127,7 +174,12 @@ def load_model_for_role(role: str) -> Dict[str, Any]:
         }
 
     elif backend == "sambanova":
-        client = _get_sambanova_client()
+        base_url = (
+            cfg.get("base_url")
+            or os.environ.get("SAMBANOVA_BASE_URL")
+            or SAMBANOVA_DEFAULT_BASE_URL
+        )
+        client = _get_sambanova_client(base_url)
         # モデル名が指定されていない場合はデフォルトを使用
         if not model_name:
             model_name = "Llama-4-Maverick-17B-128E-Instruct"
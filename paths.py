@@ -6,6 +6,7 @@
 from __future__ import annotations
 
 from pathlib import Path
+from typing import List, Set
 
 import importlib
 import config_loader
@@ -14,36 +15,87 @@ importlib.reload(config_loader)  # Colab用: 編集後も最新を読む
 from config_loader import SETTINGS
 
 
+# フレーム画像は frames/{video_id}/{シャード}/ に分けて置く（1ディレクトリのファイル数を抑える）
+FRAMES_PER_SHARD = 1000
+
+# このプロセスで作成済みのディレクトリ。パスを求めるたびに mkdir（stat）しないようにする
+_ENSURED_DIRS: Set[Path] = set()
+
+
+def _ensure_dir(d: Path) -> Path:
+    if d not in _ENSURED_DIRS:
+        d.mkdir(parents=True, exist_ok=True)
+        _ENSURED_DIRS.add(d)
+    return d
+
+
+def forget_dirs() -> None:
+    """作成済みディレクトリの記録を消す（実行中にディレクトリを消した場合など）。"""
+    _ENSURED_DIRS.clear()
+
+
 def get_data_root() -> Path:
-    root = SETTINGS.data_root
-    root.mkdir(parents=True, exist_ok=True)
-    return root
+    return _ensure_dir(SETTINGS.data_root)
 
 
 def get_raw_video_dir() -> Path:
-    d = get_data_root() / "raw_videos"
-    d.mkdir(parents=True, exist_ok=True)
-    return d
+    return _ensure_dir(get_data_root() / "raw_videos")
 
 
 def get_raw_video_path(video_id: str, suffix: str = ".mp4") -> Path:
     return get_raw_video_dir() / f"{video_id}{suffix}"
 
 
-def get_frames_dir(video_id: str) -> Path:
+def get_proxy_video_path(video_id: str) -> Path:
+    """デコード用に変換したプロキシ動画（video_ingest が作る）。"""
+    return _ensure_dir(get_data_root() / "proxies") / f"{video_id}_proxy.mp4"
+
+
+def get_frames_dir(video_id: str, create: bool = True) -> Path:
     d = get_data_root() / "frames" / video_id
-    d.mkdir(parents=True, exist_ok=True)
-    return d
+    return _ensure_dir(d) if create else d
+
+
+def get_frame_shard_dir(video_id: str, frame_index: int, create: bool = True) -> Path:
+    d = get_frames_dir(video_id, create) / f"{frame_index // FRAMES_PER_SHARD:04d}"
+    return _ensure_dir(d) if create else d
+
+
+def get_frame_path(video_id: str, frame_index: int, ext: str = ".png", create: bool = True) -> Path:
+    """create=False なら（読むだけのときなど）ディレクトリを作らない。"""
+    return get_frame_shard_dir(video_id, frame_index, create) / f"{video_id}_f{frame_index:05d}{ext}"
+
+
+def list_frame_files(video_id: str, pattern: str = "*.png") -> List[Path]:
+    """video_id のフレーム画像（シャードの下も含む）をパス順に返す。"""
+    return sorted(get_frames_dir(video_id).rglob(pattern))
+
 
+def get_embeddings_dir() -> Path:
+    return _ensure_dir(get_data_root() / "embeddings")
 
-def get_frame_path(video_id: str, frame_index: int, ext: str = ".png") -> Path:
-    return get_frames_dir(video_id) / f"{video_id}_f{frame_index:05d}{ext}"
+
+def get_embedding_path(video_id: str) -> Path:
+    """フレームの特徴ベクトル（float32, フレーム数 × 次元。np.load(mmap_mode="r") で読む）。"""
+    return get_embeddings_dir() / f"{video_id}_emb.npy"
+
+
+def get_embedding_frames_path(video_id: str) -> Path:
+    """get_embedding_path の各行のフレーム番号（int32）。"""
+    return get_embeddings_dir() / f"{video_id}_emb_frames.npy"
+
+
+def get_frame_pack_dir() -> Path:
+    return _ensure_dir(get_data_root() / "frame_packs")
+
+
+def get_frame_pack_path(video_id: str) -> Path:
+    """フレーム画像をまとめたパック（無圧縮 zip。frame_store が作る）。"""
+    return get_frame_pack_dir() / f"{video_id}_frames.zip"
 
 
 def get_manifest_dir() -> Path:
-    d = get_data_root() / "manifests"
-    d.mkdir(parents=True, exist_ok=True)
-    return d
+    return _ensure_dir(get_data_root() / "manifests")
 
 
 def get_manifest_path(video_id: str) -> Path:
@@ -51,34 +103,119 @@ def get_manifest_path(video_id: str) -> Path:
 
 
 def get_analysis_dir() -> Path:
-    d = get_data_root() / "analysis"
-    d.mkdir(parents=True, exist_ok=True)
-    return d
+    return _ensure_dir(get_data_root() / "analysis")
 
 
 def get_analysis_path(video_id: str) -> Path:
     return get_analysis_dir() / f"{video_id}_analysis.jsonl"
 
 
+def get_candidate_report_path(video_id: str) -> Path:
+    return get_analysis_dir() / f"{video_id}_candidates.json"
+
+
+def get_alerts_path(video_id: str) -> Path:
+    return get_analysis_dir() / f"{video_id}_alerts.jsonl"
+
+
+def get_audio_alerts_path(video_id: str) -> Path:
+    return get_analysis_dir() / f"{video_id}_audio_alerts.jsonl"
+
+
 def get_bestshots_dir(video_id: str) -> Path:
-    d = get_data_root() / "bestshots" / video_id
-    d.mkdir(parents=True, exist_ok=True)
-    return d
+    return _ensure_dir(get_data_root() / "bestshots" / video_id)
 
 
 def get_bestshot_image_path(video_id: str, rank: int, ext: str = ".png") -> Path:
     return get_bestshots_dir(video_id) / f"{video_id}_best_{rank:02d}{ext}"
 
 
+def get_bestshot_thumbnail_path(video_id: str, rank: int, size: int, ext: str = ".webp") -> Path:
+    return get_bestshots_dir(video_id) / "thumbs" / f"{video_id}_best_{rank:02d}_{size}{ext}"
+
+
 def get_bestshot_meta_path(video_id: str) -> Path:
     return get_bestshots_dir(video_id) / f"{video_id}_bestshots.json"
 
 
 def get_diary_dir() -> Path:
-    d = get_data_root() / "diary"
-    d.mkdir(parents=True, exist_ok=True)
-    return d
+    return _ensure_dir(get_data_root() / "diary")
 
 
 def get_diary_path(video_id: str, ext: str = ".md") -> Path:
     return get_diary_dir() / f"{video_id}_diary{ext}"
+
+
+def get_diary_partial_path(video_id: str) -> Path:
+    """日記ステージの実行中だけ存在する、生成途中の日記テキスト（画面が読んで逐次表示する）。"""
+    return get_diary_dir() / f"{video_id}_diary.partial.md"
+
+
+def get_diary_stats_path(video_id: str) -> Path:
+    return get_diary_dir() / f"{video_id}_diary_stats.json"
+
+
+def get_diary_chunk_dir(video_id: str) -> Path:
+    return _ensure_dir(get_diary_dir() / "chunks" / video_id)
+
+
+def get_diary_chunk_path(video_id: str, chunk_index: int, digest: str) -> Path:
+    return get_diary_chunk_dir(video_id) / f"chunk_{chunk_index:04d}_{digest}.txt"
+
+
+def get_runs_dir(video_id: str) -> Path:
+    return _ensure_dir(get_data_root() / "runs" / video_id)
+
+
+def get_pipeline_state_path(video_id: str) -> Path:
+    return get_runs_dir(video_id) / "pipeline_state.json"
+
+
+def get_pipeline_report_path(video_id: str) -> Path:
+    return get_runs_dir(video_id) / "pipeline_report.json"
+
+
+def get_profile_dir(video_id: str) -> Path:
+    return _ensure_dir(get_runs_dir(video_id) / "profile")
+
+
+def get_video_meta_path(video_id: str) -> Path:
+    return get_runs_dir(video_id) / "video_meta.json"
+
+
+def get_metrics_path(video_id: str) -> Path:
+    return get_runs_dir(video_id) / "metrics.json"
+
+
+def get_metrics_prom_path(video_id: str) -> Path:
+    return get_runs_dir(video_id) / "metrics.prom"
+
+
+def get_batch_report_path(batch_id: str) -> Path:
+    return _ensure_dir(get_data_root() / "runs" / "_batches") / f"{batch_id}.json"
+
+
+def get_benchmarks_dir() -> Path:
+    return _ensure_dir(get_data_root() / "benchmarks")
+
+
+def get_jobs_dir() -> Path:
+    return _ensure_dir(get_data_root() / "jobs")
+
+
+def get_job_db_path() -> Path:
+    return get_jobs_dir() / "jobs.sqlite3"
+
+
+def get_job_log_path() -> Path:
+    return get_jobs_dir() / "workers.log"
+
+
+def get_catalog_db_path() -> Path:
+    """動画・実行・成果物のカタログ（catalog.py）。"""
+    return _ensure_dir(get_data_root()) / "catalog.sqlite3"
+
+
+def get_search_db_path() -> Path:
+    """キャプション・タグの全文検索の索引（caption_search.py）。"""
+    return _ensure_dir(get_data_root()) / "search.sqlite3"
@@ -0,0 +1,654 @@
+"""
+動画 → フレーム → マニフェスト → 解析 → ベストショット / 日記 / アラート を
+ステージ単位で実行し、入力が変わっていないステージはスキップするパイプライン実行モジュール。
+
+各ステージは「入力の指紋（fingerprint）」を runs/{video_id}/pipeline_state.json に記録する。
+指紋は次の sha256:
+- 上流ステージの成果物（と元動画）の内容ハッシュ
+- そのステージに関係する SETTINGS の値
+- models.yaml の役割ごとの設定（LLM を使うステージのみ）
+- プロンプトテンプレートの内容ハッシュ（LLM を使うステージのみ）
+
+指紋が前回と同じで、成果物も前回書いたまま残っていればスキップ（make と同じ考え方）。
+上流が再計算されても成果物の中身が同じなら、下流はスキップされる。
+実行結果（ステージごとの hit / miss と理由・所要時間）は runs/{video_id}/pipeline_report.json に保存する。
+ステージ・LLM 呼び出しごとの計測（instrumentation）は runs/{video_id}/metrics.json / metrics.prom に保存する。
+成果物・実行の記録はカタログ（catalog.py）にも書き、画面などはファイルを探さずにそちらを引く。
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import importlib
+import config_loader
+import paths
+import schemas
+import jsonl_io
+import model_loader
+import prompt_templates
+import vision_caption_prompt
+import audio_analyzer
+import video_ingest
+import frame_extractor
+import frame_preprocessor
+import frame_store
+import manifest_builder
+import vision_captioner
+import bestshot_scorer
+import diary_generator
+import alert_analyzer
+import instrumentation
+import catalog
+
+importlib.reload(config_loader)
+importlib.reload(paths)
+importlib.reload(schemas)
+importlib.reload(jsonl_io)
+importlib.reload(model_loader)
+importlib.reload(prompt_templates)
+importlib.reload(vision_caption_prompt)
+importlib.reload(audio_analyzer)
+importlib.reload(video_ingest)
+importlib.reload(frame_extractor)
+importlib.reload(frame_preprocessor)
+importlib.reload(frame_store)
+importlib.reload(manifest_builder)
+importlib.reload(vision_captioner)
+importlib.reload(bestshot_scorer)
+importlib.reload(diary_generator)
+importlib.reload(alert_analyzer)
+importlib.reload(instrumentation)
+importlib.reload(catalog)
+
+from config_loader import SETTINGS
+from paths import (
+    get_alerts_path,
+    get_analysis_path,
+    get_audio_alerts_path,
+    get_bestshot_meta_path,
+    get_diary_partial_path,
+    get_diary_path,
+    get_embedding_frames_path,
+    get_embedding_path,
+    get_frame_pack_path,
+    get_manifest_path,
+    get_pipeline_report_path,
+    get_pipeline_state_path,
+    get_profile_dir,
+    get_proxy_video_path,
+    get_raw_video_path,
+    get_video_meta_path,
+)
+from schemas import AlertEvent
+from jsonl_io import read_jsonl_as_dataclasses, write_jsonl
+from model_loader import get_model_config
+from prompt_templates import (
+    build_chunk_summary_prompt,
+    build_diary_prompt_from_lines,
+    build_diary_reduce_prompt,
+)
+from vision_caption_prompt import build_vision_caption_prompt
+from audio_analyzer import detect_audio_alerts, alerts_to_focus_segments
+from video_ingest import ingest_video
+from frame_extractor import extract_frames
+from frame_preprocessor import preprocess_frames
+from frame_store import pack_after_extraction
+from manifest_builder import build_manifest
+from vision_captioner import run_captioning
+from bestshot_scorer import select_bestshots
+from diary_generator import stream_diary
+from alert_analyzer import collect_alerts
+from instrumentation import count, end_run, span, start_run
+from catalog import record_artifacts, record_run
+
+
+# 元動画を表す疑似ステージ名（deps に書ける）
+VIDEO = "video"
+
+StageRunner = Callable[[str, Dict[str, Any]], Any]
+
+
+@dataclass
+class Stage:
+    """パイプラインの1ステージ。"""
+    name: str
+    deps: Tuple[str, ...]
+    run: StageRunner                           # (video_id, ctx) -> 任意（戻り値は使わない）
+    outputs: Callable[[str], List[Path]]       # このステージが書く成果物
+    settings_keys: Tuple[str, ...] = ()        # 指紋に含める SETTINGS の属性名
+    params: Tuple[str, ...] = ()               # 指紋に含める ctx のキー（UI から渡す実行時オプション）
+    model_role: Optional[str] = None           # 指紋に含める models.yaml の役割
+    prompt: Optional[Callable[[], str]] = None # 指紋に含めるプロンプトテンプレート
+
+
+# ---------------------------------------------------------------------------
+# ステージの実装
+# ---------------------------------------------------------------------------
+
+def _run_ingest(video_id: str, ctx: Dict[str, Any]) -> None:
+    ingest_video(video_id)
+
+
+def _run_audio(video_id: str, ctx: Dict[str, Any]) -> None:
+    if not SETTINGS.audio_enabled:
+        write_jsonl(get_audio_alerts_path(video_id), [])
+        return
+    try:
+        detect_audio_alerts(video_id)
+    except RuntimeError as e:
+        # ffmpeg が無いなど。音声なしとして下流を続ける
+        print(f"[WARN] 音声解析をスキップしました: {e}")
+        write_jsonl(get_audio_alerts_path(video_id), [])
+
+
+def _run_frames(video_id: str, ctx: Dict[str, Any]) -> None:
+    audio_alerts = read_jsonl_as_dataclasses(get_audio_alerts_path(video_id), AlertEvent)
+    frames_meta = extract_frames(video_id, focus_segments=alerts_to_focus_segments(audio_alerts))
+    frames_meta = preprocess_frames(frames_meta)
+    build_manifest(video_id, frames_meta)
+    pack_after_extraction(video_id)
+
+
+def _run_analysis(video_id: str, ctx: Dict[str, Any]) -> None:
+    run_captioning(video_id, mode=ctx.get("captioning_mode"))
+
+
+def _run_bestshots(video_id: str, ctx: Dict[str, Any]) -> None:
+    select_bestshots(video_id)
+
+
+DIARY_PARTIAL_INTERVAL_SEC = 0.3   # 生成途中の日記を書き出す間隔
+
+
+def _run_diary(video_id: str, ctx: Dict[str, Any]) -> None:
+    """
+    日記をストリーミングで生成し、途中経過を diary/{video_id}_diary.partial.md に書き出す
+    （ジョブの状態を表示している画面が読んで逐次表示する。書き終えたら消す）。
+    """
+    partial = get_diary_partial_path(video_id)
+    tmp = partial.with_name(f".{partial.name}.part")
+    text = ""
+    written_at = 0.0
+    try:
+        for piece in stream_diary(video_id):
+            text += piece
+            now = time.monotonic()
+            if now - written_at >= DIARY_PARTIAL_INTERVAL_SEC:
+                tmp.write_text(text, encoding="utf-8")
+                os.replace(tmp, partial)
+                written_at = now
+    finally:
+        tmp.unlink(missing_ok=True)
+        partial.unlink(missing_ok=True)
+
+
+def _run_alerts(video_id: str, ctx: Dict[str, Any]) -> None:
+    write_jsonl(get_alerts_path(video_id), collect_alerts(video_id))
+
+
+def _diary_prompt_template() -> str:
+    """日記まわりのテンプレート本文（中身の変化を検出するためだけに使う）。"""
+    lines = ["- {caption}"]
+    return "\n\n".join(
+        [
+            build_diary_prompt_from_lines(lines, SETTINGS.diary_max_chars, SETTINGS.diary_language),
+            build_chunk_summary_prompt(
+                lines, "{time_range}", SETTINGS.diary_chunk_max_chars, SETTINGS.diary_language
+            ),
+            build_diary_reduce_prompt(lines, SETTINGS.diary_max_chars, SETTINGS.diary_language),
+        ]
+    )
+
+
+_AUDIO_KEYS = (
+    "audio_enabled",
+    "audio_sample_rate",
+    "audio_window_sec",
+    "audio_hop_sec",
+    "audio_loud_margin_db",
+    "audio_min_loud_db",
+    "audio_cry_band_ratio",
+    "audio_cry_max_flatness",
+    "audio_min_event_sec",
+    "audio_gap_sec",
+)
+
+_ALERT_KEYS = (
+    "alert_gap_tolerance_sec",
+    "alert_enter_hits",
+    "alert_exit_misses",
+    "alert_critical_duration_sec",
+    "alert_critical_density",
+    "alert_critical_min_hits",
+)
+
+_INGEST_KEYS = (
+    "ingest_proxy_enabled",
+    "ingest_proxy_max_height",
+    "ingest_proxy_codecs",
+    "ingest_proxy_crf",
+    "ingest_proxy_preset",
+    "ingest_proxy_gop_sec",
+)
+
+STAGES: List[Stage] = [
+    Stage(
+        name="ingest",
+        deps=(VIDEO,),
+        run=_run_ingest,
+        outputs=lambda vid: [get_video_meta_path(vid)]
+        + ([get_proxy_video_path(vid)] if SETTINGS.ingest_proxy_enabled else []),
+        settings_keys=_INGEST_KEYS,
+    ),
+    Stage(
+        name="audio",
+        deps=(VIDEO,),
+        run=_run_audio,
+        outputs=lambda vid: [get_audio_alerts_path(vid)],
+        settings_keys=_AUDIO_KEYS + _ALERT_KEYS,
+    ),
+    Stage(
+        name="frames",
+        deps=(VIDEO, "ingest", "audio"),
+        run=_run_frames,
+        outputs=lambda vid: [get_manifest_path(vid)]
+        + ([get_frame_pack_path(vid)] if SETTINGS.frame_pack_enabled else [])
+        + ([get_embedding_path(vid), get_embedding_frames_path(vid)] if SETTINGS.embeddings_enabled else []),
+        settings_keys=(
+            "frame_interval_sec",
+            "audio_dense_interval_sec",
+            "audio_focus_padding_sec",
+            "embeddings_enabled",
+        ),
+    ),
+    Stage(
+        name="analysis",
+        deps=("frames",),
+        run=_run_analysis,
+        outputs=lambda vid: [get_analysis_path(vid)],
+        settings_keys=(
+            "captioning_candidate_factor",
+            "captioning_person_detection",
+            "captioning_prompt_version",
+            "captioning_max_reasks",
+            "max_bestshots",
+        ),
+        params=("captioning_mode",),
+        model_role="vision_caption",
+        prompt=build_vision_caption_prompt,
+    ),
+    Stage(
+        name="bestshots",
+        deps=("analysis", "frames"),   # frames: 見た目の類似度に特徴ベクトルを使う
+        run=_run_bestshots,
+        outputs=lambda vid: [get_bestshot_meta_path(vid)],
+        settings_keys=(
+            "max_bestshots",
+            "bestshot_min_gap_sec",
+            "bestshot_mmr_lambda",
+            "bestshot_candidate_pool_factor",
+            "bestshot_duplicate_similarity",
+            "bestshot_weights",
+            "bestshot_thumbnail_sizes",
+            "bestshot_thumbnail_format",
+            "bestshot_thumbnail_quality",
+        ),
+    ),
+    Stage(
+        name="diary",
+        deps=("analysis",),
+        run=_run_diary,
+        outputs=lambda vid: [get_diary_path(vid)],
+        settings_keys=(
+            "diary_max_chars",
+            "diary_language",
+            "diary_condense",
+            "diary_similarity_threshold",
+            "diary_prompt_token_budget",
+            "diary_mode",
+            "diary_chunk_minutes",
+            "diary_chunk_max_chars",
+        ),
+        model_role="diary_writer",
+        prompt=_diary_prompt_template,
+    ),
+    Stage(
+        name="alerts",
+        deps=("analysis", "audio"),    # audio: 音声のアラートも同じ一覧にまとめる
+        run=_run_alerts,
+        outputs=lambda vid: [get_alerts_path(vid)],
+        settings_keys=_ALERT_KEYS,
+    ),
+]
+
+STAGE_NAMES = [s.name for s in STAGES]
+
+
+# ---------------------------------------------------------------------------
+# 指紋
+# ---------------------------------------------------------------------------
+
+def _sha256_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _canonical(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, default=str)
+
+
+def _file_digest(path: Path, cache: Dict[str, List[Any]]) -> Optional[str]:
+    """
+    ファイル内容の sha256。サイズと mtime が前回と同じならキャッシュを使う（大きな動画を毎回読まない）。
+    ファイルが無ければ None。
+    """
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    key = str(path)
+    cached = cache.get(key)
+    if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+        return cached[2]
+
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    digest = h.hexdigest()
+    cache[key] = [st.st_size, st.st_mtime_ns, digest]
+    return digest
+
+
+def _fingerprint_parts(
+    stage: Stage,
+    upstream: Dict[str, Dict[str, Optional[str]]],
+    ctx: Dict[str, Any],
+) -> Dict[str, str]:
+    """指紋の構成要素ごとのハッシュ（どれが変わったかを報告に出すため分けて持つ）。"""
+    parts = {
+        "upstream": _sha256_text(_canonical({d: upstream.get(d) for d in stage.deps})),
+        "settings": _sha256_text(
+            _canonical({k: getattr(SETTINGS, k) for k in stage.settings_keys})
+        ),
+    }
+    if stage.params:
+        parts["params"] = _sha256_text(_canonical({k: ctx.get(k) for k in stage.params}))
+    if stage.model_role:
+        parts["model"] = _sha256_text(_canonical(get_model_config(stage.model_role)))
+    if stage.prompt:
+        parts["prompt"] = _sha256_text(stage.prompt())
+    return parts
+
+
+def _fingerprint(parts: Dict[str, str]) -> str:
+    return _sha256_text(_canonical(parts))
+
+
+# ---------------------------------------------------------------------------
+# 実行
+# ---------------------------------------------------------------------------
+
+def _load_state(video_id: str) -> Dict[str, Any]:
+    path = get_pipeline_state_path(video_id)
+    if not path.exists():
+        return {"stages": {}, "file_digests": {}}
+    try:
+        state = json.loads(path.read_text(encoding="utf-8"))
+    except json.JSONDecodeError:
+        print(f"[WARN] pipeline state is broken, ignored: {path}")
+        return {"stages": {}, "file_digests": {}}
+    state.setdefault("stages", {})
+    state.setdefault("file_digests", {})
+    return state
+
+
+def _save_state(video_id: str, state: Dict[str, Any]) -> None:
+    get_pipeline_state_path(video_id).write_text(
+        json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8"
+    )
+
+
+def _stages_for(targets: Optional[Sequence[str]]) -> List[Stage]:
+    """targets とその上流だけを、STAGES の順（トポロジカル順）で返す。"""
+    if not targets:
+        return list(STAGES)
+    by_name = {s.name: s for s in STAGES}
+    unknown = [t for t in targets if t not in by_name]
+    if unknown:
+        raise ValueError(f"Unknown stage(s): {unknown}. Available: {STAGE_NAMES}")
+
+    needed = set()
+    stack = list(targets)
+    while stack:
+        name = stack.pop()
+        if name in needed or name == VIDEO:
+            continue
+        needed.add(name)
+        stack.extend(by_name[name].deps)
+    return [s for s in STAGES if s.name in needed]
+
+
+def _miss_reason(
+    prev: Optional[Dict[str, Any]],
+    parts: Dict[str, str],
+    outputs: Dict[str, Optional[str]],
+) -> Optional[str]:
+    """スキップできない理由（スキップできるなら None）。"""
+    if prev is None:
+        return "no previous run"
+    changed = [k for k, v in parts.items() if prev.get("parts", {}).get(k) != v]
+    if changed:
+        return "changed: " + ", ".join(changed)
+    if any(d is None for d in outputs.values()):
+        return "outputs missing"
+    if outputs != prev.get("outputs"):
+        return "outputs modified"
+    return None
+
+
+def run_pipeline(
+    video_id: str,
+    targets: Optional[Sequence[str]] = None,
+    force: bool = False,
+    captioning_mode: Optional[str] = None,
+    runners: Optional[Dict[str, StageRunner]] = None,
+    on_stage_start: Optional[Callable[[str], None]] = None,
+    on_stage_end: Optional[Callable[[Dict[str, Any]], None]] = None,
+    profile: Optional[bool] = None,
+) -> Dict[str, Any]:
+    """
+    targets（省略時は全ステージ）に必要なステージを順に実行する。入力が変わっていないステージはスキップ。
+
+    force: True なら指紋に関係なく全ステージを再実行する
+    captioning_mode: vision_captioner.run_captioning の mode（None なら settings.yaml の値）
+    runners: ステージ名 -> 実行関数 の差し替え（Streamlit で日記をストリーミング表示する場合など）
+    on_stage_start / on_stage_end: 進捗表示用のコールバック（end にはそのステージの報告 dict を渡す）
+    profile: True なら実行したステージのプロファイルを runs/{video_id}/profile/ に書く
+        （None なら settings.yaml の profiling.enabled）
+
+    戻り値: 実行報告（runs/{video_id}/pipeline_report.json にも保存）
+    """
+    if not get_raw_video_path(video_id).exists():
+        raise FileNotFoundError(f"Video not found: {get_raw_video_path(video_id)}")
+
+    ctx: Dict[str, Any] = {
+        "captioning_mode": captioning_mode or SETTINGS.captioning_mode,
+    }
+    runners = runners or {}
+    state = _load_state(video_id)
+    digests = state["file_digests"]
+
+    # 上流の成果物ハッシュ（ステージ名 -> {パス: ハッシュ}）
+    upstream: Dict[str, Dict[str, Optional[str]]] = {
+        VIDEO: {"video": _file_digest(get_raw_video_path(video_id), digests)},
+    }
+
+    started = time.perf_counter()
+    report: Dict[str, Any] = {
+        "video_id": video_id,
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "force": force,
+        "stages": [],
+    }
+
+    # 各ステージ・LLM 呼び出しの時間やカウンタを記録し、runs/{video_id}/metrics.json, metrics.prom に書く
+    metrics_run = start_run(video_id, profile=profile)
+    try:
+        for stage in _stages_for(targets):
+            parts = _fingerprint_parts(stage, upstream, ctx)
+            fingerprint = _fingerprint(parts)
+            prev = state["stages"].get(stage.name)
+            outputs = {str(p): _file_digest(p, digests) for p in stage.outputs(video_id)}
+
+            reason = "forced" if force else _miss_reason(prev, parts, outputs)
+            if on_stage_start is not None:
+                on_stage_start(stage.name)
+
+            t0 = time.perf_counter()
+            with span(stage.name, kind="stage", cache="miss" if reason is not None else "hit"):
+                count("cache_misses" if reason is not None else "cache_hits")
+                if reason is not None:
+                    runners.get(stage.name, stage.run)(video_id, ctx)
+                    outputs = {str(p): _file_digest(p, digests) for p in stage.outputs(video_id)}
+                    state["stages"][stage.name] = {
+                        "fingerprint": fingerprint,
+                        "parts": parts,
+                        "outputs": outputs,
+                        "finished_at": datetime.now().isoformat(timespec="seconds"),
+                    }
+                    # 1ステージごとに保存しておけば、途中で落ちても終わった分は次回スキップできる
+                    _save_state(video_id, state)
+            upstream[stage.name] = outputs
+            record_artifacts(video_id, stage.name, outputs)
+
+            entry = {
+                "stage": stage.name,
+                "status": "miss" if reason is not None else "hit",
+                "reason": reason,
+                "elapsed_sec": round(time.perf_counter() - t0, 3),
+            }
+            report["stages"].append(entry)
+            if on_stage_end is not None:
+                on_stage_end(entry)
+    finally:
+        metrics = end_run(metrics_run)
+
+    report["elapsed_sec"] = round(time.perf_counter() - started, 3)
+    report["hits"] = sum(1 for e in report["stages"] if e["status"] == "hit")
+    report["misses"] = sum(1 for e in report["stages"] if e["status"] == "miss")
+    report["metrics"] = metrics["totals"] if metrics else {}
+
+    _save_state(video_id, state)
+    get_pipeline_report_path(video_id).write_text(
+        json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8"
+    )
+    record_run(report, metrics)
+    return report
+
+
+def rebase_state(video_id: str) -> List[str]:
+    """
+    成果物の意味を変えずに書き換えたとき（layout_migration でフレームのパスを書き換えた場合など）に、
+    最新だったステージの記録を今の成果物に付け替える。次回の実行でそれらのステージは再計算されない。
+    もともと上流が変わっていたステージには触らない（成果物を手で編集していた場合は、その内容で最新とみなす）。
+    戻り値: 記録を付け替えたステージ名
+    """
+    state = _load_state(video_id)
+    digests = state["file_digests"]
+    video = {"video": _file_digest(get_raw_video_path(video_id), digests)}
+    old_upstream: Dict[str, Dict[str, Optional[str]]] = {VIDEO: video}
+    new_upstream: Dict[str, Dict[str, Optional[str]]] = {VIDEO: video}
+
+    rebased = []
+    for stage in STAGES:
+        prev = state["stages"].get(stage.name)
+        if prev is None:
+            continue
+        up_to_date = prev["parts"].get("upstream") == _sha256_text(
+            _canonical({d: old_upstream.get(d) for d in stage.deps})
+        )
+        old_upstream[stage.name] = prev["outputs"]
+        if not up_to_date:
+            new_upstream[stage.name] = prev["outputs"]
+            continue
+
+        outputs = {str(p): _file_digest(p, digests) for p in stage.outputs(video_id)}
+        upstream = _sha256_text(_canonical({d: new_upstream.get(d) for d in stage.deps}))
+        if outputs != prev["outputs"] or upstream != prev["parts"]["upstream"]:
+            prev["parts"]["upstream"] = upstream
+            prev["fingerprint"] = _fingerprint(prev["parts"])
+            prev["outputs"] = outputs
+            rebased.append(stage.name)
+        new_upstream[stage.name] = outputs
+
+    _save_state(video_id, state)
+    return rebased
+
+
+def stage_outputs(video_id: str) -> Dict[str, Dict[str, Optional[str]]]:
+    """
+    今ある成果物のハッシュ（ステージ名 -> {パス: sha256}。元動画は VIDEO -> {"video": sha256}）。
+    pipeline_state.json のハッシュキャッシュを使うので、変わっていないファイルは読み直さない。
+    """
+    state = _load_state(video_id)
+    digests = state["file_digests"]
+    result: Dict[str, Dict[str, Optional[str]]] = {
+        VIDEO: {"video": _file_digest(get_raw_video_path(video_id), digests)},
+    }
+    for stage in STAGES:
+        result[stage.name] = {str(p): _file_digest(p, digests) for p in stage.outputs(video_id)}
+    _save_state(video_id, state)
+    return result
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    lines = [
+        f"{report['video_id']}: {report['hits']} hit / {report['misses']} miss "
+        f"({report['elapsed_sec']:.1f}s)"
+    ]
+    for e in report["stages"]:
+        reason = f" ({e['reason']})" if e["reason"] else ""
+        lines.append(f"  {e['stage']:<10} {e['status']:<4} {e['elapsed_sec']:>8.2f}s{reason}")
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="入力が変わったステージだけを再実行するパイプライン（raw_videos/{video_id}.mp4 が必要）"
+    )
+    parser.add_argument("video_id")
+    parser.add_argument(
+        "--targets", nargs="*", default=None, choices=STAGE_NAMES,
+        help="実行したいステージ（上流も必要に応じて実行される）。省略時は全ステージ",
+    )
+    parser.add_argument("--force", action="store_true", help="指紋を無視して全ステージを再実行する")
+    parser.add_argument("--captioning-mode", choices=["all", "candidates"], default=None)
+    parser.add_argument(
+        "--profile", action="store_true", default=None,
+        help="実行したステージのプロファイル・ピークメモリを runs/{video_id}/profile/ に書く",
+    )
+    args = parser.parse_args()
+
+    report = run_pipeline(
+        args.video_id,
+        targets=args.targets,
+        force=args.force,
+        captioning_mode=args.captioning_mode,
+        profile=args.profile,
+    )
+    print(format_report(report))
+    if args.profile or SETTINGS.profiling_enabled:
+        print(f"Profile: {get_profile_dir(args.video_id)}")
+
+
+if __name__ == "__main__":
+    main()
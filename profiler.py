@@ -0,0 +1,235 @@
+"""
+遅い実行の原因調査用のプロファイラ（instrumentation の span(kind="stage") から使う）。
+
+settings.yaml の profiling.enabled か、pipeline.py / batch_runner.py の --profile で有効になる。
+有効なときはステージごとに次を行い、runs/{video_id}/profile/ に書き出す。
+
+- mode="sampling": 別スレッドから全スレッドのスタックを interval_ms ごとに取得する
+  （並列キャプションのワーカースレッドや、ネットワーク待ちで止まっている箇所も見える）
+  → {stage}.folded（collapsed stack 形式。flamegraph.pl / speedscope / inferno でそのまま描ける）
+- mode="cprofile": cProfile で関数呼び出しを決定的に記録する（ステージを実行しているスレッドのみ）
+  → {stage}.pstats（snakeviz / gprof2dot などで開ける）
+- memory=True: tracemalloc でステージ中のピークメモリ（Python のヒープ。ステージ開始時からの増分）を測る
+- 全ステージの上位 top_n 関数を hotspots.txt に表でまとめる
+
+プロファイル中は処理が遅くなる（特に cprofile と memory）ので、普段は無効にしておく。
+"""
+
+from __future__ import annotations
+
+import cProfile
+import io
+import pstats
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import importlib
+import config_loader
+import paths
+
+importlib.reload(config_loader)
+importlib.reload(paths)
+
+from config_loader import SETTINGS
+from paths import get_profile_dir
+
+
+PROFILE_MODES = ("sampling", "cprofile")
+
+
+class _Sampler(threading.Thread):
+    """
+    interval ごとに sys._current_frames() で全スレッドのスタックを取り、collapsed stack ごとに数える。
+    ステージ開始前からあるスレッド（Streamlit やジョブキューの heartbeat など）と、
+    threading のロック / Event 待ちで止まっているだけのサンプル（アイドル）は数えない。
+    """
+
+    def __init__(self, interval_sec: float) -> None:
+        super().__init__(name="profiler-sampler", daemon=True)
+        self.interval_sec = interval_sec
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+        self._stage_thread = threading.get_ident()
+        self._ignored = {t.ident for t in threading.enumerate()} - {self._stage_thread}
+        self._labels: Dict[Any, str] = {}
+
+    def _label(self, code: Any) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+            self._labels[code] = label
+        return label
+
+    @staticmethod
+    def _is_idle(code: Any) -> bool:
+        name = Path(code.co_filename).name
+        return name == "threading.py" or (name == "thread.py" and code.co_name == "_worker")
+
+    def run(self) -> None:
+        me = threading.get_ident()
+        while not self._stop_event.wait(self.interval_sec):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            self.samples += 1
+            for tid, frame in sys._current_frames().items():
+                if tid == me or tid in self._ignored or self._is_idle(frame.f_code):
+                    continue
+                stack: List[str] = []
+                while frame is not None:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                stack.append("stage" if tid == self._stage_thread else names.get(tid, "thread"))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+
+class _StageProfile:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.sampler: Optional[_Sampler] = None
+        self.cprofile: Optional[cProfile.Profile] = None
+        self.mem_start = 0
+
+
+class RunProfiler:
+    """1回の実行（instrumentation.RunMetrics）に付くプロファイラ。ステージごとに start_stage / stop_stage する。"""
+
+    def __init__(
+        self,
+        video_id: str,
+        mode: Optional[str] = None,
+        interval_ms: Optional[float] = None,
+        top_n: Optional[int] = None,
+        memory: Optional[bool] = None,
+    ) -> None:
+        self.video_id = video_id
+        self.mode = mode or SETTINGS.profiling_mode
+        if self.mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profiling mode: {self.mode} (choose from {PROFILE_MODES})")
+        self.interval_sec = (interval_ms or SETTINGS.profiling_interval_ms) / 1000.0
+        self.top_n = top_n or SETTINGS.profiling_top_n
+        self.memory = SETTINGS.profiling_memory if memory is None else memory
+        self.hotspots: Dict[str, List[Dict[str, Any]]] = {}
+        self._started_tracemalloc = False
+
+        # 前回の結果が残っているとキャッシュヒットしたステージと混ざるので消しておく
+        self.dir = get_profile_dir(video_id)
+        for old in [*self.dir.glob("*.folded"), *self.dir.glob("*.pstats"), *self.dir.glob("hotspots.txt")]:
+            old.unlink()
+
+    def start_stage(self, name: str) -> _StageProfile:
+        prof = _StageProfile(name)
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracemalloc = True
+            tracemalloc.reset_peak()
+            prof.mem_start = tracemalloc.get_traced_memory()[0]
+        if self.mode == "sampling":
+            prof.sampler = _Sampler(self.interval_sec)
+            prof.sampler.start()
+        else:
+            prof.cprofile = cProfile.Profile()
+            prof.cprofile.enable()
+        return prof
+
+    def stop_stage(self, prof: _StageProfile) -> Dict[str, Any]:
+        """プロファイルを止めてファイルに書き、span に残す要約を返す。"""
+        summary: Dict[str, Any] = {"mode": self.mode}
+        if prof.cprofile is not None:
+            prof.cprofile.disable()
+        if prof.sampler is not None:
+            prof.sampler.stop()
+        if self.memory and tracemalloc.is_tracing():
+            summary["peak_mem_bytes"] = max(tracemalloc.get_traced_memory()[1] - prof.mem_start, 0)
+
+        if prof.sampler is not None:
+            path = self.dir / f"{prof.name}.folded"
+            path.write_text(
+                "".join(f"{stack} {n}\n" for stack, n in prof.sampler.stacks.most_common()),
+                encoding="utf-8",
+            )
+            summary["samples"] = prof.sampler.samples
+            summary["output"] = path.name
+            self.hotspots[prof.name] = _sampling_hotspots(prof.sampler.stacks, self.top_n)
+        elif prof.cprofile is not None:
+            path = self.dir / f"{prof.name}.pstats"
+            stats = pstats.Stats(prof.cprofile, stream=io.StringIO())
+            stats.dump_stats(str(path))
+            summary["output"] = path.name
+            self.hotspots[prof.name] = _cprofile_hotspots(stats, self.top_n)
+        return summary
+
+    def finish(self) -> None:
+        """ホットスポット表を書き、自分で始めた tracemalloc を止める。"""
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        if self.hotspots:
+            (self.dir / "hotspots.txt").write_text(format_hotspots(self.hotspots, self.mode), encoding="utf-8")
+
+
+def _sampling_hotspots(stacks: Counter, top_n: int) -> List[Dict[str, Any]]:
+    """collapsed stack から関数ごとの self（末端）/ total（スタックに含まれる）サンプル数を数える。"""
+    total_samples = sum(stacks.values()) or 1
+    self_counts: Counter = Counter()
+    total_counts: Counter = Counter()
+    for stack, n in stacks.items():
+        frames = stack.split(";")[1:]  # 先頭はスレッド名
+        if not frames:
+            continue
+        self_counts[frames[-1]] += n
+        for f in set(frames):
+            total_counts[f] += n
+    return [
+        {
+            "function": func,
+            "self_pct": round(100.0 * n / total_samples, 2),
+            "total_pct": round(100.0 * total_counts[func] / total_samples, 2),
+            "samples": n,
+        }
+        for func, n in self_counts.most_common(top_n)
+    ]
+
+
+def _cprofile_hotspots(stats: pstats.Stats, top_n: int) -> List[Dict[str, Any]]:
+    rows: List[Tuple[float, Dict[str, Any]]] = []
+    for (filename, line, func), (_cc, nc, tt, ct, _callers) in stats.stats.items():  # type: ignore[attr-defined]
+        rows.append(
+            (
+                tt,
+                {
+                    "function": f"{func} ({Path(filename).name}:{line})",
+                    "tottime_sec": round(tt, 6),
+                    "cumtime_sec": round(ct, 6),
+                    "calls": nc,
+                },
+            )
+        )
+    rows.sort(key=lambda r: r[0], reverse=True)
+    return [r for _, r in rows[:top_n]]
+
+
+def format_hotspots(hotspots: Dict[str, List[Dict[str, Any]]], mode: str) -> str:
+    lines: List[str] = []
+    for stage, rows in hotspots.items():
+        lines.append(f"== {stage} ({mode}) ==")
+        if mode == "sampling":
+            lines.append(f"{'self%':>7} {'total%':>7} {'samples':>8}  function")
+            for r in rows:
+                lines.append(f"{r['self_pct']:>7.2f} {r['total_pct']:>7.2f} {r['samples']:>8}  {r['function']}")
+        else:
+            lines.append(f"{'tottime':>10} {'cumtime':>10} {'calls':>8}  function")
+            for r in rows:
+                lines.append(
+                    f"{r['tottime_sec']:>10.4f} {r['cumtime_sec']:>10.4f} {r['calls']:>8}  {r['function']}"
+                )
+        lines.append("")
+    return "\n".join(lines)
@@ -0,0 +1,274 @@
+"""
+版付きのプロンプトテンプレートの登録簿と、トークン数の概算。
+
+- PromptTemplate: 1つの版のプロンプト。system（全フレーム共通の指示）と user（画像の後に付ける短い依頼）に分ける
+  - 呼び出し側は system → 画像 → user の順にメッセージを組む。先頭の system が毎回まったく同じ文字列になるので、
+    プレフィックスキャッシュのあるバックエンド（OpenAI 互換サーバーの prompt caching など）は2枚目以降の指示部分を再利用できる
+- get_prompt(role, version): 登録済みの版を返す（version 省略時は settings.yaml の captioning.prompt_version）
+- count_tokens: トークン数の概算（日本語は1文字≒1トークン、それ以外は4文字≒1トークン）
+- usage_report: 解析結果（analysis JSONL の extra.llm_usage）から、版ごとの1フレームあたりのトークン数・応答時間を集計する
+
+版を変えると analysis ステージの指紋（プロンプト本文）が変わるので、次の実行で解析し直される。
+版の中身を書き換えるときは版名も上げること（過去の実行結果の集計が混ざらないように）。
+
+実行例:
+    python prompt_registry.py list
+    python prompt_registry.py report --all
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import math
+import re
+import sys
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import importlib
+import config_loader
+import paths
+import jsonl_io
+import catalog
+
+importlib.reload(config_loader)
+importlib.reload(paths)
+importlib.reload(jsonl_io)
+importlib.reload(catalog)
+
+from config_loader import SETTINGS
+from paths import get_analysis_path
+from jsonl_io import read_jsonl_as_dicts
+from catalog import list_videos
+
+
+_CJK = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff\uff66-\uff9f]")
+
+
+def count_tokens(text: str) -> int:
+    """
+    トークン数の概算。日本語（かな・漢字）は1文字≒1トークン、それ以外は4文字≒1トークン。
+    """
+    cjk = len(_CJK.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    """1つの版のプロンプト。"""
+    role: str          # models.yaml の役割名（vision_caption など）
+    version: str       # "full-v1" のような版名
+    system: str        # 全フレーム共通の指示（キャッシュされる先頭部分）
+    user: str          # 画像の後に付ける短い依頼（空なら付けない）
+    description: str = ""
+
+    @property
+    def text(self) -> str:
+        """指紋・トークン概算用の全文（system と user をつないだもの。user が無ければ system そのまま）。"""
+        return f"{self.system}\n\n{self.user}" if self.user else self.system
+
+    @property
+    def tokens(self) -> int:
+        """テキスト部分のトークン数の概算（画像のぶんは含まない）。"""
+        return count_tokens(self.system) + count_tokens(self.user)
+
+    @property
+    def digest(self) -> str:
+        return hashlib.sha256(self.text.encode("utf-8")).hexdigest()[:12]
+
+
+_REGISTRY: Dict[str, Dict[str, PromptTemplate]] = {}
+
+
+def register(template: PromptTemplate) -> PromptTemplate:
+    _REGISTRY.setdefault(template.role, {})[template.version] = template
+    return template
+
+
+def list_prompts(role: Optional[str] = None) -> List[PromptTemplate]:
+    roles = [role] if role else sorted(_REGISTRY)
+    return [t for r in roles for t in _REGISTRY.get(r, {}).values()]
+
+
+def get_prompt(role: str, version: Optional[str] = None) -> PromptTemplate:
+    """登録済みのプロンプト。version 省略時は settings.yaml の captioning.prompt_version。"""
+    version = version or SETTINGS.captioning_prompt_version
+    versions = _REGISTRY.get(role, {})
+    if version not in versions:
+        raise ValueError(
+            f"Unknown prompt version for {role}: {version} (available: {', '.join(versions) or 'none'})"
+        )
+    return versions[version]
+
+
+# ---------------------------------------------------------------------------
+# Vision（フレーム1枚の解析）
+# ---------------------------------------------------------------------------
+
+VISION_USER_TEXT = "この写真を解析し、JSONオブジェクトのみを出力してください。"
+
+# 以前の vision_caption_prompt.py と1文字も違わない本文（既存の解析結果の指紋と一致させるため、書き換えない）
+register(PromptTemplate(
+    role="vision_caption",
+    version="full-v1",
+    description="system / user に分ける前の vision_caption_prompt と同じ全文（依頼文なし）",
+    system=(
+        "あなたは保育園で撮影された写真を解析する専門家です。"
+        "以下の画像を注意深く観察し、指定された形式でJSONオブジェクトのみを出力してください。\n\n"
+
+        "【出力形式】\n"
+        "以下のJSON構造を厳密に守ってください。説明文やコメントは一切含めないでください。\n\n"
+
+        "{\n"
+        '  "caption": "画像の内容を1文で簡潔に説明してください。主語と述語を明確にし、具体的な行動や状況を含めてください。",\n'
+        '  "tags": ["タグ1", "タグ2", "タグ3"],\n'
+        '  "scores": {\n'
+        '    "cuteness": 0.0-1.0,\n'
+        '    "interesting": 0.0-1.0,\n'
+        '    "representative": 0.0-1.0\n'
+        "  },\n"
+        '  "has_child": true/false,\n'
+        '  "num_children": 0以上の整数,\n'
+        '  "main_subject": "主な被写体（例: 男の子、女の子、先生、複数の子どもなど）",\n'
+        '  "bbox": [x_min, y_min, x_max, y_max]\n'
+        "}\n\n"
+
+        "【各項目の詳細説明】\n"
+        "1. caption: 画像に写っている内容を1文で説明。誰が、どこで、何をしているかを明確に。\n"
+        "   例: \"室内の保育室で、男の子がブロックで遊んでいる。\"\n"
+        "   例: \"屋外の園庭で、複数の子どもが滑り台で遊んでいる。\"\n\n"
+
+        "2. tags: 画像の特徴を表す短いタグを配列で。以下のカテゴリから関連するものを選んでください。\n"
+        "   - 場所: 室内、屋外、保育室、園庭、廊下、トイレ、給食室など\n"
+        "   - 活動: 遊び、食事、お昼寝、制作、運動、読み聞かせなど\n"
+        "   - 対象: 子ども、先生、保護者、おもちゃ、絵本など\n"
+        "   - 感情・表情: 笑顔、泣いている、集中、楽しそうなど\n"
+        "   例: [\"室内\", \"ブロック\", \"笑顔\", \"男の子\", \"遊び\"]\n\n"
+
+        "3. scores: 各スコアは0.0から1.0の間の浮動小数点数で評価してください。\n"
+        "   - cuteness: 写真の「可愛さ」や「愛らしさ」の度合い\n"
+        "   - interesting: 写真の「興味深さ」や「印象的さ」の度合い\n"
+        "   - representative: その日の活動全体を代表しているかどうか\n\n"
+
+        "4. has_child: 子どもが1人以上写っている場合はtrue、写っていない場合はfalse。\n\n"
+
+        "5. num_children: 写っている子どもの人数を推定してください。0以上の整数で。\n\n"
+
+        "6. main_subject: 主な被写体を短く表してください。\n"
+        "   例: \"男の子\", \"女の子\", \"先生\", \"保護者\", \"複数の子ども\" など\n\n"
+
+        "7. bbox: 主な子ども1人の位置をバウンディングボックスで指定してください。\n"
+        "   画像全体を幅1.0、高さ1.0としたときの正規化座標で [x_min, y_min, x_max, y_max] の形式。\n"
+        "   子どもが写っていない場合は [0.0, 0.0, 0.0, 0.0] を返してください。\n\n"
+
+        "【重要な注意事項】\n"
+        "- 出力は必ずJSONオブジェクト1つだけにしてください。\n"
+        "- JSONの前後に説明文、コメント、マークダウン記号（```jsonなど）は一切付けないでください。\n"
+        "- すべてのキー（caption, tags, scores, has_child, num_children, main_subject, bbox）を含めてください。\n"
+        "- JSONの構文エラーがないよう、ダブルクォート、カンマ、括弧を正確に使用してください。\n"
+        "- 数値は浮動小数点数または整数として正しく記述してください。\n"
+    ),
+    user="",
+))
+
+register(PromptTemplate(
+    role="vision_caption",
+    version="compact-v1",
+    description="キーと値の範囲だけを書いたトークン最小の版",
+    system=(
+        "保育園の写真を解析し、次の形のJSONオブジェクト1つだけを出力（前後の文章・```は不要）。\n"
+        '{"caption":"誰がどこで何をしているかを1文で","tags":["場所・活動・対象・表情の短い語"],'
+        '"scores":{"cuteness":0-1,"interesting":0-1,"representative":0-1},'
+        '"has_child":true/false,"num_children":整数,"main_subject":"主な被写体",'
+        '"bbox":[x_min,y_min,x_max,y_max]}\n'
+        "bbox は主な子ども1人の位置を画像全体を1とした座標で。子どもがいなければ [0,0,0,0]。"
+    ),
+    user=VISION_USER_TEXT,
+))
+
+
+# ---------------------------------------------------------------------------
+# 版ごとのコスト集計
+# ---------------------------------------------------------------------------
+
+def _percentile(values: Sequence[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def usage_report(analyses: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    """
+    解析結果（FrameAnalysis の dict）の extra.llm_usage を版ごとに集計する。
+    戻り値: 版 -> frames / prompt_tokens / completion_tokens / cached_tokens（1フレームあたりの平均）/
+            latency_mean / latency_p50 / latency_p95（秒）/ template_tokens（テキスト部分の概算）
+    実トークン数を返さないバックエンド（dummy など）のフレームは、トークンの平均から除く。
+    """
+    by_version: Dict[str, List[Dict[str, Any]]] = {}
+    for a in analyses:
+        usage = (a.get("extra") or {}).get("llm_usage")
+        if usage:
+            by_version.setdefault(usage.get("prompt_version", "-"), []).append(usage)
+
+    report: Dict[str, Dict[str, float]] = {}
+    for version, rows in sorted(by_version.items()):
+        with_tokens = [r for r in rows if r.get("prompt_tokens")]
+        latencies = [float(r["latency_sec"]) for r in rows if r.get("latency_sec") is not None]
+        entry: Dict[str, float] = {"frames": len(rows), "template_tokens": rows[-1].get("template_tokens", 0)}
+        for key in ("prompt_tokens", "completion_tokens", "cached_tokens"):
+            entry[key] = (
+                round(sum(r.get(key, 0) or 0 for r in with_tokens) / len(with_tokens), 1) if with_tokens else 0.0
+            )
+        if latencies:
+            entry["latency_mean"] = round(sum(latencies) / len(latencies), 3)
+            entry["latency_p50"] = round(_percentile(latencies, 0.5), 3)
+            entry["latency_p95"] = round(_percentile(latencies, 0.95), 3)
+        report[version] = entry
+    return report
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="プロンプトの版の一覧と、版ごとのトークン数・応答時間の集計")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_list = sub.add_parser("list", help="登録済みのプロンプトの版")
+    p_list.add_argument("--role", default=None)
+
+    p_report = sub.add_parser("report", help="解析結果から版ごとの1フレームあたりのコストを集計する")
+    p_report.add_argument("video_ids", nargs="*")
+    p_report.add_argument("--all", action="store_true", help="カタログに記録された全動画")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        for t in list_prompts(args.role):
+            mark = "*" if t.version == SETTINGS.captioning_prompt_version else " "
+            print(f"{mark} {t.role:<16} {t.version:<12} ~{t.tokens:>5} tokens  {t.digest}  {t.description}")
+        return 0
+
+    video_ids: List[str] = list(args.video_ids)
+    if args.all:
+        video_ids += [v["video_id"] for v in list_videos()]
+    if not video_ids:
+        parser.error("video_id か --all を指定してください")
+
+    def _analyses() -> Iterable[Dict[str, Any]]:
+        for vid in video_ids:
+            yield from read_jsonl_as_dicts(get_analysis_path(vid))
+
+    report = usage_report(_analyses())
+    if not report:
+        print("No frames with usage records (analyzed before prompt versions were recorded?)")
+        return 0
+    print(f"{'version':<12} {'frames':>7} {'prompt':>8} {'cached':>8} {'compl':>7} {'tmpl':>6} {'mean s':>7} {'p50 s':>7} {'p95 s':>7}")
+    for version, e in report.items():
+        print(
+            f"{version:<12} {int(e['frames']):>7} {e['prompt_tokens']:>8.1f} {e['cached_tokens']:>8.1f} "
+            f"{e['completion_tokens']:>7.1f} {int(e['template_tokens']):>6} {e.get('latency_mean', 0):>7.3f} "
+            f"{e.get('latency_p50', 0):>7.3f} {e.get('latency_p95', 0):>7.3f}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
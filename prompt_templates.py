@@ -1,6 +1,6 @@
 """
 各役割ごとのプロンプトテンプレートをまとめるモジュール。
-プロンプト調整はこのファイルだけ触れば済むようにする。
+プロンプト調整はこのファイルだけ触れば済むようにする（Vision 用だけは版付きで prompt_registry にある）。
 """
 
 from __future__ import annotations
@@ -8,79 +8,22 @@ from __future__ import annotations
 from typing import List
 
 from schemas import FrameAnalysis  # 軽い依存なので reload は不要でもOK
+from vision_caption_prompt import build_vision_caption_prompt  # noqa: F401
 
 
-def build_vision_caption_prompt() -> str:
+def build_diary_prompt(frame_analyses: List[FrameAnalysis], max_chars: int, language: str = "ja") -> str:
     """
-    画像1枚に対して caption + tags + scores を JSON で返すよう指示するプロンプト。
+    フレームの caption 群から 1日のミニ日記を書かせるプロンプト。
     Llama4向けに最適化された高品質なプロンプト。
     """
-    return (
-        "あなたは保育園で撮影された写真を解析する専門家です。"
-        "以下の画像を注意深く観察し、指定された形式でJSONオブジェクトのみを出力してください。\n\n"
-        
-        "【出力形式】\n"
-        "以下のJSON構造を厳密に守ってください。説明文やコメントは一切含めないでください。\n\n"
-        
-        "{\n"
-        '  "caption": "画像の内容を1文で簡潔に説明してください。主語と述語を明確にし、具体的な行動や状況を含めてください。",\n'
-        '  "tags": ["タグ1", "タグ2", "タグ3"],\n'
-        '  "scores": {\n'
-        '    "cuteness": 0.0-1.0,\n'
-        '    "interesting": 0.0-1.0,\n'
-        '    "representative": 0.0-1.0\n'
-        "  },\n"
-        '  "has_child": true/false,\n'
-        '  "num_children": 0以上の整数,\n'
-        '  "main_subject": "主な被写体（例: 男の子、女の子、先生、複数の子どもなど）",\n'
-        '  "bbox": [x_min, y_min, x_max, y_max]\n'
-        "}\n\n"
-        
-        "【各項目の詳細説明】\n"
-        "1. caption: 画像に写っている内容を1文で説明。誰が、どこで、何をしているかを明確に。\n"
-        "   例: \"室内の保育室で、男の子がブロックで遊んでいる。\"\n"
-        "   例: \"屋外の園庭で、複数の子どもが滑り台で遊んでいる。\"\n\n"
-        
-        "2. tags: 画像の特徴を表す短いタグを配列で。以下のカテゴリから関連するものを選んでください。\n"
-        "   - 場所: 室内、屋外、保育室、園庭、廊下、トイレ、給食室など\n"
-        "   - 活動: 遊び、食事、お昼寝、制作、運動、読み聞かせなど\n"
-        "   - 対象: 子ども、先生、保護者、おもちゃ、絵本など\n"
-        "   - 感情・表情: 笑顔、泣いている、集中、楽しそうなど\n"
-        "   例: [\"室内\", \"ブロック\", \"笑顔\", \"男の子\", \"遊び\"]\n\n"
-        
-        "3. scores: 各スコアは0.0から1.0の間の浮動小数点数で評価してください。\n"
-        "   - cuteness: 写真の「可愛さ」や「愛らしさ」の度合い（0.0=普通、1.0=非常に可愛い）\n"
-        "   - interesting: 写真の「興味深さ」や「印象的さ」の度合い（0.0=普通、1.0=非常に興味深い）\n"
-        "   - representative: その日の活動全体を代表しているかどうか（0.0=特殊な場面、1.0=典型的な場面）\n\n"
-        
-        "4. has_child: 子どもが1人以上写っている場合はtrue、写っていない場合はfalse。\n\n"
-        
-        "5. num_children: 写っている子どもの人数を推定してください。0以上の整数で。\n\n"
-        
-        "6. main_subject: 主な被写体を短く表してください。\n"
-        "   例: \"男の子\", \"女の子\", \"先生\", \"保護者\", \"複数の子ども\", \"おもちゃ\"など\n\n"
-        
-        "7. bbox: 主な子ども1人の位置をバウンディングボックスで指定してください。\n"
-        "   画像全体を幅1.0、高さ1.0としたときの正規化座標で [x_min, y_min, x_max, y_max] の形式。\n"
-        "   左上が原点(0,0)、右下が(1,1)です。\n"
-        "   子どもが写っていない場合は [0.0, 0.0, 0.0, 0.0] を返してください。\n"
-        "   例: 画像の中央付近にいる場合 [0.35, 0.40, 0.65, 0.80]\n\n"
-        
-        "【重要な注意事項】\n"
-        "- 出力は必ずJSONオブジェクト1つだけにしてください。\n"
-        "- JSONの前後に説明文、コメント、マークダウン記号（```jsonなど）は一切付けないでください。\n"
-        "- すべてのキー（caption, tags, scores, has_child, num_children, main_subject, bbox）を含めてください。\n"
-        "- JSONの構文エラーがないよう、ダブルクォート、カンマ、括弧を正確に使用してください。\n"
-        "- 数値は浮動小数点数または整数として正しく記述してください。\n"
-    )
+    lines = [f"- {fa.caption}" for fa in frame_analyses]
+    return build_diary_prompt_from_lines(lines, max_chars=max_chars, language=language)
 
 
-def build_diary_prompt(frame_analyses: List[FrameAnalysis], max_chars: int, language: str = "ja") -> str:
+def build_diary_prompt_from_lines(lines: List[str], max_chars: int, language: str = "ja") -> str:
     """
-    フレームの caption 群から 1日のミニ日記を書かせるプロンプト。
-    Llama4向けに最適化された高品質なプロンプト。
+    箇条書きの行（"- " 始まり。caption_condenser で圧縮したものなど）から日記プロンプトを組み立てる。
     """
-    lines = [f"- {fa.caption}" for fa in frame_analyses]
     joined = "\n".join(lines)
     
     if language == "ja":
@@ -129,3 +72,64 @@ def build_diary_prompt(frame_analyses: List[FrameAnalysis], max_chars: int, lang
         )
 
     return joined + "\n\n" + instr
+
+
+def build_chunk_summary_prompt(
+    lines: List[str],
+    time_range: str,
+    max_chars: int,
+    language: str = "ja",
+) -> str:
+    """
+    階層的な日記生成（map 段）用。ある時間帯の caption 群から、その時間帯の短い要約を書かせる。
+    """
+    joined = "\n".join(lines)
+
+    if language == "ja":
+        instr = (
+            "【タスク】\n"
+            f"上記の箇条書きは、保育園で撮影された映像のうち {time_range} の時間帯を要約した文です。\n"
+            f"この時間帯に起きたことを、{max_chars}文字以内の日本語で簡潔にまとめてください。\n\n"
+
+            "【書き方のガイドライン】\n"
+            "1. 時系列の順序を保ってください。\n"
+            "2. 印象的な場面や、泣いている・転んだなど気になる出来事は必ず残してください。\n"
+            "3. 後で1日分の日記にまとめるためのメモなので、事実を中心に書いてください。\n\n"
+
+            "【出力形式】\n"
+            "- 要約本文のみを出力してください。見出しやマークダウン記号は不要です。"
+        )
+    else:
+        instr = (
+            "【Task】\n"
+            f"The bullet points above describe moments at a daycare center during {time_range}.\n"
+            f"Summarize what happened in this period in {language} within {max_chars} characters.\n\n"
+
+            "【Guidelines】\n"
+            "1. Keep the chronological order.\n"
+            "2. Always keep memorable moments and notable incidents (crying, falling, etc.).\n"
+            "3. These are notes for a full-day diary, so focus on facts.\n\n"
+
+            "【Output Format】\n"
+            "- Output only the summary text, no headings or markdown."
+        )
+
+    return joined + "\n\n" + instr
+
+
+def build_diary_reduce_prompt(
+    chunk_summaries: List[str],
+    max_chars: int,
+    language: str = "ja",
+) -> str:
+    """
+    階層的な日記生成（reduce 段）用。時間帯ごとの要約（"- [時間帯] 要約" の行）から1日の日記を書かせる。
+    指示文は build_diary_prompt と共通にして、最終的な日記の書きぶりを揃える。
+    """
+    if language == "ja":
+        header = "（各行は [時間帯] ごとの様子の要約です）"
+    else:
+        header = "(Each line summarizes one [time range] of the day.)"
+    return build_diary_prompt_from_lines(
+        [header] + list(chunk_summaries), max_chars=max_chars, language=language
+    )
@@ -20,6 +20,9 @@ class FrameMeta:
     frame_path: str
     is_blurry: bool = False
     is_too_dark: bool = False
+    brightness: Optional[float] = None   # グレースケール平均輝度（0〜255）
+    sharpness: Optional[float] = None    # ラプラシアン分散（大きいほどシャープ）
+    motion: Optional[float] = None       # 直前フレームとの差分（0〜1）。先頭フレームは None
 
 
 @dataclass
@@ -51,6 +54,12 @@ class FrameAnalysis:
 
     flags: Dict[str, bool] = field(default_factory=dict)
 
+    # 前処理（frame_preprocessor）の画質指標を引き継ぐ
+    is_blurry: bool = False
+    is_too_dark: bool = False
+    brightness: Optional[float] = None
+    sharpness: Optional[float] = None
+
     extra: Dict[str, Any] = field(default_factory=dict)
 
 
@@ -65,6 +74,10 @@ class BestShotMeta:
     score: float
     frame_path: str
     caption: str
+    # スコアの内訳（特徴量名 -> 重み付き寄与）。合計が score になる
+    score_breakdown: Dict[str, float] = field(default_factory=dict)
+    # UI 表示用サムネイル（長辺 px の文字列 -> パス）
+    thumbnails: Dict[str, str] = field(default_factory=dict)
 
 
 @dataclass
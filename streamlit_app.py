@@ -3,37 +3,43 @@
 
 - 動画ファイルをアップロード
 - video_id を自動 or 手動で決定
-- バックエンドのパイプラインを一気に実行
+- バックエンドのパイプラインをバックグラウンドのジョブとして実行（job_queue。入力が変わっていないステージはスキップ）
   - 動画 → フレーム抽出 → 前処理 → マニフェスト
-  - Vision 解析（Gemini / ダミー） → ベストショット選定 → 日記生成
+  - Vision 解析（Gemini / ダミー） → ベストショット選定 → 日記生成 / アラート検出
 - 結果としてベストショット画像と日記テキストを表示
 - さらに各ステップの成果物を「デバッグビュー」としてクリック展開で確認可能
+- 実行中のジョブは URL（?job=...）に紐づくので、画面をリロードしても進捗・結果の表示に戻れる
 
 ※ バックエンド部分は Colab 上で既に作成済みの各 *.py を利用する。
 """
 
 from __future__ import annotations
 
+import datetime
 import importlib
+import itertools
 import json
 import os
+import time
+import uuid
 from pathlib import Path
 from typing import Optional
 
 import streamlit as st
-from PIL import Image
 
 import config_loader
 import paths
 import video_loader
-import frame_extractor
-import frame_preprocessor
-import manifest_builder
-import vision_captioner
+import video_ingest
 import bestshot_scorer
-import diary_generator
+import pipeline
+import job_queue
 import inspection
 import jsonl_io
+import frame_store
+import catalog
+import caption_search
+import frame_embeddings
 
 # # Colab / Streamlit の secrets から GEMINI_API_KEY を拾って env に入れる（あれば）
 # if "GEMINI_API_KEY" in st.secrets:
@@ -43,85 +49,416 @@ import jsonl_io
 importlib.reload(config_loader)
 importlib.reload(paths)
 importlib.reload(video_loader)
-importlib.reload(frame_extractor)
-importlib.reload(frame_preprocessor)
-importlib.reload(manifest_builder)
-importlib.reload(vision_captioner)
+importlib.reload(video_ingest)
 importlib.reload(bestshot_scorer)
-importlib.reload(diary_generator)
+importlib.reload(pipeline)
+importlib.reload(job_queue)
 importlib.reload(inspection)
 importlib.reload(jsonl_io)
+importlib.reload(frame_store)
+importlib.reload(catalog)
+importlib.reload(caption_search)
+importlib.reload(frame_embeddings)
 
 from config_loader import SETTINGS
 from video_loader import save_video, generate_video_id
-from frame_extractor import extract_frames
-from frame_preprocessor import preprocess_frames
-from manifest_builder import build_manifest
-from vision_captioner import run_captioning
-from bestshot_scorer import select_bestshots
-from diary_generator import generate_diary
+from video_ingest import estimate_eta, load_video_meta, probe_video
+from bestshot_scorer import pick_thumbnail
+from pipeline import STAGE_NAMES
+from job_queue import (
+    DONE,
+    FAILED,
+    QUEUED,
+    RUNNING,
+    ensure_workers,
+    get_job,
+    list_jobs,
+    queue_position,
+    submit_job,
+)
 from inspection import show_sample_frames
 from paths import (
+    get_alerts_path,
     get_bestshot_meta_path,
+    get_diary_partial_path,
     get_diary_path,
     get_manifest_path,
     get_analysis_path,
-    get_frames_dir,
     get_raw_video_dir,
+    get_raw_video_path,
+    get_metrics_path,
 )
 from jsonl_io import read_jsonl_as_dicts
+from frame_store import list_frames, read_frame_bytes
+from catalog import get_run_stages, get_video, latest_analysis, list_runs
+from catalog import list_frames as list_catalog_frames
+from caption_search import format_time, frame_thumbnail, search_captions
+from frame_embeddings import similar_frames
+
+
+# パイプラインのステージ名 -> 画面に出す名前
+STAGE_TITLES = {
+    "ingest": "動画情報・プロキシ",
+    "audio": "音声解析",
+    "frames": "フレーム抽出・前処理・マニフェスト",
+    "analysis": "画像解析",
+    "bestshots": "ベストショット選定",
+    "diary": "日記生成",
+    "alerts": "アラート検出",
+}
+
+STATUS_LABELS = {
+    "queued": "待機中",
+    "running": "実行中",
+    "done": "完了",
+    "failed": "失敗",
+}
+
+
+def _owner_id() -> str:
+    """
+    ジョブの持ち主（公平なスケジューリングの単位）。URL に持たせてリロード後も同じにする。
+    """
+    owner = st.query_params.get("owner")
+    if not owner:
+        owner = uuid.uuid4().hex[:12]
+        st.query_params["owner"] = owner
+    return owner
 
 
-def run_full_pipeline(video_file, custom_video_id: Optional[str] = None) -> str:
+def _resolve_video_id(video_file, custom_video_id: Optional[str]) -> str:
     """
-    アップロード動画を受け取り、パイプラインを最後まで実行するヘルパ関数。
-    戻り値: 実際に使用した video_id
+    同じアップロード（ファイル名 + サイズ）には同じ video_id を使い回す。
+    こうしておくと、設定だけ変えて再実行したときに変わっていないステージがスキップされる。
     """
-    # video_id を決定
     if custom_video_id and custom_video_id.strip():
-        video_id = custom_video_id.strip()
-    else:
-        video_id = generate_video_id(prefix="ui")
-
-    suffix = Path(video_file.name).suffix or ".mp4"
-
-    # 1. 動画保存
-    st.write("### 1. 動画を保存しています …")
-    video_id = save_video(video_file, video_id=video_id, suffix=suffix)
-    st.write(f"- video_id: `{video_id}`")
-
-    # 2. フレーム抽出
-    st.write("### 2. フレームを抽出しています …")
-    with st.spinner("フレーム抽出中…"):
-        frames_meta = extract_frames(video_id)
-    st.write(f"- 抽出フレーム枚数: {len(frames_meta)}")
-
-    # 3. フレーム前処理
-    st.write("### 3. フレームを前処理しています …")
-    with st.spinner("前処理中…"):
-        frames_meta = preprocess_frames(frames_meta)
-
-    # 4. マニフェスト作成
-    st.write("### 4. マニフェストを作成しています …")
-    build_manifest(video_id, frames_meta)
-
-    # 5. 画像解析（Gemini または ダミー）
-    st.write("### 5. 画像解析を実行しています …")
-    with st.spinner("画像解析中…"):
-        _ = run_captioning(video_id)
-
-    # 6. ベストショット選定
-    st.write("### 6. ベストショットを選定しています …")
-    with st.spinner("ベストショット選定中…"):
-        _ = select_bestshots(video_id)
-
-    # 7. 日記生成
-    st.write("### 7. 日記テキストを生成しています …")
-    with st.spinner("日記生成中…"):
-        _ = generate_diary(video_id)
+        return custom_video_id.strip()
+    uploads = st.session_state.setdefault("upload_video_ids", {})
+    key = f"{video_file.name}:{video_file.size}"
+    if key not in uploads:
+        uploads[key] = generate_video_id(prefix="ui")
+    return uploads[key]
+
+
+def submit_pipeline_job(
+    video_file,
+    owner: str,
+    custom_video_id: Optional[str] = None,
+    captioning_mode: Optional[str] = None,
+) -> int:
+    """
+    アップロード動画を保存し、パイプラインのジョブを登録する（実行はバックグラウンドのワーカー）。
+    戻り値: job_id
+    """
+    video_id = _resolve_video_id(video_file, custom_video_id)
+
+    # チャンクごとに書き出しながらハッシュを取る。同じ中身が保存済みならその video_id を使う
+    # （video_id を指定された場合はその名前で保存する）
+    dedupe = not (custom_video_id and custom_video_id.strip())
+    video_id = save_video(video_file, video_id=video_id, dedupe=dedupe)
+
+    # 取り込みステージが終わる前から残り時間の目安を出せるよう、動画の長さ・解像度をここで調べて一緒に登録する
+    try:
+        video_info = probe_video(get_raw_video_path(video_id))
+    except (RuntimeError, OSError, ValueError) as e:
+        print(f"[WARN] Failed to probe {video_id}: {e}")
+        video_info = None
+    job_id = submit_job(video_id, owner, {"captioning_mode": captioning_mode}, video_info=video_info)
+    ensure_workers()
+    return job_id
+
+
+def show_job_status(job: dict) -> None:
+    """ジョブの状態とステージごとの進捗を表示する。"""
+    status = job["status"]
+    st.markdown(
+        f"## ジョブ #{job['id']}（video_id: `{job['video_id']}`）: {STATUS_LABELS.get(status, status)}"
+    )
 
-    st.success("パイプラインが完了しました。")
-    return video_id
+    if status == QUEUED:
+        pos = queue_position(job["id"])
+        st.info(f"順番待ちです（前に {pos} 件）。" if pos else "まもなく開始します。")
+
+    done_stages = {e["stage"]: e for e in job["progress"]}
+    st.progress(min(len(done_stages) / len(STAGE_NAMES), 1.0))
+    rows = []
+    for name in STAGE_NAMES:
+        entry = done_stages.get(name)
+        if entry is not None:
+            state = "スキップ（変更なし）" if entry["status"] == "hit" else f"完了 {entry['elapsed_sec']:.1f} 秒"
+        elif job["current_stage"] == name:
+            state = "実行中 …"
+        else:
+            state = "-"
+        rows.append({"ステージ": STAGE_TITLES.get(name, name), "状態": state})
+    st.table(rows)
+
+    if status in (QUEUED, RUNNING):
+        remaining = [name for name in STAGE_NAMES if name not in done_stages]
+        eta = estimate_eta(job["video_id"], remaining, video_info=job["video_info"])
+        if eta is not None:
+            st.caption(f"残り時間の目安: 約 {max(eta / 60, 0.1):.1f} 分（動画の長さ・解像度と過去の実行時間から推定）")
+
+    if status == RUNNING and job["current_stage"] == "diary":
+        # ワーカーが書き出す生成途中の日記を、ポーリングのたびに読み直して表示する
+        try:
+            partial_text = get_diary_partial_path(job["video_id"]).read_text(encoding="utf-8")
+        except FileNotFoundError:  # まだ書き出されていない / 書き終えて消えた
+            partial_text = ""
+        if partial_text:
+            st.markdown("### 日記（生成中）")
+            st.markdown(partial_text + " ▌")
+
+    if status == FAILED:
+        st.error(f"エラーが発生しました: {job['error']}")
+
+
+def show_metrics(metrics: dict) -> None:
+    """runs/{video_id}/metrics.json の要約をステージごとの表にする。"""
+    totals = metrics.get("totals", {})
+    cols = st.columns(4)
+    cols[0].metric("合計時間", f"{metrics['wall_sec']:.1f} 秒")
+    cols[1].metric("API 呼び出し", f"{int(totals.get('api_calls', 0))}")
+    cols[2].metric("読み込み / 書き込み", (
+        f"{totals.get('bytes_read', 0) / 1e6:.1f} / {totals.get('bytes_written', 0) / 1e6:.1f} MB"
+    ))
+    cols[3].metric("トークン（入力 / 出力）", (
+        f"{int(totals.get('prompt_tokens', 0))} / {int(totals.get('completion_tokens', 0))}"
+    ))
+
+    rows = []
+    for stage in STAGE_NAMES:
+        s = metrics.get("stages", {}).get(stage)
+        if s is None:
+            continue
+        c = s.get("counters", {})
+        llm = s.get("llm", {})
+        rows.append(
+            {
+                "ステージ": STAGE_TITLES.get(stage, stage),
+                "キャッシュ": s.get("cache", "-"),
+                "時間 (秒)": round(s.get("wall_sec", 0.0), 2),
+                "フレーム数": int(c.get("frames_processed", 0)),
+                "読み込み (MB)": round(c.get("bytes_read", 0) / 1e6, 2),
+                "書き込み (MB)": round(c.get("bytes_written", 0) / 1e6, 2),
+                "API 呼び出し": int(c.get("api_calls", 0)),
+                "API エラー": int(c.get("api_errors", 0)),
+                "API 時間 (秒)": round(llm.get("wall_sec", 0.0), 2),
+                "API 枠待ち (秒)": round(llm.get("wait_sec", 0.0), 2),
+                "トークン": int(c.get("prompt_tokens", 0) + c.get("completion_tokens", 0)),
+            }
+        )
+        if "profile" in s:
+            rows[-1]["ピークメモリ (MB)"] = round(s["profile"].get("peak_mem_bytes", 0) / 1e6, 1)
+    st.table(rows)
+
+
+def show_similar(video_id: str) -> None:
+    """「似ている写真を探す」で選んだベストショットに見た目が似ているフレームを、全動画から探して並べる。"""
+    target = st.session_state.get("similar_to")
+    if not target or target[0] != video_id:
+        return
+    st.markdown(f"#### 似ている写真（フレーム {target[1]} と見た目が近い順）")
+    hits = similar_frames(target[0], target[1], k=12)
+    if not hits:
+        st.write("特徴ベクトルが見つかりませんでした（python frame_embeddings.py build で作れます）。")
+        return
+    cols = st.columns(4)
+    for i, h in enumerate(hits):
+        with cols[i % len(cols)]:
+            thumb = _search_thumbnail(h["frame_path"])
+            if thumb is not None:
+                st.image(thumb)
+            st.caption(f"`{h['video_id']}` {format_time(h['time_sec'])}（類似度 {h['similarity']:.2f}）")
+
+
+def show_results(video_id: str) -> None:
+    """完了したジョブの成果物（ベストショット・日記・中間生成物）を表示する。"""
+    st.markdown("---")
+    st.markdown(f"## 2. 結果（video_id: `{video_id}`）")
+
+    # ベストショット表示
+    st.subheader("ベストショット")
+    meta_path = get_bestshot_meta_path(video_id)
+    metas = []
+    if meta_path.exists():
+        metas = json.loads(meta_path.read_text(encoding="utf-8"))
+        cols = st.columns(3)
+        for i, m in enumerate(metas):
+            col = cols[i % len(cols)]
+            with col:
+                # 3列表示なので 1列あたり ~400px（高DPIでも 640 あれば足りる）
+                st.image(pick_thumbnail(m, 400), caption=f"#{m['rank']} - {m['caption']}")
+                if st.button("似ている写真を探す", key=f"similar_{video_id}_{m['frame_index']}"):
+                    st.session_state["similar_to"] = (video_id, m["frame_index"])
+        show_similar(video_id)
+    else:
+        st.write("ベストショット情報が見つかりませんでした。")
+
+    # 日記表示
+    st.subheader("今日のミニ日記")
+    diary_path = get_diary_path(video_id)
+    if diary_path.exists():
+        diary_text = diary_path.read_text(encoding="utf-8")
+        st.text_area("日記", diary_text, height=300)
+    else:
+        st.write("日記ファイルが見つかりませんでした。")
+
+    # アラート（画像のキーワードと音声の大きな音・泣き声）
+    st.subheader("アラート")
+    alerts = read_jsonl_as_dicts(get_alerts_path(video_id)) if get_alerts_path(video_id).exists() else []
+    if alerts:
+        st.table(
+            [
+                {
+                    "時間": f"{format_time(a['start_time_sec'])} - {format_time(a['end_time_sec'])}",
+                    "レベル": a["level"],
+                    "種類": "音声" if a.get("extra", {}).get("source") == "audio" else "画像",
+                    "内容": a["reason"],
+                }
+                for a in alerts
+            ]
+        )
+    else:
+        st.write("アラートはありませんでした。")
+
+    # --- ここからデバッグビュー ---
+    st.markdown("---")
+    st.markdown("## 3. デバッグビュー（中間生成物を確認）")
+
+    # 3-1. 保存された動画ファイル
+    with st.expander("① 保存された動画ファイルを確認する"):
+        video = get_video(video_id)
+        video_path = get_raw_video_dir() / (video["file"] if video else f"{video_id}.mp4")
+        if video_path.exists():
+            st.write(f"パス: `{video_path}`")
+            st.video(str(video_path))
+            video_meta = load_video_meta(video_id)
+            if video_meta is not None:
+                st.json(video_meta)
+        else:
+            st.write("対応する動画ファイルが見つかりませんでした。")
+
+    # 3-2. 抽出フレーム
+    with st.expander("② 抽出されたフレームを確認する"):
+        # カタログ（マニフェストの内容）から引く。カタログに無い古い成果物はファイルを探す
+        frame_files = [f["frame_path"] for f in list_catalog_frames(video_id)] or list_frames(video_id)
+        st.write(f"フレーム枚数: {len(frame_files)}")
+        if frame_files:
+            # 最初の数枚だけ表示
+            max_show = min(12, len(frame_files))
+            cols = st.columns(4)
+            for i, p in enumerate(frame_files[:max_show]):
+                # パック（frame_store）にしか無いフレームもあるのでバイト列で渡す
+                col = cols[i % len(cols)]
+                with col:
+                    st.image(read_frame_bytes(p), caption=os.path.basename(p))
+        else:
+            st.write("フレーム画像が見つかりませんでした。")
+
+    # 3-3. マニフェスト JSONL
+    with st.expander("③ マニフェスト（frames_manifest.jsonl）の中身を見る"):
+        manifest_path = get_manifest_path(video_id)
+        records = list_catalog_frames(video_id)
+        if not records and manifest_path.exists():
+            records = read_jsonl_as_dicts(manifest_path)
+        if records:
+            st.write(f"レコード数: {len(records)}")
+            if records:
+                st.json(records[:5])  # 先頭5件だけ
+        else:
+            st.write("マニフェストファイルが見つかりませんでした。")
+
+    # 3-4. 画像解析結果 JSONL
+    with st.expander("④ 画像解析結果（analysis.jsonl）の中身を見る"):
+        analysis = latest_analysis(video_id)
+        analysis_path = Path(analysis["path"]) if analysis else get_analysis_path(video_id)
+        if analysis_path.exists():
+            with analysis_path.open(encoding="utf-8") as f:
+                records = [json.loads(line) for line in itertools.islice(f, 5) if line.strip()]
+            if analysis and analysis["records"] is not None:
+                st.write(f"レコード数: {analysis['records']}")
+            if records:
+                st.json(records)  # 先頭5件だけ
+        else:
+            st.write("解析結果ファイルが見つかりませんでした。")
+
+    # 3-5. ベストショットメタ情報
+    with st.expander("⑤ ベストショットのメタ情報を見る"):
+        if metas:
+            st.json(metas)
+        else:
+            st.write("ベストショットメタ情報が存在しません。")
+
+    # 3-6. 元フレームのランダムサンプル（既存の inspection 利用）
+    with st.expander("⑥ 元フレームをランダム表示（inspection.show_sample_frames）"):
+        st.write("下にランダムで数枚のフレームを表示します。")
+        show_sample_frames(video_id, n=4)
+
+    # 3-7. 直近の実行メトリクス（instrumentation）
+    with st.expander("⑦ 実行メトリクス（ステージごとの時間・I/O・API 呼び出し）"):
+        metrics_path = get_metrics_path(video_id)
+        if metrics_path.exists():
+            show_metrics(json.loads(metrics_path.read_text(encoding="utf-8")))
+        else:
+            st.write("メトリクスが見つかりませんでした。")
+
+    # 3-8. この動画の過去の実行（catalog）
+    with st.expander("⑧ 過去の実行（キャッシュ hit / miss・所要時間）"):
+        runs = list_runs(video_id, limit=20)
+        if runs:
+            st.table(
+                [
+                    {
+                        "#": r["id"],
+                        "開始": r["started_at"],
+                        "hit": r["hits"],
+                        "miss": r["misses"],
+                        "時間 (秒)": round(r["elapsed_sec"] or 0.0, 2),
+                        "再計算したステージ": ", ".join(
+                            STAGE_TITLES.get(s["stage"], s["stage"])
+                            for s in get_run_stages(r["id"])
+                            if s["status"] == "miss"
+                        ),
+                    }
+                    for r in runs
+                ]
+            )
+        else:
+            st.write("実行記録が見つかりませんでした。")
+
+
+@st.cache_data(max_entries=500, show_spinner=False)
+def _search_thumbnail(frame_path: str) -> Optional[bytes]:
+    return frame_thumbnail(frame_path)
+
+
+def show_search() -> None:
+    """全動画のキャプション・タグ・被写体を横断して検索する（caption_search）。"""
+    with st.expander("🔍 過去の動画からシーンを探す（キャプション・タグ）"):
+        query = st.text_input("キーワード（空白区切りで AND）", value="", placeholder="例: 滑り台 笑顔")
+        use_dates = st.checkbox("撮影日で絞り込む", value=False)
+        since = until = None
+        if use_dates:
+            c1, c2 = st.columns(2)
+            since = c1.date_input("から", value=datetime.date.today() - datetime.timedelta(days=7))
+            until = c2.date_input("まで", value=datetime.date.today())
+        if not query.strip():
+            return
+
+        t0 = time.perf_counter()
+        hits = search_captions(query, since=since, until=until, limit=48)
+        st.caption(f"{len(hits)} 件（{(time.perf_counter() - t0) * 1000:.0f} ms）")
+        cols = st.columns(4)
+        for i, h in enumerate(hits):
+            with cols[i % len(cols)]:
+                thumb = _search_thumbnail(h["frame_path"])
+                if thumb is not None:
+                    st.image(thumb)
+                st.caption(
+                    f"{(h['recorded_at'] or '')[:10]} `{h['video_id']}` {format_time(h['time_sec'])}\n\n"
+                    f"{h['caption']}"
+                )
 
 
 def main():
@@ -131,6 +468,7 @@ def main():
         "動画をアップロードして、ベストショットとミニ日記を自動生成します。"
         "※ LLM のバックエンドは config/models.yaml の設定（Gemini / dummy / local）に従います。"
     )
+    owner = _owner_id()
 
     st.sidebar.header("設定")
     st.sidebar.write(f"データ保存先: `{SETTINGS.data_root}`")
@@ -146,6 +484,23 @@ def main():
         help="指定すると outputs 以下のフォルダ名などに利用されます。",
     )
 
+    bestshot_only = st.sidebar.checkbox(
+        "ベストショットのみ（候補フレームだけ画像解析）",
+        value=(SETTINGS.captioning_mode == "candidates"),
+        help="画質・動きなどのローカル指標で絞った候補だけを Vision LLM に送ります。日記の情報量は減ります。",
+    )
+
+    # 過去のジョブ（完了したものは結果を開ける）
+    st.sidebar.markdown("---")
+    st.sidebar.subheader("最近のジョブ")
+    for j in list_jobs(owner=owner, limit=10):
+        label = f"#{j['id']} {j['video_id']}（{STATUS_LABELS.get(j['status'], j['status'])}）"
+        if st.sidebar.button(label, key=f"job_{j['id']}"):
+            st.query_params["job"] = str(j["id"])
+            st.rerun()
+
+    show_search()
+
     st.markdown("## 1. 動画をアップロード")
 
     video_file = st.file_uploader(
@@ -155,109 +510,50 @@ def main():
 
     run_button = st.button("この動画を解析する", type="primary", disabled=(video_file is None))
 
-    if video_file is None:
+    if video_file is None and "job" not in st.query_params:
         st.info("左のボタンから動画ファイルをアップロードしてください。")
         return
 
-    if run_button:
+    if run_button and video_file is not None:
         try:
-            # パイプライン実行
-            video_id = run_full_pipeline(video_file, custom_video_id=custom_video_id)
-
-            st.markdown("---")
-            st.markdown(f"## 2. 結果（video_id: `{video_id}`）")
-
-            # ベストショット表示
-            st.subheader("ベストショット")
-            meta_path = get_bestshot_meta_path(video_id)
-            metas = []
-            if meta_path.exists():
-                metas = json.loads(meta_path.read_text(encoding="utf-8"))
-                cols = st.columns(3)
-                for i, m in enumerate(metas):
-                    col = cols[i % len(cols)]
-                    with col:
-                        st.image(m["frame_path"], caption=f"#{m['rank']} - {m['caption']}")
-            else:
-                st.write("ベストショット情報が見つかりませんでした。")
-
-            # 日記表示
-            st.subheader("今日のミニ日記")
-            diary_path = get_diary_path(video_id)
-            if diary_path.exists():
-                diary_text = diary_path.read_text(encoding="utf-8")
-                st.text_area("日記", diary_text, height=300)
-            else:
-                st.write("日記ファイルが見つかりませんでした。")
-
-            # --- ここからデバッグビュー ---
-            st.markdown("---")
-            st.markdown("## 3. デバッグビュー（中間生成物を確認）")
-
-            # 3-1. 保存された動画ファイル
-            with st.expander("① 保存された動画ファイルを確認する"):
-                raw_dir = get_raw_video_dir()
-                candidates = list(raw_dir.glob(f"{video_id}*"))
-                if candidates:
-                    video_path = candidates[0]
-                    st.write(f"パス: `{video_path}`")
-                    st.video(str(video_path))
-                else:
-                    st.write("対応する動画ファイルが見つかりませんでした。")
-
-            # 3-2. 抽出フレーム
-            with st.expander("② 抽出されたフレームを確認する"):
-                frames_dir = get_frames_dir(video_id)
-                frame_files = sorted(frames_dir.glob("*.png"))
-                st.write(f"フレーム枚数: {len(frame_files)}")
-                if frame_files:
-                    # 最初の数枚だけ表示
-                    max_show = min(12, len(frame_files))
-                    cols = st.columns(4)
-                    for i, p in enumerate(frame_files[:max_show]):
-                        img = Image.open(p)
-                        col = cols[i % len(cols)]
-                        with col:
-                            st.image(img, caption=p.name)
-                else:
-                    st.write("フレーム画像が見つかりませんでした。")
-
-            # 3-3. マニフェスト JSONL
-            with st.expander("③ マニフェスト（frames_manifest.jsonl）の中身を見る"):
-                manifest_path = get_manifest_path(video_id)
-                if manifest_path.exists():
-                    records = read_jsonl_as_dicts(manifest_path)
-                    st.write(f"レコード数: {len(records)}")
-                    if records:
-                        st.json(records[:5])  # 先頭5件だけ
-                else:
-                    st.write("マニフェストファイルが見つかりませんでした。")
-
-            # 3-4. 画像解析結果 JSONL
-            with st.expander("④ 画像解析結果（analysis.jsonl）の中身を見る"):
-                analysis_path = get_analysis_path(video_id)
-                if analysis_path.exists():
-                    records = read_jsonl_as_dicts(analysis_path)
-                    st.write(f"レコード数: {len(records)}")
-                    if records:
-                        st.json(records[:5])  # 先頭5件だけ
-                else:
-                    st.write("解析結果ファイルが見つかりませんでした。")
-
-            # 3-5. ベストショットメタ情報
-            with st.expander("⑤ ベストショットのメタ情報を見る"):
-                if metas:
-                    st.json(metas)
-                else:
-                    st.write("ベストショットメタ情報が存在しません。")
-
-            # 3-6. 元フレームのランダムサンプル（既存の inspection 利用）
-            with st.expander("⑥ 元フレームをランダム表示（inspection.show_sample_frames）"):
-                st.write("下にランダムで数枚のフレームを表示します。")
-                show_sample_frames(video_id, n=4)
+            job_id = submit_pipeline_job(
+                video_file,
+                owner,
+                custom_video_id=custom_video_id,
+                captioning_mode="candidates" if bestshot_only else "all",
+            )
+        except Exception as e:
+            st.error(f"エラーが発生しました: {e}")
+            return
+        st.query_params["job"] = str(job_id)
+        st.rerun()
+
+    if "job" not in st.query_params:
+        return
 
+    job = get_job(int(st.query_params["job"]))
+    if job is None:
+        st.warning("ジョブが見つかりませんでした。")
+        return
+
+    st.markdown("---")
+    show_job_status(job)
+
+    if job["status"] == DONE:
+        report = job["report"] or {}
+        st.success(
+            f"パイプラインが完了しました（{report.get('hits', 0)} ステージをスキップ / "
+            f"{report.get('misses', 0)} ステージを実行）。"
+        )
+        try:
+            show_results(job["video_id"])
         except Exception as e:
             st.error(f"エラーが発生しました: {e}")
+    elif job["status"] != FAILED:
+        # 実行中はワーカーが落ちていないか確認しつつ、一定間隔で再描画して進捗を更新する
+        ensure_workers()
+        time.sleep(SETTINGS.jobs_poll_interval_sec)
+        st.rerun()
 
 
 if __name__ == "__main__":
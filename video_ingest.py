@@ -0,0 +1,344 @@
+"""
+取り込んだ動画の情報（長さ・fps・フレーム数・解像度・コーデック）を一度だけ調べて保存し、
+必要ならデコードしやすいプロキシ動画（720p H.264・短い GOP）を作るモジュール。
+
+- probe_video: ffprobe で調べる（無ければ OpenCV で分かる範囲を調べる）
+- ingest_video: runs/{video_id}/video_meta.json に保存し、設定に応じて proxies/{video_id}_proxy.mp4 を作る
+- decode_source: 後段（frame_extractor）が読むべき動画と、その動画情報を返す（プロキシがあればプロキシ）
+- plan_extraction / estimate_eta: 動画情報からフレーム抽出の見積もりと、残り時間の目安を出す
+  （目安の係数は過去の実行（catalog.py に記録された所要時間）から学習し、無ければ既定値を使う）
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+import statistics
+import subprocess
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import cv2  # type: ignore
+
+import importlib
+import config_loader
+import paths
+import catalog
+
+importlib.reload(config_loader)
+importlib.reload(paths)
+importlib.reload(catalog)
+
+from config_loader import SETTINGS
+from paths import get_proxy_video_path, get_raw_video_path, get_video_meta_path
+from catalog import stage_history
+
+
+# 残り時間の目安に使う既定の係数（秒 / 単位）。単位は _stage_units を参照
+DEFAULT_STAGE_RATES = {
+    "ingest": 0.003,     # 元動画のメガピクセル・フレーム（プロキシを作る場合）
+    "audio": 0.5,        # 動画の分
+    "frames": 0.003,     # デコードするメガピクセル・フレーム
+    "analysis": 0.5,     # LLM に送るフレーム（並列呼び出し込み）
+    "bestshots": 0.02,   # 抽出フレーム
+    "diary": 15.0,       # 1回
+    "alerts": 0.2,       # 1回
+}
+
+# 係数の学習に使う過去の実行の数（新しい順）
+_RATE_HISTORY = 20
+
+
+# ---------------------------------------------------------------------------
+# 動画情報
+# ---------------------------------------------------------------------------
+
+def _parse_rate(rate: Optional[str]) -> Optional[float]:
+    """ffprobe の "30000/1001" 形式のフレームレートを float にする。"""
+    if not rate:
+        return None
+    try:
+        num, _, den = str(rate).partition("/")
+        value = float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return None
+    return value if value > 0 else None
+
+
+def _probe_ffprobe(path: Path) -> Optional[Dict[str, Any]]:
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-print_format", "json",
+        "-show_format", "-show_streams",
+        str(path),
+    ]
+    try:
+        proc = subprocess.run(cmd, capture_output=True, check=False)
+    except FileNotFoundError:
+        return None
+    if proc.returncode != 0:
+        return None
+
+    data = json.loads(proc.stdout or b"{}")
+    streams = data.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"), None)
+    if video is None:
+        return None
+    fmt = data.get("format", {})
+
+    fps = _parse_rate(video.get("avg_frame_rate")) or _parse_rate(video.get("r_frame_rate"))
+    duration = float(video.get("duration") or fmt.get("duration") or 0.0) or None
+    frame_count = int(video["nb_frames"]) if str(video.get("nb_frames", "")).isdigit() else None
+    if frame_count is None and duration and fps:
+        frame_count = int(round(duration * fps))
+
+    rotation = 0
+    for side in video.get("side_data_list", []):
+        if "rotation" in side:
+            rotation = int(side["rotation"])
+    if not rotation and "rotate" in video.get("tags", {}):
+        rotation = int(video["tags"]["rotate"])
+
+    return {
+        "prober": "ffprobe",
+        "duration_sec": duration,
+        "fps": fps,
+        "frame_count": frame_count,
+        "width": int(video.get("width") or 0),
+        "height": int(video.get("height") or 0),
+        "codec": video.get("codec_name"),
+        "pix_fmt": video.get("pix_fmt"),
+        "bit_rate": int(fmt["bit_rate"]) if str(fmt.get("bit_rate", "")).isdigit() else None,
+        "rotation": rotation,
+        "has_audio": any(s.get("codec_type") == "audio" for s in streams),
+    }
+
+
+def _probe_opencv(path: Path) -> Dict[str, Any]:
+    cap = cv2.VideoCapture(str(path))
+    if not cap.isOpened():
+        raise RuntimeError(f"Cannot open video: {path}")
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or None
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or None
+        fourcc = int(cap.get(cv2.CAP_PROP_FOURCC))
+        codec = "".join(chr((fourcc >> (8 * i)) & 0xFF) for i in range(4)).strip("\x00 ").lower() or None
+        return {
+            "prober": "opencv",
+            "duration_sec": frame_count / fps if frame_count and fps else None,
+            "fps": fps,
+            "frame_count": frame_count,
+            "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            "codec": codec,
+            "pix_fmt": None,
+            "bit_rate": None,
+            "rotation": 0,
+            "has_audio": None,
+        }
+    finally:
+        cap.release()
+
+
+def probe_video(path: Path) -> Dict[str, Any]:
+    """動画の長さ・fps・フレーム数・解像度・コーデックなどを調べる。"""
+    path = Path(path)
+    if not path.exists():
+        raise FileNotFoundError(f"Video not found: {path}")
+    return _probe_ffprobe(path) or _probe_opencv(path)
+
+
+# ---------------------------------------------------------------------------
+# プロキシ動画
+# ---------------------------------------------------------------------------
+
+def proxy_reason(info: Dict[str, Any]) -> Optional[str]:
+    """プロキシを作るべき理由（不要なら None）。"""
+    codec = (info.get("codec") or "").lower()
+    if codec in SETTINGS.ingest_proxy_codecs:
+        return f"codec {codec}"
+    if info.get("height", 0) > SETTINGS.ingest_proxy_max_height:
+        return f"height {info['height']}"
+    return None
+
+
+def make_proxy(src: Path, dst: Path, info: Dict[str, Any]) -> None:
+    """
+    ffmpeg で src をデコードしやすい H.264（max_height 以下・短い GOP・音声なし）に変換する。
+    fps は変えないので、フレーム番号 / fps の時刻は元動画と一致する。
+    """
+    max_height = SETTINGS.ingest_proxy_max_height
+    height = min(int(info.get("height") or 0) or max_height, max_height)
+    gop = max(int(round((info.get("fps") or 30.0) * SETTINGS.ingest_proxy_gop_sec)), 1)
+    tmp = dst.with_name(f".{dst.name}.part.mp4")
+    cmd = [
+        "ffmpeg", "-nostdin", "-v", "error", "-y",
+        "-i", str(src),
+        "-map", "0:v:0", "-an",
+        "-vf", f"scale=-2:{height - height % 2}",
+        "-c:v", "libx264",
+        "-preset", SETTINGS.ingest_proxy_preset,
+        "-crf", str(SETTINGS.ingest_proxy_crf),
+        "-g", str(gop), "-keyint_min", str(gop), "-sc_threshold", "0",
+        "-pix_fmt", "yuv420p",
+        "-movflags", "+faststart",
+        str(tmp),
+    ]
+    try:
+        proc = subprocess.run(cmd, capture_output=True, check=False)
+    except FileNotFoundError as e:
+        raise RuntimeError("ffmpeg が見つかりません。プロキシ作成には ffmpeg が必要です。") from e
+    if proc.returncode != 0:
+        tmp.unlink(missing_ok=True)
+        err = proc.stderr.decode("utf-8", errors="replace")
+        raise RuntimeError(f"ffmpeg proxy transcode failed: {err.strip()}")
+    os.replace(tmp, dst)
+
+
+# ---------------------------------------------------------------------------
+# 取り込み
+# ---------------------------------------------------------------------------
+
+def ingest_video(video_id: str) -> Dict[str, Any]:
+    """
+    元動画を調べて runs/{video_id}/video_meta.json に保存する。
+    ingest.proxy.enabled で、かつ重い動画ならプロキシも作る（失敗したら元動画を使う）。
+    戻り値: 保存した動画情報
+    """
+    raw_path = get_raw_video_path(video_id)
+    info = probe_video(raw_path)
+    st = raw_path.stat()
+    meta: Dict[str, Any] = {
+        "video_id": video_id,
+        "file": raw_path.name,
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "video": info,
+        "proxy": None,
+    }
+
+    proxy_path = get_proxy_video_path(video_id)
+    reason = proxy_reason(info) if SETTINGS.ingest_proxy_enabled else None
+    if reason is not None:
+        try:
+            make_proxy(raw_path, proxy_path, info)
+            meta["proxy"] = {"file": proxy_path.name, "reason": reason, "video": probe_video(proxy_path)}
+        except RuntimeError as e:
+            print(f"[WARN] プロキシを作れなかったので元動画を使います: {e}")
+    if meta["proxy"] is None and proxy_path.exists():
+        proxy_path.unlink()  # 設定を変えた場合などに古いプロキシを使わないように
+
+    get_video_meta_path(video_id).write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+    return meta
+
+
+def load_video_meta(video_id: str) -> Optional[Dict[str, Any]]:
+    """保存済みの動画情報。無いか、元動画が差し替わっていれば None。"""
+    path = get_video_meta_path(video_id)
+    raw_path = get_raw_video_path(video_id)
+    if not path.exists() or not raw_path.exists():
+        return None
+    meta = json.loads(path.read_text(encoding="utf-8"))
+    st = raw_path.stat()
+    if meta.get("size") != st.st_size or meta.get("mtime_ns") != st.st_mtime_ns:
+        return None
+    return meta
+
+
+def decode_source(video_id: str) -> Tuple[Path, Optional[Dict[str, Any]]]:
+    """
+    フレーム抽出で読む動画のパスと、その動画情報を返す。
+    プロキシがあればプロキシ、無ければ元動画（動画情報が未取得なら None）。
+    """
+    meta = load_video_meta(video_id)
+    if meta is None:
+        return get_raw_video_path(video_id), None
+    proxy = meta.get("proxy")
+    if proxy is not None and get_proxy_video_path(video_id).exists():
+        return get_proxy_video_path(video_id), proxy["video"]
+    return get_raw_video_path(video_id), meta["video"]
+
+
+# ---------------------------------------------------------------------------
+# 見積もり
+# ---------------------------------------------------------------------------
+
+def plan_extraction(info: Dict[str, Any], interval_sec: Optional[float] = None) -> Dict[str, Any]:
+    """動画情報から、フレーム抽出で何フレームをデコードし何枚保存するかを見積もる。"""
+    fps = info.get("fps") or 30.0
+    frame_count = info.get("frame_count") or int((info.get("duration_sec") or 0.0) * fps)
+    interval_frames = max(int(round(fps * (interval_sec or SETTINGS.frame_interval_sec))), 1)
+    return {
+        "fps": fps,
+        "decode_frames": frame_count,
+        "decode_mpix_frames": frame_count * info.get("width", 0) * info.get("height", 0) / 1e6,
+        "interval_frames": interval_frames,
+        "sampled_frames": math.ceil(frame_count / interval_frames) if frame_count else 0,
+    }
+
+
+def _stage_units(meta: Dict[str, Any]) -> Dict[str, float]:
+    """ステージごとの仕事量（DEFAULT_STAGE_RATES の単位）。"""
+    raw = meta["video"]
+    decode = meta["proxy"]["video"] if meta.get("proxy") else raw
+    plan = plan_extraction(decode)
+    return {
+        "ingest": plan_extraction(raw)["decode_mpix_frames"] if meta.get("proxy") else 0.0,
+        "audio": (raw.get("duration_sec") or 0.0) / 60.0,
+        "frames": plan["decode_mpix_frames"],
+        "analysis": plan["sampled_frames"],
+        "bestshots": plan["sampled_frames"],
+        "diary": 1.0,
+        "alerts": 1.0,
+    }
+
+
+def learned_stage_rates() -> Dict[str, float]:
+    """
+    過去の実行（カタログの直近 _RATE_HISTORY 回）から、ステージごとの「秒 / 単位」の中央値を求める。
+    キャッシュヒットしたステージは使わない。データが無いステージは既定値。
+    """
+    samples: Dict[str, List[float]] = {}
+    for h in stage_history(_RATE_HISTORY):
+        units = _stage_units(h["meta"])
+        if units.get(h["stage"], 0) > 0:
+            samples.setdefault(h["stage"], []).append(h["elapsed_sec"] / units[h["stage"]])
+
+    rates = dict(DEFAULT_STAGE_RATES)
+    for stage, values in samples.items():
+        rates[stage] = statistics.median(values)
+    return rates
+
+
+def estimate_eta(
+    video_id: str, stages: Sequence[str], video_info: Optional[Dict[str, Any]] = None
+) -> Optional[float]:
+    """
+    stages（これから実行するステージ名）にかかる時間の目安（秒）。
+    取り込み（ingest）前は video_info（ジョブ登録時に probe_video で調べたもの。プロキシは無い扱い）で見積もる。
+    どちらも無ければ None。
+    """
+    meta = load_video_meta(video_id)
+    if meta is None:
+        if video_info is None:
+            return None
+        meta = {"video": video_info, "proxy": None}
+    units = _stage_units(meta)
+    rates = learned_stage_rates()
+    return sum(units.get(s, 0.0) * rates.get(s, 0.0) for s in stages)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="動画情報を調べて保存する（設定に応じてプロキシも作る）")
+    parser.add_argument("video_id")
+    args = parser.parse_args()
+
+    meta = ingest_video(args.video_id)
+    print(json.dumps(meta, ensure_ascii=False, indent=2))
+    print(json.dumps(plan_extraction(decode_source(args.video_id)[1] or meta["video"]), indent=2))
+
+
+if __name__ == "__main__":
+    main()
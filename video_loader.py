@@ -1,19 +1,33 @@
 """
 Colab 上でアップロードされた動画ファイルを所定の場所に保存し、
 video_id を発行するためのモジュール。
+
+動画は CHUNK_SIZE ずつ読みながら書き出し、同時に sha256 を計算する（ファイル全体をメモリに載せない）。
+内容ハッシュ → video_id の対応はカタログ（catalog.py の videos）に記録し、
+同じ中身の動画が再アップロードされたら保存し直さずに既存の video_id（と成果物）を使う。
 """
 
 from __future__ import annotations
 
+import hashlib
+import os
+import shutil
+import uuid
 from datetime import datetime
 from pathlib import Path
-from typing import Optional, Union, IO
+from typing import IO, Optional, Tuple, Union
 
 import importlib
 import paths
+import catalog
 importlib.reload(paths)  # Colab用
+importlib.reload(catalog)
 
 from paths import get_raw_video_path
+from catalog import find_video_by_sha256, register_video
+
+
+CHUNK_SIZE = 8 * 1024 * 1024  # 取り込み時に一度に読む量（メモリ使用量はこれで頭打ちになる）
 
 
 def generate_video_id(prefix: str = "video") -> str:
@@ -24,27 +38,112 @@ def generate_video_id(prefix: str = "video") -> str:
     return f"{now}_{prefix}"
 
 
+def file_sha256(path: Path) -> str:
+    """ファイル内容の sha256（CHUNK_SIZE ずつ読む）。"""
+    h = hashlib.sha256()
+    with Path(path).open("rb") as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _copy_stream(src: IO[bytes], dst_path: Path) -> Tuple[str, int]:
+    """src を dst_path に CHUNK_SIZE ずつコピーし、(sha256, バイト数) を返す。"""
+    h = hashlib.sha256()
+    size = 0
+    with dst_path.open("wb") as out:
+        for block in iter(lambda: src.read(CHUNK_SIZE), b""):
+            h.update(block)
+            out.write(block)
+            size += len(block)
+    return h.hexdigest(), size
+
+
+def _register(digest: str, size: int, video_id: str, dst_path: Path) -> None:
+    register_video(video_id, dst_path.name, digest, size, datetime.now().isoformat(timespec="seconds"))
+
+
+def find_duplicate(digest: str, size: int) -> Optional[str]:
+    """同じ内容の動画が取り込み済みなら、その video_id を返す（元ファイルが消えていれば None）。"""
+    entry = find_video_by_sha256(digest)
+    if entry is None:
+        return None
+    existing = get_raw_video_path(entry["video_id"], suffix=Path(entry["file"]).suffix)
+    if existing.exists() and existing.stat().st_size == size:
+        return entry["video_id"]
+    return None
+
+
 def save_video(
     src: Union[str, Path, IO[bytes]],
     video_id: Optional[str] = None,
     suffix: str = ".mp4",
+    dedupe: bool = True,
 ) -> str:
     """
     src: もとの動画ファイルパス、もしくは file-like object (binaries)
-    戻り値: video_id
+    dedupe: True なら、同じ内容の動画が取り込み済みのときは保存せずにその video_id を返す
+    戻り値: video_id（dedupe で既存のものに置き換わることがある）
     """
     if video_id is None:
         video_id = generate_video_id()
 
     dst_path = get_raw_video_path(video_id, suffix=suffix)
+    # いったん隠しファイルに書き、ハッシュを確かめてから置き換える（途中で失敗しても既存の動画を壊さない）
+    tmp_path = dst_path.with_name(f".{dst_path.name}.{uuid.uuid4().hex}.part")
+
+    try:
+        # src がパスか file-like かで分岐
+        if isinstance(src, (str, Path)):
+            with Path(src).open("rb") as f:
+                digest, size = _copy_stream(f, tmp_path)
+        else:
+            # file-like
+            if hasattr(src, "seek"):
+                src.seek(0)
+            digest, size = _copy_stream(src, tmp_path)
+
+        existing_id = find_duplicate(digest, size)
+        if existing_id == video_id or (dedupe and existing_id is not None):
+            # 同じ中身が保存済み。書き直すと mtime が変わってパイプラインの再ハッシュになるので何もしない
+            if existing_id != video_id:
+                print(f"[INFO] Same video already imported as {existing_id}; reusing it")
+            return existing_id
+
+        os.replace(tmp_path, dst_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+    _register(digest, size, video_id, dst_path)
+    return video_id
+
+
+def import_video(src: Union[str, Path], video_id: str) -> str:
+    """
+    手元の動画ファイルを raw_videos/{video_id}.mp4 として取り込む（バッチ処理用）。
+    先に内容ハッシュを取り、同じ内容の動画が取り込み済みならコピーせずにその video_id を返す
+    （別の名前・フォルダの同じ映像や、同じファイルの再実行で処理し直さないように。save_video と同じ）。
+    大きなファイルを複製しないよう、同じファイルシステムならハードリンクにする。
+    新しく取り込んだ動画は内容ハッシュをカタログに登録する（後で同じ動画をアップロードすると再利用される）。
+    戻り値: 使う video_id（取り込み済みの動画と同じ内容なら、そちらの video_id）
+    """
+    src_path = Path(src)
+    digest = file_sha256(src_path)
+    size = src_path.stat().st_size
 
-    # src がパスか file-like かで分岐
-    if isinstance(src, (str, Path)):
-        src_path = Path(src)
-        dst_path.write_bytes(src_path.read_bytes())
-    else:
-        # file-like
-        data = src.read()
-        dst_path.write_bytes(data)
+    existing_id = find_duplicate(digest, size)
+    if existing_id is not None:
+        if existing_id != video_id:
+            print(f"[INFO] Same video already imported as {existing_id}; reusing it ({src_path})")
+        return existing_id
 
+    dst_path = get_raw_video_path(video_id)
+    if dst_path.exists():
+        dst_path.unlink()  # 同じ video_id で中身の違う動画（差し替え）
+    try:
+        os.link(src_path, dst_path)
+    except OSError:
+        shutil.copy2(src_path, dst_path)
+    _register(digest, size, video_id, dst_path)
     return video_id
@@ -7,8 +7,10 @@ FrameAnalysis の JSONL を出力するモジュール。
 from __future__ import annotations
 
 import json
+import time
 import base64
-from typing import List, Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Sequence, Tuple
 
 import importlib
 import paths
@@ -17,6 +19,11 @@ import jsonl_io
 import config_loader
 import model_loader
 import vision_caption_prompt  # ★ ここからプロンプトを読み込む
+import candidate_ranker
+import instrumentation
+import frame_store
+import caption_search
+import vision_output
 
 importlib.reload(paths)
 importlib.reload(schemas)
@@ -24,25 +31,98 @@ importlib.reload(jsonl_io)
 importlib.reload(config_loader)
 importlib.reload(model_loader)
 importlib.reload(vision_caption_prompt)
+importlib.reload(candidate_ranker)
+importlib.reload(instrumentation)
+importlib.reload(frame_store)
+importlib.reload(caption_search)
+importlib.reload(vision_output)
 
-from paths import get_manifest_path, get_analysis_path
+from paths import get_manifest_path, get_analysis_path, get_candidate_report_path
 from schemas import FrameMeta, FrameAnalysis
 from jsonl_io import read_jsonl_as_dataclasses, write_jsonl
 from config_loader import SETTINGS
-from model_loader import load_model_for_role
-from vision_caption_prompt import build_vision_caption_prompt
+from model_loader import api_slot, load_model_for_role
+from vision_caption_prompt import PromptTemplate, get_vision_prompt
+from candidate_ranker import default_candidate_count, rank_candidates
+from instrumentation import bind_stage, count, record_usage
+from frame_store import read_frame_bytes
+from caption_search import index_analyses
+from vision_output import (
+    VISION_FIELDS,
+    build_reask_text,
+    gemini_schema,
+    json_schema,
+    merge_vision_results,
+    parse_vision_output,
+    validate_vision_result,
+)
+
+try:
+    from google.genai import types as genai_types  # pip install -q -U google-genai
+except ImportError:
+    genai_types = None  # 後でエラーメッセージに使う
 
 
 def _encode_image_base64(image_path: str) -> str:
-    """画像ファイルを base64 文字列に変換するヘルパー。"""
-    with open(image_path, "rb") as f:
-        return base64.b64encode(f.read()).decode("utf-8")
+    """画像ファイル（フレームのパックの中でもよい）を base64 文字列に変換するヘルパー。"""
+    return base64.b64encode(read_frame_bytes(image_path)).decode("utf-8")
 
 
-def _call_vision_model(model_info: Dict[str, Any], image_path: str, prompt: str) -> dict:
+# 構造化出力の指定方法（models.yaml の structured_output）。使えないと言われたら次の方法に下げる
+_STRUCTURED_MODES = ("json_schema", "json_object", "none")
+_STRUCTURED_FALLBACK: Dict[str, str] = {}   # model_name -> 実際に使う方法（下げたもの）
+
+
+def _structured_mode(model_info: Dict[str, Any]) -> str:
+    mode = str((model_info.get("config") or {}).get("structured_output", "json_schema"))
+    if mode not in _STRUCTURED_MODES:
+        raise ValueError(f"Unsupported structured_output: {mode} (choose from {', '.join(_STRUCTURED_MODES)})")
+    return _STRUCTURED_FALLBACK.get(model_info["model_name"], mode)
+
+
+def _response_format(mode: str, fields: Sequence[str]) -> Optional[Dict[str, Any]]:
+    if mode == "json_schema":
+        return {"type": "json_schema", "json_schema": {"name": "frame_analysis", "schema": json_schema(fields)}}
+    if mode == "json_object":
+        return {"type": "json_object"}
+    return None
+
+
+_STRUCTURED_ERROR_WORDS = ("response_format", "json_schema", "json_object", "structured")
+
+
+def _is_rejected_request(e: Exception) -> bool:
+    """
+    構造化出力の指定を受け付けなかったエラーか（400 / 422 で、エラー本文が response_format などに触れているもの）。
+    画像が大きすぎる・トークン超過などの別の 400 では方法を下げない（下げたまま残ってしまうため）。
+    """
+    if getattr(e, "status_code", None) not in (400, 422):
+        return False
+    detail = f"{e} {getattr(e, 'body', '') or ''}".lower()
+    return any(w in detail for w in _STRUCTURED_ERROR_WORDS)
+
+
+def _image_mime(image_path: str) -> str:
+    # 拡張子から MIME をざっくり判定（PNG 以外は JPEG 扱い）
+    return "image/png" if image_path.lower().endswith(".png") else "image/jpeg"
+
+
+def _call_vision_model(
+    model_info: Dict[str, Any],
+    image_path: str,
+    prompt: PromptTemplate,
+    followup: Optional[Tuple[str, str]] = None,
+    fields: Sequence[str] = VISION_FIELDS,
+) -> Tuple[str, Dict[str, int]]:
     """
     Vision モデル（SambaNova Llama-4-Maverick-17B-128E-Instruct など）を呼び出す。
     config/models.yaml の vision_caption セクションの設定に従って動作する。
+
+    メッセージは「system: 共通の指示 → user: 画像 → 短い依頼」の順に組む。
+    先頭の指示は全フレームで同じ文字列なので、プレフィックスキャッシュのあるサーバーでは2枚目以降その部分が再利用される。
+    followup: (直前のモデルの出力, 聞き直しの依頼文)。会話の続きとして送り、fields のキーだけを出させる
+    構造化出力（structured_output）が使えるバックエンドでは fields のスキーマを指定する。
+    戻り値: (モデルの出力テキスト, トークン数（instrumentation.record_usage の戻り値）)
     """
     backend = model_info["backend"]
 
@@ -53,33 +133,52 @@ def _call_vision_model(model_info: Dict[str, Any], image_path: str, prompt: str)
 
         # 画像を base64 化
         image_b64 = _encode_image_base64(image_path)
-
-        # 拡張子から MIME をざっくり判定（PNG 以外は JPEG 扱い）
-        if image_path.lower().endswith(".png"):
-            mime = "image/png"
-        else:
-            mime = "image/jpeg"
-
-        # Vision + Text のマルチモーダル入力
-        response = client.chat.completions.create(
-            model=model_name,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:{mime};base64,{image_b64}"
-                            },
+        mime = _image_mime(image_path)
+
+        # Vision + Text のマルチモーダル入力（フレームごとに変わる画像は共通の指示の後ろに置く）
+        messages: List[Dict[str, Any]] = [
+            {"role": "system", "content": prompt.system},
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:{mime};base64,{image_b64}"
                         },
-                    ],
-                }
-            ],
-            temperature=0.2,
-            top_p=0.9,
-        )
+                    },
+                ] + ([{"type": "text", "text": prompt.user}] if prompt.user else []),
+            },
+        ]
+        if followup is not None:
+            messages += [
+                {"role": "assistant", "content": followup[0]},
+                {"role": "user", "content": followup[1]},
+            ]
+
+        while True:
+            mode = _structured_mode(model_info)
+            extra: Dict[str, Any] = {}
+            response_format = _response_format(mode, fields)
+            if response_format is not None:
+                extra["response_format"] = response_format
+            try:
+                response = client.chat.completions.create(
+                    model=model_name,
+                    messages=messages,
+                    temperature=0.2,
+                    top_p=0.9,
+                    **extra,
+                )
+                break
+            except Exception as e:
+                if response_format is None or not _is_rejected_request(e):
+                    raise
+                fallback = _STRUCTURED_MODES[_STRUCTURED_MODES.index(mode) + 1]
+                print(f"[WARN] {model_name} rejected response_format {mode}, falling back to {fallback}: {e}")
+                _STRUCTURED_FALLBACK[model_name] = fallback
+                count("retries")
+        usage = record_usage(response)
 
         content = response.choices[0].message.content
 
@@ -92,33 +191,51 @@ def _call_vision_model(model_info: Dict[str, Any], image_path: str, prompt: str)
                     texts.append(part.get("text", ""))
             text = "".join(texts)
         else:
-            text = str(content)
+            text = str(content or "")
+        return text, usage
 
-        try:
-            return json.loads(text)
-        except json.JSONDecodeError:
-            # JSON になっていなかった場合でも、とりあえず caption にそのまま入れて返す
-            return {
-                "caption": text.strip(),
-                "tags": [],
-                "scores": {},
-                "has_child": False,
-                "num_children": 0,
-                "main_subject": "",
-                "bbox": None,
-            }
+    # -------- Gemini バックエンド --------
+    elif backend == "gemini":
+        if genai_types is None:
+            raise ImportError("google-genai がインストールされていません。")
+        client = model_info["client"]
+        mode = _structured_mode(model_info)
+
+        contents: List[Any] = [
+            genai_types.Content(
+                role="user",
+                parts=[
+                    genai_types.Part.from_bytes(data=read_frame_bytes(image_path), mime_type=_image_mime(image_path)),
+                ] + ([genai_types.Part.from_text(text=prompt.user)] if prompt.user else []),
+            )
+        ]
+        if followup is not None:
+            contents += [
+                genai_types.Content(role="model", parts=[genai_types.Part.from_text(text=followup[0])]),
+                genai_types.Content(role="user", parts=[genai_types.Part.from_text(text=followup[1])]),
+            ]
+        config = genai_types.GenerateContentConfig(
+            system_instruction=prompt.system,
+            temperature=0.2,
+            top_p=0.9,
+            response_mime_type="application/json" if mode != "none" else None,
+            response_schema=gemini_schema(fields) if mode == "json_schema" else None,
+        )
+        resp = client.models.generate_content(model=model_info["model_name"], contents=contents, config=config)
+        return resp.text or "", record_usage(resp)
 
     # -------- テスト用ダミー実装 --------
     elif backend == "dummy":
-        return {
+        result = {
             "caption": "ダミー: 子どもが室内で遊んでいる様子です。",
             "tags": ["ダミー", "子ども"],
-            "scores": {"cuteness": 0.5, "representative": 0.5},
+            "scores": {"cuteness": 0.5, "interesting": 0.5, "representative": 0.5},
             "has_child": True,
             "num_children": 1,
             "main_subject": "子ども",
             "bbox": [0.3, 0.3, 0.6, 0.8],
         }
+        return json.dumps({k: result[k] for k in fields}, ensure_ascii=False), {}
 
     else:
         raise NotImplementedError(f"Unsupported backend for vision: {backend}")
@@ -162,99 +279,212 @@ def _build_flags(
     flags["center_position"] = grid_label in center_cells if grid_label else False
     return flags
 
-def run_captioning(video_id: str) -> List[FrameAnalysis]:
+
+def _timed_call(
+    model_info: Dict[str, Any],
+    fm: FrameMeta,
+    prompt: PromptTemplate,
+    followup: Optional[Tuple[str, str]] = None,
+    fields: Sequence[str] = VISION_FIELDS,
+) -> Tuple[str, Dict[str, int], float]:
+    with api_slot(model_info.get("role", "vision_caption")) as attrs:
+        attrs["prompt_version"] = prompt.version
+        if followup is not None:
+            attrs["reask"] = list(fields)
+        started = time.perf_counter()
+        text, usage = _call_vision_model(model_info, fm.frame_path, prompt, followup=followup, fields=fields)
+        return text, usage, time.perf_counter() - started
+
+
+def _ask_vision(
+    model_info: Dict[str, Any], fm: FrameMeta, prompt: PromptTemplate
+) -> Tuple[Dict[str, Any], Dict[str, Any], Dict[str, Any]]:
+    """
+    Vision モデルに聞いて、検証済みの結果を返す。
+    出力が崩れていれば vision_output.parse_vision_output で拾い、それでも欠けた項目だけを
+    captioning.max_reasks 回まで聞き直す（聞き直しは retries に数える）。
+    戻り値: (結果, extra["llm_usage"] に残す値, extra["vision_parse"] に残す値)
+    """
+    text, usage, latency = _timed_call(model_info, fm, prompt)
+    raw, salvaged = parse_vision_output(text)
+    result, missing = validate_vision_result(raw or {})
+    if salvaged:
+        count("vision_salvaged")
+
+    reasked: List[str] = []
+    reask_calls = 0
+    for _ in range(max(SETTINGS.captioning_max_reasks, 0)):
+        if not missing:
+            break
+        count("retries")
+        reask_calls += 1
+        more_text, more_usage, more_latency = _timed_call(
+            model_info, fm, prompt, followup=(text, build_reask_text(missing)), fields=missing
+        )
+        latency += more_latency
+        for k, v in more_usage.items():
+            usage[k] = usage.get(k, 0) + v
+        more, _ = parse_vision_output(more_text)
+        reasked += [f for f in missing if f not in reasked]
+        result, missing = validate_vision_result(merge_vision_results(result, more or {}, missing))
+
+    if missing:
+        count("vision_incomplete")
+        print(f"[WARN] Vision result for {fm.frame_path} is missing: {', '.join(missing)}")
+        if "caption" in missing and raw is None:
+            # JSON が読めなかった場合でも、とりあえず出力を caption にそのまま入れる
+            result["caption"] = text.strip()
+
+    llm_usage = {
+        "prompt_version": prompt.version,
+        "template_tokens": prompt.tokens,
+        "latency_sec": round(latency, 4),
+        "reasks": reask_calls,
+        **usage,
+    }
+    parse_info = {"salvaged": salvaged, "reasked": reasked, "missing": missing}
+    return result, llm_usage, parse_info
+
+
+def analyze_frame(model_info: Dict[str, Any], fm: FrameMeta, prompt: PromptTemplate) -> FrameAnalysis:
+    """
+    フレーム1枚を Vision モデルで解析し、FrameAnalysis を返す。
+    run_captioning（バッチ）と live_monitor（逐次）の両方から使う。
+    プロンプトの版・トークン数・応答時間を extra["llm_usage"] に残す（prompt_registry.py report で版ごとに集計できる）。
+    出力の手直し・聞き直しの記録は extra["vision_parse"] に残す。
+    """
+    result, llm_usage, parse_info = _ask_vision(model_info, fm, prompt)
+
+    caption: str = result.get("caption", "")
+    tags = result.get("tags") or []
+    scores = result.get("scores") or {}
+
+    has_child: bool = bool(result.get("has_child", False))
+    num_children: int = int(result.get("num_children", 0))
+    main_subject: str = result.get("main_subject", "") or ""
+
+    bbox_raw = result.get("bbox")
+    bbox: Optional[List[float]] = None
+    grid_row: Optional[int] = None
+    grid_col: Optional[int] = None
+    grid_label: Optional[str] = None
+
+    if isinstance(bbox_raw, (list, tuple)) and len(bbox_raw) >= 4:
+        try:
+            bbox = [float(x) for x in bbox_raw[:4]]
+            grid_row, grid_col, grid_label = bbox_to_grid(bbox)
+        except Exception as e:
+            print(f"[WARN] bbox_to_grid failed for frame {fm.frame_path}: {e}")
+            bbox = None
+            grid_row = grid_col = None
+            grid_label = None
+
+    flags = _build_flags(has_child, num_children, grid_label)
+
+    fa = FrameAnalysis(
+        video_id=fm.video_id,
+        frame_index=fm.frame_index,
+        time_sec=fm.time_sec,
+        frame_path=fm.frame_path,
+        caption=caption,
+        tags=tags,
+        scores=scores,
+        is_blurry=fm.is_blurry,
+        is_too_dark=fm.is_too_dark,
+        brightness=fm.brightness,
+        sharpness=fm.sharpness,
+    )
+
+    if hasattr(fa, "has_child"):
+        setattr(fa, "has_child", has_child)
+    if hasattr(fa, "num_children"):
+        setattr(fa, "num_children", num_children)
+    if hasattr(fa, "main_subject"):
+        setattr(fa, "main_subject", main_subject)
+    if hasattr(fa, "bbox"):
+        setattr(fa, "bbox", bbox)
+    if hasattr(fa, "grid_row"):
+        setattr(fa, "grid_row", grid_row)
+    if hasattr(fa, "grid_col"):
+        setattr(fa, "grid_col", grid_col)
+    if hasattr(fa, "grid_label"):
+        setattr(fa, "grid_label", grid_label)
+    if hasattr(fa, "flags"):
+        setattr(fa, "flags", flags)
+
+    if hasattr(fa, "extra"):
+        current_extra = getattr(fa, "extra") or {}
+        if not isinstance(current_extra, dict):
+            current_extra = {}
+        current_extra.update(
+            {
+                "raw_vision_result": result,
+                "llm_usage": llm_usage,
+                "vision_parse": parse_info,
+                "grid_info": {
+                    "bbox": bbox,
+                    "grid_row": grid_row,
+                    "grid_col": grid_col,
+                    "grid_label": grid_label,
+                },
+            }
+        )
+        setattr(fa, "extra", current_extra)
+
+    return fa
+
+
+def run_captioning(video_id: str, mode: Optional[str] = None) -> List[FrameAnalysis]:
     """
     1. manifests/{video_id}_frames_manifest.jsonl を読む
     2. Vision LLM に投げて FrameAnalysis を作る
-    3. analysis/{video_id}_analysis.jsonl に保存
+    3. analysis/{video_id}_analysis.jsonl に保存し、全文検索（caption_search）の索引を入れ替える
+
+    mode（省略時は SETTINGS.captioning_mode）:
+      - "all": 全フレームを解析
+      - "candidates": candidate_ranker のローカル指標で絞った候補だけを解析する（ベストショット用）。
+        節約した LLM 呼び出し数を analysis/{video_id}_candidates.json に記録する。
     """
+    mode = mode or SETTINGS.captioning_mode
     manifest_path = get_manifest_path(video_id)
     frames: List[FrameMeta] = read_jsonl_as_dataclasses(manifest_path, FrameMeta)
     if not frames:
         print(f"No frames found in manifest: {manifest_path}")
         return []
 
-    model_info = load_model_for_role("vision_caption")
-    base_prompt = build_vision_caption_prompt()
-
-    analyses: List[FrameAnalysis] = []
-
-    for fm in frames:
-        result: Dict[str, Any] = _call_vision_model(model_info, fm.frame_path, base_prompt)
-
-        caption: str = result.get("caption", "")
-        tags = result.get("tags") or []
-        scores = result.get("scores") or {}
-
-        has_child: bool = bool(result.get("has_child", False))
-        num_children: int = int(result.get("num_children", 0))
-        main_subject: str = result.get("main_subject", "") or ""
-
-        bbox_raw = result.get("bbox")
-        bbox: Optional[List[float]] = None
-        grid_row: Optional[int] = None
-        grid_col: Optional[int] = None
-        grid_label: Optional[str] = None
-
-        if isinstance(bbox_raw, (list, tuple)) and len(bbox_raw) >= 4:
-            try:
-                bbox = [float(x) for x in bbox_raw[:4]]
-                grid_row, grid_col, grid_label = bbox_to_grid(bbox)
-            except Exception as e:
-                print(f"[WARN] bbox_to_grid failed for frame {fm.frame_path}: {e}")
-                bbox = None
-                grid_row = grid_col = None
-                grid_label = None
-
-        flags = _build_flags(has_child, num_children, grid_label)
-
-        fa = FrameAnalysis(
-            video_id=fm.video_id,
-            frame_index=fm.frame_index,
-            time_sec=fm.time_sec,
-            frame_path=fm.frame_path,
-            caption=caption,
-            tags=tags,
-            scores=scores,
+    if mode == "candidates":
+        total = len(frames)
+        requested = default_candidate_count()
+        frames = rank_candidates(frames, requested)
+        if len(frames) < min(requested, total):
+            print(f"[WARN] Only {len(frames)} of {requested} candidate frames passed the spacing rule ({video_id})")
+        report = {
+            "video_id": video_id,
+            "total_frames": total,
+            "requested_candidates": requested,
+            "llm_calls": len(frames),
+            "llm_calls_saved": total - len(frames),
+            "candidate_frame_indices": [f.frame_index for f in frames],
+        }
+        get_candidate_report_path(video_id).write_text(
+            json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8"
         )
+        print(f"Captioning {len(frames)}/{total} candidate frames (saved {total - len(frames)} calls)")
+    elif mode != "all":
+        raise ValueError(f"Unsupported captioning mode: {mode}")
 
-        if hasattr(fa, "has_child"):
-            setattr(fa, "has_child", has_child)
-        if hasattr(fa, "num_children"):
-            setattr(fa, "num_children", num_children)
-        if hasattr(fa, "main_subject"):
-            setattr(fa, "main_subject", main_subject)
-        if hasattr(fa, "bbox"):
-            setattr(fa, "bbox", bbox)
-        if hasattr(fa, "grid_row"):
-            setattr(fa, "grid_row", grid_row)
-        if hasattr(fa, "grid_col"):
-            setattr(fa, "grid_col", grid_col)
-        if hasattr(fa, "grid_label"):
-            setattr(fa, "grid_label", grid_label)
-        if hasattr(fa, "flags"):
-            setattr(fa, "flags", flags)
-
-        if hasattr(fa, "extra"):
-            current_extra = getattr(fa, "extra") or {}
-            if not isinstance(current_extra, dict):
-                current_extra = {}
-            current_extra.update(
-                {
-                    "raw_vision_result": result,
-                    "grid_info": {
-                        "bbox": bbox,
-                        "grid_row": grid_row,
-                        "grid_col": grid_col,
-                        "grid_label": grid_label,
-                    },
-                }
-            )
-            setattr(fa, "extra", current_extra)
+    model_info = load_model_for_role("vision_caption")
+    prompt = get_vision_prompt()
 
-        analyses.append(fa)
+    # API 待ちが大半なのでスレッドで並列に投げる（全体の同時数は model_loader.api_slot で制限される）
+    with ThreadPoolExecutor(max_workers=max(SETTINGS.captioning_max_workers, 1)) as pool:
+        analyses: List[FrameAnalysis] = list(
+            pool.map(bind_stage(lambda fm: analyze_frame(model_info, fm, prompt)), frames)
+        )
 
+    count("frames_processed", len(analyses))
     out_path = get_analysis_path(video_id)
     write_jsonl(out_path, analyses)
+    index_analyses(video_id, analyses)
     return analyses
 
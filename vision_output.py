@@ -0,0 +1,244 @@
+"""
+Vision モデルの出力（フレーム1枚の解析結果の JSON）の読み取り・検証と、欠けた項目だけの聞き直し。
+
+- json_schema / gemini_schema: 構造化出力（OpenAI 互換の response_format / Gemini の response_schema）に渡すスキーマ
+- parse_vision_output: まず json.loads、だめなら ```json の囲みを外し、最初の釣り合った {...} を取り出し、
+  末尾の余分なカンマを消してから読み直す（LLM をもう一度呼ばずに済む分はここで拾う）
+- validate_vision_result: FrameAnalysis に入れる項目ごとに型・範囲をそろえ、使えなかった項目名を返す
+- build_reask_text: 欠けた項目だけを出し直させる依頼文（vision_captioner が会話の続きとして送る）
+"""
+
+from __future__ import annotations
+
+import json
+import math
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+
+VISION_FIELDS = ("caption", "tags", "scores", "has_child", "num_children", "main_subject", "bbox")
+SCORE_KEYS = ("cuteness", "interesting", "representative")
+
+_FIELD_SCHEMAS: Dict[str, Dict[str, Any]] = {
+    "caption": {"type": "string"},
+    "tags": {"type": "array", "items": {"type": "string"}},
+    "scores": {
+        "type": "object",
+        "properties": {k: {"type": "number", "minimum": 0.0, "maximum": 1.0} for k in SCORE_KEYS},
+        "required": list(SCORE_KEYS),
+    },
+    "has_child": {"type": "boolean"},
+    "num_children": {"type": "integer", "minimum": 0},
+    "main_subject": {"type": "string"},
+    "bbox": {"type": "array", "items": {"type": "number"}, "minItems": 4, "maxItems": 4},
+}
+
+# 聞き直すときに添える各項目の短い説明
+_FIELD_HINTS = {
+    "caption": '"caption": 誰がどこで何をしているかを1文で',
+    "tags": '"tags": 場所・活動・対象・表情の短い語の配列',
+    "scores": '"scores": {"cuteness", "interesting", "representative"} をそれぞれ 0.0〜1.0 の数値で',
+    "has_child": '"has_child": 子どもが写っていれば true',
+    "num_children": '"num_children": 写っている子どもの人数（0以上の整数）',
+    "main_subject": '"main_subject": 主な被写体を短く',
+    "bbox": '"bbox": 主な子ども1人の [x_min, y_min, x_max, y_max]（0〜1。いなければ [0,0,0,0]）',
+}
+
+_FENCE = re.compile(r"```(?:json|JSON)?\s*(.*?)(?:```|$)", re.DOTALL)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+
+# ---------------------------------------------------------------------------
+# スキーマ
+# ---------------------------------------------------------------------------
+
+def json_schema(fields: Sequence[str] = VISION_FIELDS) -> Dict[str, Any]:
+    """fields だけを必須のキーに持つオブジェクトの JSON Schema。"""
+    return {
+        "type": "object",
+        "properties": {f: _FIELD_SCHEMAS[f] for f in fields},
+        "required": list(fields),
+        "additionalProperties": False,
+    }
+
+
+def _to_gemini(schema: Dict[str, Any]) -> Dict[str, Any]:
+    out: Dict[str, Any] = {}
+    for key, value in schema.items():
+        if key == "additionalProperties":
+            continue  # Gemini のスキーマには無い
+        if key == "type":
+            out[key] = str(value).upper()
+        elif key == "properties":
+            out[key] = {k: _to_gemini(v) for k, v in value.items()}
+        elif key == "items":
+            out[key] = _to_gemini(value)
+        else:
+            out[key] = value
+    return out
+
+
+def gemini_schema(fields: Sequence[str] = VISION_FIELDS) -> Dict[str, Any]:
+    """json_schema を Gemini の response_schema の形（型名は大文字）にしたもの。"""
+    return _to_gemini(json_schema(fields))
+
+
+# ---------------------------------------------------------------------------
+# 読み取り
+# ---------------------------------------------------------------------------
+
+def _first_balanced_object(text: str) -> Optional[str]:
+    """最初の '{' から、括弧が釣り合うところまで（文字列の中の括弧は数えない）。釣り合わなければ None。"""
+    start = text.find("{")
+    if start < 0:
+        return None
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif c == "\\":
+                escaped = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return None
+
+
+def parse_vision_output(text: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """
+    モデルの出力テキストを dict にする。
+    戻り値: (dict（読めなければ None）, 手直しして読んだか)
+    """
+    try:
+        obj = json.loads(text)
+        return (obj, False) if isinstance(obj, dict) else (None, False)
+    except json.JSONDecodeError:
+        pass
+
+    fenced = _FENCE.search(text)
+    body = fenced.group(1) if fenced else text
+    candidate = _first_balanced_object(body)
+    if candidate is None:
+        return None, False
+    for attempt in (candidate, _TRAILING_COMMA.sub(r"\1", candidate)):
+        try:
+            obj = json.loads(attempt)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(obj, dict):
+            return obj, True
+    return None, False
+
+
+# ---------------------------------------------------------------------------
+# 検証
+# ---------------------------------------------------------------------------
+
+def _as_float(value: Any) -> Optional[float]:
+    if isinstance(value, bool):
+        return None
+    try:
+        x = float(value)
+    except (TypeError, ValueError):
+        return None
+    return x if math.isfinite(x) else None   # inf / nan は読めなかった扱い（int(inf) は OverflowError）
+
+
+def _as_bool(value: Any) -> Optional[bool]:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.strip().lower() in ("true", "false"):
+        return value.strip().lower() == "true"
+    return None
+
+
+def _clamp01(x: float) -> float:
+    return min(1.0, max(0.0, x))
+
+
+def validate_vision_result(obj: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    VISION_FIELDS の各項目を FrameAnalysis に入れられる型にそろえる。
+    - scores は 0〜1 に丸め、3つのうち読めたものだけ残す（1つでも欠けていれば "scores" を欠けた項目に入れる）
+    - bbox は子どもが写っていないときは無くてよい（None にする）
+    戻り値: (そろえた dict（使えた項目だけ）, 欠けた・使えなかった項目名のリスト)
+    """
+    out: Dict[str, Any] = {}
+
+    caption = obj.get("caption")
+    if isinstance(caption, str) and caption.strip():
+        out["caption"] = caption.strip()
+
+    tags = obj.get("tags")
+    if isinstance(tags, str):
+        tags = re.split(r"[,、]", tags)
+    if isinstance(tags, list):
+        out["tags"] = [str(t).strip() for t in tags if str(t).strip()]
+
+    scores = obj.get("scores")
+    if isinstance(scores, dict):
+        parsed = {k: _as_float(scores.get(k)) for k in SCORE_KEYS}
+        out["scores"] = {k: round(_clamp01(v), 4) for k, v in parsed.items() if v is not None}
+
+    has_child = _as_bool(obj.get("has_child"))
+    if has_child is not None:
+        out["has_child"] = has_child
+
+    num_children = _as_float(obj.get("num_children"))
+    if num_children is not None and num_children >= 0:
+        out["num_children"] = int(num_children)
+
+    main_subject = obj.get("main_subject")
+    if isinstance(main_subject, str):
+        out["main_subject"] = main_subject.strip()
+
+    bbox = obj.get("bbox")
+    if isinstance(bbox, (list, tuple)) and len(bbox) >= 4:
+        coords = [_as_float(v) for v in bbox[:4]]
+        if all(c is not None for c in coords):
+            x0, y0, x1, y1 = (_clamp01(c) for c in coords)
+            out["bbox"] = [min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)]
+    if "bbox" not in out and out.get("has_child") is False:
+        out["bbox"] = None
+
+    missing = [
+        f for f in VISION_FIELDS
+        if f not in out or (f == "scores" and len(out["scores"]) < len(SCORE_KEYS))
+    ]
+    return out, missing
+
+
+def merge_vision_results(base: Dict[str, Any], update: Dict[str, Any], fields: Sequence[str]) -> Dict[str, Any]:
+    """聞き直しの結果（update）の fields だけを base に重ねる（scores は読めたキーを足し合わせる）。"""
+    merged = dict(base)
+    for f in fields:
+        if f not in update:
+            continue
+        if f == "scores" and isinstance(update[f], dict):
+            merged[f] = {**(base.get(f) or {}), **update[f]}
+        else:
+            merged[f] = update[f]
+    return merged
+
+
+def build_reask_text(missing: Sequence[str]) -> str:
+    """欠けた項目だけを出し直させる依頼文。"""
+    hints = "\n".join(f"- {_FIELD_HINTS[f]}" for f in missing)
+    return (
+        "直前の出力では次の項目が欠けているか、形式が正しくありませんでした。"
+        "同じ写真について、これらのキーだけを含むJSONオブジェクトを1つだけ出力してください。\n"
+        f"{hints}"
+    )